@@ -1,15 +1,66 @@
-from flask import Flask, jsonify, request
+import codecs
+import json
+import time
+from datetime import datetime
+
+from flask import Flask, Response, g, jsonify, request
 from flask_restful import Api, Resource
 import psycopg2
-from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
+from bulk_orders import import_orders, stream_export
+from catalog import catalog
+from category_tree import ancestors, category_node, root_categories, subtree, subtree_products
+from customer_spend import customer_spend, top_customers
 from database import Database
 from config import Config
+from idempotency import IDEMPOTENCY_HEADER, idempotent, replay_headers, valid_key
+from inventory import (
+    ORDER_STATUSES, ReservationError, reserve_item, reserve_items, validate_item, validate_lines,
+    validate_order_id
+)
+from metrics import REQUEST_LATENCY, RESPONSES, metrics_response
+from order_details import details_to_json, fetch_order_details
+from order_reads import read_order, read_order_items, read_product_stock
+from response_cache import ResponseCache
 
 app = Flask(__name__)
 app.config.from_object(Config)
 api = Api(app)
 
+read_cache = ResponseCache(Config.READ_CACHE_SIZE, Config.READ_CACHE_TTL)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+    if 'request_started' in g:
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - g.request_started)
+    result = 'ok'
+    if response.status_code >= 400:
+        body = response.get_json(silent=True)
+        result = body.get('error', 'error') if isinstance(body, dict) else 'error'
+    RESPONSES.labels(endpoint, str(response.status_code), result).inc()
+    return response
+
+def idempotency_key():
+    """Значение заголовка Idempotency-Key или None; ValueError, если оно некорректно"""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is not None and not valid_key(key):
+        raise ValueError(f'{IDEMPOTENCY_HEADER} must be 1-255 characters long')
+    return key
+
+def database_error_response(e):
+    """Ответ API на ошибку БД, оставшуюся после повторов транзакции"""
+    if e.pgcode in ('55P03', '57014'):
+        # Превышены lock_timeout / statement_timeout - запрос можно повторить позже
+        return {'error': 'Database is busy, try again later'}, 503
+    if e.pgcode is None:
+        return {'error': 'Database connection failed'}, 500
+    return {'error': 'Database operation failed'}, 500
+
 class AddToOrderService(Resource):
     def post(self):
         """
@@ -20,12 +71,14 @@ class AddToOrderService(Resource):
             "product_id": 3,
             "quantity": 1
         }
+        С заголовком Idempotency-Key повтор запроса возвращает сохраненный ответ
         """
-        conn = None
-        cursor = None
-        
         try:
             data = request.get_json()
+            try:
+                key = idempotency_key()
+            except ValueError as e:
+                return {'error': str(e)}, 400
             
             # Валидация входных данных
             if not data:
@@ -40,152 +93,435 @@ class AddToOrderService(Resource):
             product_id = data['product_id']
             quantity = data['quantity']
             
-            # Проверка валидности quantity
-            if not isinstance(quantity, int) or quantity <= 0:
-                return {'error': 'Quantity must be a positive integer'}, 400
+            error = validate_item(order_id, product_id, quantity)
+            if error:
+                return {'error': error}, 400
             
-            # Получаем соединение с базой данных
-            conn = Database.get_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            # Несуществующий товар отсекается по кэшу справочника, без транзакции
+            if catalog.get_product(product_id) is None:
+                return {'error': 'Product not found'}, 404
             
-            # Начинаем транзакцию
-            conn.autocommit = False
-            
-            try:
-                # 1. Проверяем существование заказа и его статус
-                cursor.execute("""
-                    SELECT id, current_status FROM orders 
-                    WHERE id = %s FOR UPDATE
-                """, (order_id,))
-                order = cursor.fetchone()
-                
-                if not order:
-                    return {'error': 'Order not found'}, 404
-                
-                if order['current_status'] not in ['new', 'processing']:
-                    return {'error': 'Cannot modify order in current status'}, 400
-                
-                # 2. Проверяем наличие товара на складе
-                cursor.execute("""
-                    SELECT id, name, quantity as stock_quantity, price 
-                    FROM products 
-                    WHERE id = %s FOR UPDATE
-                """, (product_id,))
-                product = cursor.fetchone()
-                
-                if not product:
-                    return {'error': 'Product not found'}, 404
-                
-                if product['stock_quantity'] < quantity:
-                    return {
-                        'error': 'Insufficient stock',
-                        'available_quantity': product['stock_quantity'],
-                        'requested_quantity': quantity
-                    }, 400
-                
-                # 3. Проверяем, есть ли уже этот товар в заказе
-                cursor.execute("""
-                    SELECT id, quantity, price 
-                    FROM order_items 
-                    WHERE order_id = %s AND product_id = %s
-                    FOR UPDATE
-                """, (order_id, product_id))
-                existing_item = cursor.fetchone()
-                
-                if existing_item:
-                    # 4. Если товар уже есть в заказе - обновляем количество
-                    new_quantity = existing_item['quantity'] + quantity
-                    
-                    # Проверяем, не превысит ли это общее количество доступного товара
-                    if product['stock_quantity'] < new_quantity:
-                        return {
-                            'error': 'Insufficient stock for updated quantity',
-                            'available_quantity': product['stock_quantity'],
-                            'current_in_order': existing_item['quantity'],
-                            'requested_additional': quantity
-                        }, 400
-                    
-                    cursor.execute("""
-                        UPDATE order_items 
-                        SET quantity = %s 
-                        WHERE id = %s
-                    """, (new_quantity, existing_item['id']))
-                    
-                    action = 'updated'
-                    final_quantity = new_quantity
-                    
-                else:
-                    # 5. Если товара нет в заказе - добавляем новую позицию
-                    cursor.execute("""
-                        INSERT INTO order_items (order_id, product_id, quantity, price)
-                        VALUES (%s, %s, %s, %s)
-                        RETURNING id
-                    """, (order_id, product_id, quantity, product['price']))
-                    
-                    action = 'added'
-                    final_quantity = quantity
-                
-                # 6. Уменьшаем количество товара на складе
-                cursor.execute("""
-                    UPDATE products 
-                    SET quantity = quantity - %s 
-                    WHERE id = %s
-                """, (quantity, product_id))
-                
-                # Коммитим транзакцию
-                conn.commit()
-                
+            def add_item(cursor):
+                result = reserve_item(cursor, order_id, product_id, quantity)
                 return {
-                    'message': f'Product {action} to order successfully',
+                    'message': f"Product {result['action']} to order successfully",
                     'order_id': order_id,
                     'product_id': product_id,
-                    'final_quantity': final_quantity,
-                    'product_name': product['name'],
-                    'price_per_unit': float(product['price'])
+                    'final_quantity': result['final_quantity'],
+                    'product_name': result['product_name'],
+                    'price_per_unit': result['price_per_unit']
                 }, 200
-                
-            except psycopg2.Error as e:
-                # Откатываем транзакцию в случае ошибки
-                if conn:
-                    conn.rollback()
-                app.logger.error(f"Database error: {e}")
-                return {'error': 'Database operation failed'}, 500
-                
-            finally:
-                if cursor:
-                    cursor.close()
-                
+            
+            # Проверка статуса заказа, списание остатка и добавление позиции
+            # выполняются одним запросом, блокировка товара держится до коммита.
+            # При deadlock / serialization failure транзакция повторяется
+            response, status_code, replayed = Database.run_in_transaction(
+                lambda cursor: idempotent(cursor, 'add_item', key, data, add_item),
+                operation='add_item',
+                cursor_factory=RealDictCursor,
+                lock_timeout=Config.ORDER_TX_LOCK_TIMEOUT,
+                statement_timeout=Config.ORDER_TX_STATEMENT_TIMEOUT
+            )
+            
+            return response, status_code, replay_headers(replayed)
+            
+        except ReservationError as e:
+            return e.payload, e.status_code
+        
         except psycopg2.Error as e:
-            app.logger.error(f"PostgreSQL error: {e}")
-            return {'error': 'Database connection failed'}, 500
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
         
         except Exception as e:
             app.logger.error(f"Unexpected error: {e}")
             return {'error': 'Internal server error'}, 500
-        
-        finally:
-            if conn:
-                Database.return_connection(conn)
+
+class AddItemsToOrderService(Resource):
+    def post(self):
+        """
+        Добавление нескольких товаров в заказ одной транзакцией
+        Пример JSON тела запроса:
+        {
+            "order_id": 2,
+            "items": [
+                {"product_id": 3, "quantity": 1},
+                {"product_id": 5, "quantity": 2}
+            ]
+        }
+        С заголовком Idempotency-Key повтор запроса возвращает сохраненный ответ
+        """
+        try:
+            data = request.get_json()
+            try:
+                key = idempotency_key()
+            except ValueError as e:
+                return {'error': str(e)}, 400
+
+            # Валидация входных данных
+            if not data:
+                return {'error': 'No JSON data provided'}, 400
+
+            for field in ['order_id', 'items']:
+                if field not in data:
+                    return {'error': f'Missing required field: {field}'}, 400
+
+            order_id = data['order_id']
+            items = data['items']
+
+            error = validate_order_id(order_id)
+            if error:
+                return {'error': error}, 400
+
+            if not isinstance(items, list) or not items:
+                return {'error': 'Items must be a non-empty list'}, 400
+
+            errors = validate_lines(items)
+            if errors:
+                return {'error': 'Invalid items', 'items': errors}, 400
+
+            products = catalog.get_products(line['product_id'] for line in items)
+            if any(line['product_id'] not in products for line in items):
+                return {'error': 'Some items cannot be reserved', 'items': [
+                    {'product_id': line['product_id'], 'quantity': line['quantity']}
+                    if line['product_id'] in products else
+                    {'product_id': line['product_id'], 'quantity': line['quantity'], 'error': 'Product not found'}
+                    for line in items
+                ]}, 400
+
+            def add_items(cursor):
+                return {
+                    'message': 'Products added to order successfully',
+                    'order_id': order_id,
+                    'items': reserve_items(cursor, order_id, items)
+                }, 200
+
+            response, status_code, replayed = Database.run_in_transaction(
+                lambda cursor: idempotent(cursor, 'add_items', key, data, add_items),
+                operation='add_items',
+                cursor_factory=RealDictCursor,
+                lock_timeout=Config.ORDER_TX_LOCK_TIMEOUT,
+                statement_timeout=Config.ORDER_TX_STATEMENT_TIMEOUT
+            )
+
+            return response, status_code, replay_headers(replayed)
+
+        except ReservationError as e:
+            return e.payload, e.status_code
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return {'error': 'Internal server error'}, 500
+
+class ImportOrdersService(Resource):
+    def post(self):
+        """
+        Массовый импорт заказов из тела запроса (bulk_orders.py)
+        CSV с заголовком (Content-Type: text/csv) или NDJSON (application/x-ndjson),
+        одна запись - одна позиция: external_id, customer_id, order_date, status, product_id, quantity.
+        ?dry_run=1 - только проверка. Ответ: число заказов и строк, отклоненные строки с причинами
+        """
+        try:
+            fmt = request.args.get('format') or ('ndjson' if 'ndjson' in (request.content_type or '') else 'csv')
+            dry_run = request.args.get('dry_run', '').lower() in ('1', 'true')
+            # Тело читается потоком по строкам и сразу уходит в COPY
+            lines = codecs.iterdecode(request.stream, 'utf-8')
+            with Database.connection() as conn:
+                report = import_orders(conn, lines, fmt, dry_run, rejected_limit=Config.BULK_IMPORT_REJECTED_LIMIT)
+            return report, 200
+
+        except (ValueError, UnicodeDecodeError) as e:
+            return {'error': f'Invalid import file: {e}'}, 400
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return {'error': 'Internal server error'}, 500
+
+class OrderDetailsService(Resource):
+    def get(self):
+        """
+        Детали заказов одним запросом (order_details.py): заголовок, итог и позиции с суммами
+        Параметры: ids - id заказов через запятую (до ORDER_DETAILS_MAX_IDS),
+        since, until - необязательные границы order_date (ISO 8601), ускоряют поиск по секциям
+        """
+        try:
+            order_ids = sorted({int(value) for value in request.args.get('ids', '').split(',') if value.strip()})
+            since, until = (
+                datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+                for name in ('since', 'until')
+            )
+        except ValueError:
+            return {'error': 'ids must be comma-separated integers, since and until ISO 8601 dates'}, 400
+        if not order_ids:
+            return {'error': 'Missing required parameter: ids'}, 400
+        if len(order_ids) > Config.ORDER_DETAILS_MAX_IDS:
+            return {'error': f'At most {Config.ORDER_DETAILS_MAX_IDS} orders per request'}, 400
+
+        try:
+            with Database.connection(readonly=True) as conn:
+                with conn.cursor() as cursor:
+                    frame = fetch_order_details(cursor, order_ids, since, until)
+                conn.rollback()
+            orders = details_to_json(frame)
+            found = {order['order_id'] for order in orders}
+            return {'orders': orders, 'missing': [order_id for order_id in order_ids if order_id not in found]}, 200
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return {'error': 'Internal server error'}, 500
+
+def spend_json(row):
+    customer_id, name, amount, updated_at = row
+    return {
+        'customer_id': customer_id,
+        'name': name,
+        'amount': float(amount),
+        'updated_at': updated_at.isoformat() if updated_at else None,
+    }
+
+class TopCustomersService(Resource):
+    def get(self):
+        """
+        Клиенты с наибольшей суммой покупок из сводки customer_spend (customer_spend.py)
+        Параметр limit - размер топа, по умолчанию 10
+        """
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            return {'error': 'Limit must be an integer'}, 400
+
+        try:
+            with Database.connection(readonly=True) as conn:
+                with conn.cursor() as cursor:
+                    rows = top_customers(cursor, limit)
+                conn.rollback()
+            return {'customers': [spend_json(row) for row in rows]}, 200
+
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return {'error': 'Internal server error'}, 500
+
+class CustomerSpendService(Resource):
+    def get(self, customer_id):
+        """Сумма покупок клиента из сводки customer_spend"""
+        try:
+            with Database.connection(readonly=True) as conn:
+                with conn.cursor() as cursor:
+                    row = customer_spend(cursor, customer_id)
+                conn.rollback()
+            if row is None:
+                return {'error': 'Customer not found'}, 404
+            return spend_json(row), 200
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return {'error': 'Internal server error'}, 500
+
+def int_arg(name, default):
+    """Целочисленный параметр запроса; ValueError с понятным текстом, если он некорректен"""
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        raise ValueError(f'{name} must be an integer') from None
+
+class CategoriesService(Resource):
+    def get(self, category_id=None):
+        """
+        Дерево категорий (category_tree.py): без id - корневые категории,
+        с id - категория, путь от корня и поддерево на depth уровней (по умолчанию 1).
+        У каждого узла direct_children и descendants - число прямых потомков и узлов поддерева
+        """
+        try:
+            depth = int_arg('depth', 1)
+            with Database.connection(readonly=True) as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    if category_id is None:
+                        result = {'categories': root_categories(cursor)}
+                    else:
+                        node = category_node(cursor, category_id)
+                        result = node and {
+                            'category': node,
+                            'ancestors': ancestors(cursor, category_id)[:-1],
+                            'subtree': subtree(cursor, category_id, depth)[1:],
+                        }
+                conn.rollback()
+            if not result:
+                return {'error': 'Category not found'}, 404
+            return result, 200
+
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return {'error': 'Internal server error'}, 500
+
+class CategoryProductsService(Resource):
+    def get(self, category_id):
+        """
+        Товары категории и всех ее потомков одним запросом по дереву категорий
+        Параметры: after - id последнего товара предыдущей страницы, limit
+        """
+        try:
+            after, limit = int_arg('after', 0), int_arg('limit', 50)
+            with Database.connection(readonly=True) as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    node = category_node(cursor, category_id)
+                    products, next_cursor = subtree_products(cursor, category_id, after, limit) if node else ([], None)
+                conn.rollback()
+            if not node:
+                return {'error': 'Category not found'}, 404
+            return {
+                'products': [dict(product, price=float(product['price'])) for product in products],
+                'next_after': next_cursor,
+            }, 200
+
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            return database_error_response(e)
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return {'error': 'Internal server error'}, 500
 
 # endpoints для мониторинга
 class HealthCheck(Resource):
     def get(self):
+        conn = None
         try:
             conn = Database.get_connection()
             cursor = conn.cursor()
             cursor.execute("SELECT 1")
             cursor.close()
-            Database.return_connection(conn)
             return {'status': 'healthy', 'database': 'connected'}, 200
         except Exception as e:
             return {'status': 'unhealthy', 'error': str(e)}, 500
+        finally:
+            if conn:
+                Database.return_connection(conn)
 
 api.add_resource(AddToOrderService, '/api/orders/add-item')
+api.add_resource(AddItemsToOrderService, '/api/orders/add-items')
+api.add_resource(ImportOrdersService, '/api/orders/import')
+api.add_resource(OrderDetailsService, '/api/orders/details')
+api.add_resource(TopCustomersService, '/api/customers/spend')
+api.add_resource(CustomerSpendService, '/api/customers/<int:customer_id>/spend')
+api.add_resource(CategoriesService, '/api/categories', '/api/categories/<int:category_id>')
+api.add_resource(CategoryProductsService, '/api/categories/<int:category_id>/products')
 api.add_resource(HealthCheck, '/health')
 
-@app.teardown_appcontext
-def close_db_connection(exception=None):
-    Database.close_pool()
+@app.route('/api/orders/export')
+def export_orders():
+    """
+    Потоковая выгрузка заказов с позициями в CSV (COPY TO, bulk_orders.py)
+    Параметры: since, until - границы order_date (ISO 8601), status
+    """
+    try:
+        since, until = (
+            datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+            for name in ('since', 'until')
+        )
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO 8601 dates'}), 400
+    status = request.args.get('status') or None
+    if status is not None and status not in ORDER_STATUSES:
+        return jsonify({'error': f'Status must be one of: {", ".join(ORDER_STATUSES)}'}), 400
+    return Response(
+        stream_export(since, until, status),
+        content_type='text/csv; charset=utf-8',
+        headers={'Content-Disposition': 'attachment; filename=orders.csv'}
+    )
+
+def cached_read(load, object_id, not_found):
+    """
+    Ответ GET из кэша ответов или из БД через load(cursor, object_id) (order_reads.py).
+    ETag - версия строк; при совпадении с If-None-Match ответ 304 без тела.
+    Чтение из primary: реплика с отставанием могла бы вернуть более старую версию,
+    чем уже видел клиент, и ETag пошел бы назад
+    """
+    cached = read_cache.get(request.path, request.url_rule.rule)
+    if cached is None:
+        loaded_at = time.monotonic()
+        try:
+            with Database.connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    loaded = load(cursor, object_id)
+                conn.rollback()
+
+        except psycopg2.Error as e:
+            app.logger.error(f"Database error: {e}")
+            body, status = database_error_response(e)
+            return jsonify(body), status
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+
+        # Отсутствие записи не кэшируется: новый заказ доступен сразу после коммита
+        if loaded is None:
+            return jsonify({'error': not_found}), 404
+        body, etag = loaded
+        cached = etag, json.dumps(body)
+        read_cache.put(request.path, *cached, loaded_at)
+
+    etag, body = cached
+    response = Response(body, content_type='application/json')
+    response.set_etag(etag)
+    # Клиент хранит ответ, но перед использованием перепроверяет его по ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/orders/<int:order_id>')
+def get_order(order_id):
+    """Заголовок заказа: клиент, статус, дата"""
+    return cached_read(read_order, order_id, 'Order not found')
+
+@app.route('/api/orders/<int:order_id>/items')
+def get_order_items(order_id):
+    """Позиции заказа с суммами по строкам"""
+    return cached_read(read_order_items, order_id, 'Order not found')
+
+@app.route('/api/products/<int:product_id>/stock')
+def get_product_stock(product_id):
+    """Текущий остаток товара (с шардами - их сумма)"""
+    return cached_read(read_product_stock, product_id, 'Product not found')
+
+@app.route('/metrics')
+def metrics():
+    data, content_type = metrics_response()
+    return Response(data, content_type=content_type)
 
+# Пул создается один раз при старте процесса и закрывается при его завершении.
+# Под gunicorn пул создается в каждом воркере после fork (gunicorn.conf.py)
 if __name__ == '__main__':
+    Database.init_pool()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
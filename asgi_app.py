@@ -0,0 +1,237 @@
+"""
+ASGI-версия API с тем же контрактом /api/orders/add-item и /health.
+
+Работает на asyncpg со своим асинхронным пулом: запрос, ожидающий
+блокировку строки или свободное соединение, не занимает поток, поэтому
+один процесс держит тысячи одновременных запросов.
+Запуск: uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import logging
+import random
+import re
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from config import Config
+from database import RETRYABLE_SQLSTATES
+from idempotency import (
+    CLAIM_KEY_SQL, IDEMPOTENCY_HEADER, SAVE_RESPONSE_SQL, STORED_RESPONSE_SQL,
+    key_params, replay_headers, save_params, stored_response, valid_key
+)
+from inventory import (
+    RESERVATION_STATUS_SQL, RESERVE_ITEM_SQL, ReservationError,
+    reservation_error, reservation_result, reserve_item_params, validate_item
+)
+from metrics import record_db_error, record_retry
+
+logger = logging.getLogger(__name__)
+
+
+def to_asyncpg(query):
+    """Перевод запроса с %(name)s-параметрами в $n-параметры asyncpg: (запрос, порядок имен)"""
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return re.sub(r'%\((\w+)\)s', replace, query), names
+
+
+class AsyncQuery:
+    """Запрос inventory, подготовленный для asyncpg"""
+
+    def __init__(self, query):
+        self.sql, self.names = to_asyncpg(query)
+
+    def args(self, params):
+        return [params[name] for name in self.names]
+
+
+RESERVE_ITEM = AsyncQuery(RESERVE_ITEM_SQL)
+RESERVATION_STATUS = AsyncQuery(RESERVATION_STATUS_SQL)
+CLAIM_KEY = AsyncQuery(CLAIM_KEY_SQL)
+STORED_RESPONSE = AsyncQuery(STORED_RESPONSE_SQL)
+SAVE_RESPONSE = AsyncQuery(SAVE_RESPONSE_SQL)
+
+
+class AsyncDatabase:
+    _pool = None
+
+    @classmethod
+    async def init_pool(cls):
+        cls._pool = await asyncpg.create_pool(
+            host=Config.DB_HOST,
+            port=int(Config.DB_PORT),
+            database=Config.DB_NAME,
+            user=Config.DB_USER,
+            password=Config.DB_PASSWORD,
+            min_size=Config.ASYNC_DB_POOL_MIN,
+            max_size=Config.ASYNC_DB_POOL_MAX
+        )
+        logger.info("Async database connection pool initialized")
+
+    @classmethod
+    def acquire(cls):
+        return cls._pool.acquire(timeout=Config.DB_POOL_TIMEOUT)
+
+    @classmethod
+    async def run_in_transaction(cls, func, operation='transaction', retries=None,
+                                 lock_timeout=None, statement_timeout=None):
+        """
+        Асинхронный аналог Database.run_in_transaction: await func(conn) одной транзакцией,
+        при deadlock / serialization failure - повтор до retries раз с паузой.
+        lock_timeout и statement_timeout (мс) действуют только внутри транзакции
+        """
+        retries = Config.DB_TX_RETRIES if retries is None else retries
+        attempt = 0
+        while True:
+            try:
+                async with cls.acquire() as conn:
+                    async with conn.transaction():
+                        if lock_timeout is not None or statement_timeout is not None:
+                            await conn.execute(
+                                "SELECT set_config('lock_timeout', $1, true), "
+                                "set_config('statement_timeout', $2, true)",
+                                str(lock_timeout or 0), str(statement_timeout or 0)
+                            )
+                        return await func(conn)
+            except asyncpg.PostgresError as e:
+                record_db_error(e)
+                if e.sqlstate not in RETRYABLE_SQLSTATES:
+                    raise
+                if attempt >= retries:
+                    record_retry(operation, e, exhausted=True)
+                    raise
+                record_retry(operation, e)
+                logger.warning(
+                    "Retrying %s after %s (attempt %s of %s)", operation, e.sqlstate, attempt + 1, retries
+                )
+            # Пауза после возврата соединения в пул
+            backoff = min(Config.DB_TX_RETRY_BACKOFF_MAX, Config.DB_TX_RETRY_BACKOFF * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, backoff))
+            attempt += 1
+
+    @classmethod
+    async def close_pool(cls):
+        if cls._pool:
+            await cls._pool.close()
+            cls._pool = None
+            logger.info("Async database connection pool closed")
+
+
+def database_error_response(e):
+    """Ответ на ошибку БД после повторов, как database_error_response в app.py"""
+    if e.sqlstate in ('55P03', '57014'):
+        # Превышены lock_timeout / statement_timeout - запрос можно повторить позже
+        return JSONResponse({'error': 'Database is busy, try again later'}, 503)
+    return JSONResponse({'error': 'Database operation failed'}, 500)
+
+
+async def add_item(request):
+    """Добавление товара в заказ, тело запроса как у AddToOrderService.post"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is not None and not valid_key(key):
+        return JSONResponse({'error': f'{IDEMPOTENCY_HEADER} must be 1-255 characters long'}, 400)
+
+    # Валидация входных данных
+    if not data:
+        return JSONResponse({'error': 'No JSON data provided'}, 400)
+
+    for field in ['order_id', 'product_id', 'quantity']:
+        if field not in data:
+            return JSONResponse({'error': f'Missing required field: {field}'}, 400)
+
+    order_id = data['order_id']
+    product_id = data['product_id']
+    quantity = data['quantity']
+
+    error = validate_item(order_id, product_id, quantity)
+    if error:
+        return JSONResponse({'error': error}, 400)
+
+    async def reserve(conn):
+        """Транзакция add-item: ((тело, код), ответ из ключа идемпотентности)"""
+        # Ключ идемпотентности записывается в той же транзакции (см. idempotency.py)
+        key_args = None
+        if key is not None:
+            key_args = key_params('add_item', key, data)
+            if not await conn.fetchrow(CLAIM_KEY.sql, *CLAIM_KEY.args(key_args)):
+                stored = await conn.fetchrow(STORED_RESPONSE.sql, *STORED_RESPONSE.args(key_args))
+                if stored:
+                    return stored_response(stored, key_args), True
+
+        params = reserve_item_params(order_id, product_id, quantity)
+        row = await conn.fetchrow(RESERVE_ITEM.sql, *RESERVE_ITEM.args(params))
+        if not row:
+            status = await conn.fetchrow(RESERVATION_STATUS.sql, *RESERVATION_STATUS.args(params))
+            raise reservation_error(status, quantity)
+        result = reservation_result(row)
+        response = {
+            'message': f"Product {result['action']} to order successfully",
+            'order_id': order_id,
+            'product_id': product_id,
+            'final_quantity': result['final_quantity'],
+            'product_name': result['product_name'],
+            'price_per_unit': result['price_per_unit']
+        }
+        if key_args is not None:
+            save_args = save_params(key_args, response, 200)
+            await conn.execute(SAVE_RESPONSE.sql, *SAVE_RESPONSE.args(save_args))
+        return (response, 200), False
+
+    try:
+        # Как в app.py: повтор при deadlock / serialization failure, таймауты на транзакцию
+        (response, status_code), replayed = await AsyncDatabase.run_in_transaction(
+            reserve,
+            operation='add_item',
+            lock_timeout=Config.ORDER_TX_LOCK_TIMEOUT,
+            statement_timeout=Config.ORDER_TX_STATEMENT_TIMEOUT
+        )
+
+    except ReservationError as e:
+        return JSONResponse(e.payload, e.status_code)
+
+    except asyncpg.PostgresError as e:
+        logger.error(f"Database error: {e}")
+        return database_error_response(e)
+
+    except (OSError, asyncio.TimeoutError, asyncpg.InterfaceError) as e:
+        logger.error(f"PostgreSQL error: {e}")
+        return JSONResponse({'error': 'Database connection failed'}, 500)
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return JSONResponse({'error': 'Internal server error'}, 500)
+
+    return JSONResponse(response, status_code, headers=replay_headers(replayed))
+
+
+async def health(request):
+    try:
+        async with AsyncDatabase.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+        return JSONResponse({'status': 'healthy', 'database': 'connected'}, 200)
+    except Exception as e:
+        return JSONResponse({'status': 'unhealthy', 'error': str(e)}, 500)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/orders/add-item', add_item, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+    ],
+    on_startup=[AsyncDatabase.init_pool],
+    on_shutdown=[AsyncDatabase.close_pool]
+)
@@ -0,0 +1,223 @@
+"""
+Дерево категорий: список смежности (рекурсивные запросы по parent_id) против
+материализованного пути ltree со счетчиками (category_tree, migrations/0011_category_tree.sql).
+
+В одной транзакции загружается дерево из --nodes категорий (по умолчанию 100 тыс.,
+глубина --depth) и --products товаров, дерево строится rebuild_category_tree(),
+затем для корня, узла середины дерева и листа замеряются одинаковые запросы
+обоими способами. После этого замеряется стоимость поддержки триггерами:
+добавление листьев и перенос поддеревьев; --verify сверяет счетчики с деревом.
+В конце транзакция откатывается, данные в базе не остаются.
+
+    python -m benchmarks.category_tree --nodes 100000 --depth 8 --repeat 20
+"""
+import argparse
+import random
+import time
+
+import psycopg2
+
+from benchmarks.datagen import category_rows, copy_rows, next_ids
+from benchmarks.load_test import percentile
+from benchmarks.suite import measure
+from config import Config
+
+# Одинаковые по результату запросы: (список смежности, category_tree)
+QUERIES = {
+    'subtree size': ("""
+        WITH RECURSIVE down AS (
+            SELECT id FROM categories WHERE id = %(category_id)s
+            UNION ALL
+            SELECT c.id FROM categories c JOIN down ON c.parent_id = down.id
+        )
+        SELECT count(*) FROM down
+    """, """
+        SELECT descendants + 1 FROM category_tree WHERE category_id = %(category_id)s
+    """),
+    'subtree nodes': ("""
+        WITH RECURSIVE down AS (
+            SELECT id FROM categories WHERE id = %(category_id)s
+            UNION ALL
+            SELECT c.id FROM categories c JOIN down ON c.parent_id = down.id
+        )
+        SELECT id FROM down
+    """, """
+        WITH root AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+        SELECT t.category_id FROM root JOIN category_tree t ON t.path <@ root.path
+    """),
+    'ancestors': ("""
+        WITH RECURSIVE up AS (
+            SELECT id, parent_id FROM categories WHERE id = %(category_id)s
+            UNION ALL
+            SELECT c.id, c.parent_id FROM categories c JOIN up ON c.id = up.parent_id
+        )
+        SELECT id FROM up
+    """, """
+        WITH node AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+        SELECT t.category_id FROM node JOIN category_tree t ON t.path @> node.path
+    """),
+    'products in subtree, first page': ("""
+        WITH RECURSIVE down AS (
+            SELECT id FROM categories WHERE id = %(category_id)s
+            UNION ALL
+            SELECT c.id FROM categories c JOIN down ON c.parent_id = down.id
+        )
+        SELECT p.id, p.name FROM down JOIN products p ON p.category_id = down.id
+        ORDER BY p.id
+        LIMIT 50
+    """, """
+        WITH root AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+        SELECT p.id, p.name
+        FROM root
+        JOIN category_tree t ON t.path <@ root.path
+        JOIN products p ON p.category_id = t.category_id
+        ORDER BY p.id
+        LIMIT 50
+    """),
+}
+
+# Запрос sql_queries.sql по всем категориям: до и после
+CHILD_COUNTS = ("""
+    SELECT parent.id, parent.name, COUNT(child.id)
+    FROM categories parent
+    LEFT JOIN categories child ON child.parent_id = parent.id
+    GROUP BY parent.id, parent.name
+    ORDER BY parent.name
+""", """
+    SELECT c.id, c.name, t.direct_children
+    FROM categories c
+    JOIN category_tree t ON t.category_id = c.id
+    ORDER BY c.name
+""")
+
+VERIFY_SQL = """
+    SELECT count(*)
+    FROM category_tree t
+    WHERE t.descendants <> (SELECT count(*) - 1 FROM category_tree d WHERE d.path <@ t.path)
+        OR t.direct_children <> (SELECT count(*) FROM categories c WHERE c.parent_id = t.category_id)
+"""
+
+
+def load_tree(cursor, rng, nodes, depth, products):
+    """Загрузка дерева и товаров через COPY без триггеров, затем построение category_tree"""
+    cursor.execute("SET LOCAL session_replication_role = replica")
+    first_category, first_product = next_ids(cursor, 'categories'), next_ids(cursor, 'products')
+    sizes = {'root_categories': 20, 'categories': nodes, 'category_depth': depth}
+    rows = list(category_rows(rng, first_category, sizes))
+    copy_rows(cursor, 'categories', ('id', 'name', 'parent_id'), rows)
+    category_ids = [row[0] for row in rows]
+    copy_rows(cursor, 'products', ('id', 'name', 'quantity', 'price', 'category_id'), (
+        (product_id, f"Tree product {product_id}", 0, 1, rng.choice(category_ids))
+        for product_id in range(first_product, first_product + products)
+    ))
+    cursor.execute("SET LOCAL session_replication_role = origin")
+    for table in ('categories', 'products'):
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+
+    started = time.perf_counter()
+    cursor.execute("SELECT rebuild_category_tree()")
+    print(f"Loaded {len(rows)} categories and {products} products, "
+          f"rebuild_category_tree() {time.perf_counter() - started:.2f} s")
+    cursor.execute("ANALYZE categories, category_tree, products")
+    return rows
+
+
+def sample_nodes(cursor, rows, depth):
+    """Корень с самым большим поддеревом, узел середины дерева и самый глубокий лист"""
+    first_id = rows[0][0]
+    cursor.execute("""
+        SELECT
+            (SELECT category_id FROM category_tree
+             WHERE nlevel(path) = 1 AND category_id >= %(first)s
+             ORDER BY descendants DESC LIMIT 1),
+            (SELECT category_id FROM category_tree
+             WHERE category_id >= %(first)s AND direct_children > 0
+             ORDER BY abs(nlevel(path) - %(middle)s), descendants DESC LIMIT 1),
+            (SELECT category_id FROM category_tree
+             WHERE category_id >= %(first)s
+             ORDER BY nlevel(path) DESC, category_id LIMIT 1)
+    """, {'first': first_id, 'middle': max(2, depth // 2)})
+    return dict(zip(('root', 'middle', 'leaf'), cursor.fetchone()))
+
+
+def compare(cursor, label, adjacency, tree, params, repeat):
+    def run(query):
+        return lambda: (cursor.execute(query, params), cursor.fetchall())
+    before, after = measure(run(adjacency), repeat), measure(run(tree), repeat)
+    print(f"{label:>45}: adjacency p50 {before['p50_ms']:8.2f} ms, "
+          f"ltree p50 {after['p50_ms']:8.2f} ms (x{before['p50_ms'] / max(after['p50_ms'], 1e-6):.1f})")
+
+
+def timed(cursor, statements):
+    """Время каждого изменения, поддерживаемого триггерами; p50/p99 в мс"""
+    samples = []
+    for query, params in statements:
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return percentile(samples, 0.50) * 1000, percentile(samples, 0.99) * 1000
+
+
+def maintenance(cursor, rng, rows, inserts, moves):
+    category_ids = [row[0] for row in rows]
+    roots = [row[0] for row in rows if row[2] is None]
+
+    p50, p99 = timed(cursor, (
+        ("INSERT INTO categories (name, parent_id) VALUES (%s, %s)", (f"Leaf {i}", rng.choice(category_ids)))
+        for i in range(inserts)
+    ))
+    print(f"{'insert leaf (triggers)':>45}: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+    cursor.execute("""
+        SELECT category_id, subpath(path, 0, 1)::text::int
+        FROM category_tree
+        WHERE category_id = ANY(%s) AND nlevel(path) BETWEEN 2 AND 3
+    """, (category_ids,))
+    candidates = cursor.fetchall()
+    movable = rng.sample(candidates, min(moves, len(candidates)))
+    # Перенос под корень другого поддерева: цикл исключен
+    p50, p99 = timed(cursor, (
+        ("UPDATE categories SET parent_id = %s WHERE id = %s",
+         (rng.choice([root for root in roots if root != own_root]), category_id))
+        for category_id, own_root in movable
+    ))
+    print(f"{'move subtree (triggers)':>45}: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=Config.DB_DSN)
+    parser.add_argument('--nodes', type=int, default=100_000)
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--products', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=20, help='measured runs per query')
+    parser.add_argument('--inserts', type=int, default=1000, help='leaves added through triggers')
+    parser.add_argument('--moves', type=int, default=100, help='subtrees moved through triggers')
+    parser.add_argument('--verify', action='store_true', help='check stored counts against the tree at the end')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cursor:
+            rows = load_tree(cursor, rng, args.nodes, args.depth, args.products)
+            nodes = sample_nodes(cursor, rows, args.depth)
+            for name, (adjacency, tree) in QUERIES.items():
+                for node, category_id in nodes.items():
+                    compare(cursor, f"{name} ({node})", adjacency, tree, {'category_id': category_id}, args.repeat)
+            compare(cursor, 'child counts, all categories', *CHILD_COUNTS, {}, max(1, args.repeat // 4))
+
+            maintenance(cursor, rng, rows, args.inserts, args.moves)
+            if args.verify:
+                cursor.execute(VERIFY_SQL)
+                mismatched = cursor.fetchone()[0]
+                print(f"Counters mismatched: {mismatched}")
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Генератор синтетических данных для бенчмарков.
+
+Данные детерминированы (--seed) и загружаются через COPY: глубокое дерево
+категорий, товары с популярностью по закону Ципфа (немного "горячих"
+товаров и длинный хвост), клиенты, заказы за --days дней и их позиции.
+Свежие заказы активны (new / processing), старые в основном доставлены.
+
+Загрузка идет с session_replication_role = replica (без триггеров и проверок
+FK, нужны права суперпользователя, события в order_events не пишутся), затем
+производные таблицы, которые обычно ведут триггеры и обработчик очереди
+событий worker.py, пересчитываются одним запросом.
+Данные добавляются к существующим, запускать на отдельной базе:
+    python migrate.py
+    python -m benchmarks.datagen --scale 1      # ~1 млн клиентов, 3 млн заказов, ~9 млн позиций
+    python -m benchmarks.datagen --scale 0.01   # быстрый набор для проверки
+"""
+import argparse
+import io
+from array import array
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import psycopg2
+
+from config import Config
+
+# Размеры при --scale 1; число корней и глубина дерева от масштаба не зависят
+BASE_SIZES = {
+    'root_categories': 20,
+    'categories': 5_000,
+    'category_depth': 8,
+    'customers': 1_000_000,
+    'products': 100_000,
+    'orders': 3_000_000,
+    'max_items_per_order': 5,
+}
+SCALED = ('categories', 'customers', 'products', 'orders')
+COPY_CHUNK_ROWS = 100_000
+
+
+def scaled_sizes(scale):
+    return {
+        key: max(1, int(value * scale)) if key in SCALED else value
+        for key, value in BASE_SIZES.items()
+    }
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Загрузка строк через COPY FROM STDIN порциями по COPY_CHUNK_ROWS"""
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    buffer, count = io.StringIO(), 0
+    for row in rows:
+        buffer.write('\t'.join(r'\N' if value is None else str(value) for value in row))
+        buffer.write('\n')
+        count += 1
+        if count % COPY_CHUNK_ROWS == 0:
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            buffer = io.StringIO()
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+    return count
+
+
+def next_ids(cursor, table):
+    """Первый свободный id таблицы; COPY записывает id из данных и в GENERATED ALWAYS столбцы"""
+    cursor.execute(f"SELECT COALESCE(max(id), 0) + 1 FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def category_rows(rng, first_id, sizes):
+    """Категории по уровням: корни, затем каждый уровень ссылается на случайные категории предыдущего"""
+    roots = list(range(first_id, first_id + sizes['root_categories']))
+    for category_id in roots:
+        yield category_id, f"Root {category_id}", None
+
+    rest = max(0, sizes['categories'] - len(roots))
+    levels = max(1, sizes['category_depth'] - 1)
+    previous, next_id = roots, roots[-1] + 1
+    for level in range(levels):
+        count = rest // levels + (1 if level < rest % levels else 0)
+        current = []
+        for _ in range(count):
+            yield next_id, f"Category {next_id}", rng.choice(previous)
+            current.append(next_id)
+            next_id += 1
+        previous = current or previous
+
+
+def generate(conn, sizes, seed=42, days=730, zipf=1.1):
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    started = time.monotonic()
+
+    with conn.cursor() as cursor:
+        # Без триггеров и проверок FK: данные согласованы по построению
+        cursor.execute("SET LOCAL session_replication_role = replica")
+        first = {table: next_ids(cursor, table) for table in ('categories', 'customers', 'products', 'orders', 'order_items')}
+
+        categories = list(category_rows(rng, first['categories'], sizes))
+        copy_rows(cursor, 'categories', ('id', 'name', 'parent_id'), categories)
+        category_ids = [row[0] for row in categories]
+
+        copy_rows(cursor, 'customers', ('id', 'name', 'address'), (
+            (customer_id, f"Customer {customer_id}", f"Address {customer_id}")
+            for customer_id in range(first['customers'], first['customers'] + sizes['customers'])
+        ))
+
+        product_ids = list(range(first['products'], first['products'] + sizes['products']))
+        prices = {product_id: round(rng.uniform(1, 1000), 2) for product_id in product_ids}
+        copy_rows(cursor, 'products', ('id', 'name', 'quantity', 'price', 'category_id'), (
+            (product_id, f"Product {product_id}", rng.randint(1_000, 100_000), prices[product_id],
+             rng.choice(category_ids))
+            for product_id in product_ids
+        ))
+
+        # Популярность по Ципфу: ранг товара случаен, вес ранга r - 1 / r^zipf
+        popularity = product_ids[:]
+        rng.shuffle(popularity)
+        cum_weights = list(accumulate(1 / rank ** zipf for rank in range(1, len(popularity) + 1)))
+
+        customers_last = first['customers'] + sizes['customers'] - 1
+        order_ids = range(first['orders'], first['orders'] + sizes['orders'])
+        # Позиции лежат в секции месяца своего заказа (migrations/0009_partition_orders.sql)
+        cursor.execute("SELECT create_order_partitions(%s, %s)", ((now - timedelta(days=days)).date(), now.date()))
+        # Возраст заказа в секундах по порядку id - для даты позиций
+        order_ages = array('l')
+
+        def orders():
+            for order_id in order_ids:
+                order_ages.append(rng.randint(0, days * 86400))
+                order_date = now - timedelta(seconds=order_ages[-1])
+                age = now - order_date
+                if age < timedelta(days=3):
+                    status = rng.choice(('new', 'processing', 'shipped'))
+                elif age < timedelta(days=14):
+                    status = rng.choice(('shipped', 'delivered'))
+                else:
+                    status = 'delivered'
+                yield order_id, rng.randint(first['customers'], customers_last), order_date, status
+
+        copy_rows(cursor, 'orders', ('id', 'customer_id', 'order_date', 'current_status'), orders())
+
+        def items():
+            item_id = first['order_items']
+            for order_id, age in zip(order_ids, order_ages):
+                order_date = now - timedelta(seconds=age)
+                count = rng.randint(1, sizes['max_items_per_order'])
+                for product_id in set(rng.choices(popularity, cum_weights=cum_weights, k=count)):
+                    yield item_id, order_id, order_date, product_id, rng.randint(1, 3), prices[product_id]
+                    item_id += 1
+
+        items_count = copy_rows(
+            cursor, 'order_items', ('id', 'order_id', 'order_date', 'product_id', 'quantity', 'price'), items()
+        )
+
+        for table in first:
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+            )
+        cursor.execute("SET LOCAL session_replication_role = origin")
+        rebuild_derived(cursor, first)
+    conn.commit()
+
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("REFRESH MATERIALIZED VIEW dashboard_stats_snapshot")
+        cursor.execute("VACUUM ANALYZE")
+    conn.autocommit = False
+
+    print(f"Generated {len(categories)} categories, {sizes['customers']} customers, "
+          f"{sizes['products']} products, {sizes['orders']} orders, {items_count} items "
+          f"in {time.monotonic() - started:.0f}s")
+
+
+def rebuild_derived(cursor, first):
+    """
+    Пересчет для загруженных строк данных, которые при обычной работе ведут триггеры
+    (category_roots, category_tree, order_dates) и worker.py (product_sales_*, customer_spend)
+    """
+    cursor.execute("""
+        WITH RECURSIVE tree AS (
+            SELECT id, id AS root_id FROM categories WHERE parent_id IS NULL
+            UNION ALL
+            SELECT c.id, tree.root_id FROM categories c JOIN tree ON c.parent_id = tree.id
+        )
+        INSERT INTO category_roots (category_id, root_id)
+        SELECT id, root_id FROM tree
+        WHERE id >= %s
+        ON CONFLICT (category_id) DO UPDATE SET root_id = EXCLUDED.root_id
+    """, (first['categories'],))
+    cursor.execute("SELECT rebuild_category_tree()")
+    cursor.execute("""
+        INSERT INTO order_dates (order_id, order_date)
+        SELECT id, order_date FROM orders
+        WHERE id >= %s
+    """, (first['orders'],))
+    cursor.execute("""
+        INSERT INTO product_sales_daily (sale_date, product_id, sold_amount)
+        SELECT order_date::date, product_id, SUM(quantity)
+        FROM order_items
+        WHERE id >= %s
+        GROUP BY order_date::date, product_id
+        ON CONFLICT (sale_date, product_id)
+        DO UPDATE SET sold_amount = product_sales_daily.sold_amount + EXCLUDED.sold_amount
+    """, (first['order_items'],))
+    cursor.execute("""
+        INSERT INTO product_sales_total (product_id, sold_amount)
+        SELECT product_id, SUM(quantity)
+        FROM order_items
+        WHERE id >= %s
+        GROUP BY product_id
+        ON CONFLICT (product_id)
+        DO UPDATE SET sold_amount = product_sales_total.sold_amount + EXCLUDED.sold_amount
+    """, (first['order_items'],))
+    # Суммы покупок клиентов (0010) - сверкой с полным пересчетом
+    cursor.execute("SELECT count(*) FROM reconcile_customer_spend()")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=Config.DB_DSN)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for the base sizes')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--days', type=int, default=730, help='spread order dates over this many days')
+    parser.add_argument('--zipf', type=float, default=1.1, help='product popularity skew exponent')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        generate(conn, scaled_sizes(args.scale), args.seed, args.days, args.zipf)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
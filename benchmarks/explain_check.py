@@ -0,0 +1,263 @@
+"""
+Регрессионная проверка планов запросов горячих путей.
+
+Для каждого запроса выполняется EXPLAIN (ANALYZE, FORMAT JSON); проверка
+падает, если в плане есть Seq Scan по таблице больше --min-rows строк.
+Запросы, которые по смыслу читают всю историю (агрегаты дашборда без
+фильтров), сюда не входят - для них есть отдельные сводные таблицы.
+Отчеты за период (PRUNING_CHECKS) должны читать не больше заданного числа
+месячных секций orders / order_items.
+
+Запускать на отдельной базе: с --generate в нее загружается синтетический
+набор данных benchmarks.datagen (при --scale 1 ~3 млн заказов и ~9 млн позиций).
+    python migrate.py
+    python -m benchmarks.explain_check --generate
+"""
+import argparse
+import json
+import re
+import sys
+
+import psycopg2
+
+from benchmarks import datagen
+from config import Config
+from order_details import ORDER_DETAILS_SQL
+from order_reads import ORDER_ITEMS_SQL, ORDER_SQL, PRODUCT_STOCK_SQL
+
+def sample_params(cursor):
+    cursor.execute("""
+        SELECT
+            (SELECT id FROM orders ORDER BY id DESC LIMIT 1) AS order_id,
+            (SELECT customer_id FROM orders ORDER BY id DESC LIMIT 1) AS customer_id,
+            (SELECT product_id FROM order_items ORDER BY id DESC LIMIT 1) AS product_id,
+            (SELECT parent_id FROM categories WHERE parent_id IS NOT NULL ORDER BY id DESC LIMIT 1) AS category_id
+    """)
+    params = dict(zip(('order_id', 'customer_id', 'product_id', 'category_id'), cursor.fetchone()))
+    params['order_ids'] = [params['order_id']]
+    return params
+
+
+# Запросы горячих путей app.py, streamlit_app.py и sql_queries.sql
+CHECKS = {
+    'order details (get_order_details)': ORDER_DETAILS_SQL.format(filters=''),
+    'order (GET /api/orders/<id>)': ORDER_SQL,
+    'order items (GET /api/orders/<id>/items)': ORDER_ITEMS_SQL,
+    'product stock (GET /api/products/<id>/stock)': PRODUCT_STOCK_SQL,
+    'order total': """
+        SELECT SUM(quantity * price) FROM order_items WHERE order_id = %(order_id)s
+    """,
+    'orders, next page (get_orders_page)': """
+        SELECT o.*, c.name as customer_name
+        FROM orders o
+        JOIN customers c ON o.customer_id = c.id
+        WHERE (o.order_date, o.id) < (NOW() - INTERVAL '1 day', %(order_id)s)
+        ORDER BY o.order_date DESC, o.id DESC
+        LIMIT 51
+    """,
+    'orders by status, next page (get_orders_page)': """
+        SELECT o.*, c.name as customer_name
+        FROM orders o
+        JOIN customers c ON o.customer_id = c.id
+        WHERE o.current_status IN ('processing')
+            AND (o.order_date, o.id) < (NOW() - INTERVAL '1 day', %(order_id)s)
+        ORDER BY o.order_date DESC, o.id DESC
+        LIMIT 51
+    """,
+    'active orders (add to order picker)': """
+        SELECT o.*, c.name as customer_name
+        FROM orders o
+        JOIN customers c ON o.customer_id = c.id
+        WHERE o.current_status IN ('new', 'processing')
+        ORDER BY o.order_date DESC, o.id DESC
+        LIMIT 51
+    """,
+    'orders by customer name search': """
+        SELECT o.*, c.name as customer_name
+        FROM orders o
+        JOIN customers c ON o.customer_id = c.id
+        WHERE c.name ILIKE '%%Customer 12345%%'
+        ORDER BY o.order_date DESC, o.id DESC
+        LIMIT 51
+    """,
+    'products, next page (get_products_page)': """
+        SELECT p.*, c.name as category_name
+        FROM products p
+        JOIN categories c ON p.category_id = c.id
+        WHERE (p.name, p.id) > ('Product 5', 0)
+        ORDER BY p.name, p.id
+        LIMIT 51
+    """,
+    'products by name search': """
+        SELECT p.*, c.name as category_name
+        FROM products p
+        JOIN categories c ON p.category_id = c.id
+        WHERE p.name ILIKE '%%duct 4242%%'
+        ORDER BY p.name, p.id
+        LIMIT 51
+    """,
+    'customer spend, one customer': """
+        SELECT SUM(oi.quantity * oi.price)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.customer_id = %(customer_id)s
+    """,
+    'top customers by spend (customer_spend)': """
+        SELECT s.customer_id, c.name, s.amount
+        FROM customer_spend s
+        JOIN customers c ON c.id = s.customer_id
+        WHERE s.amount > 0
+        ORDER BY s.amount DESC, s.customer_id
+        LIMIT 10
+    """,
+    'product sales': """
+        SELECT SUM(quantity) FROM order_items WHERE product_id = %(product_id)s
+    """,
+    'child categories': """
+        SELECT id, name FROM categories WHERE parent_id = %(category_id)s
+    """,
+    'products in category': """
+        SELECT id, name FROM products WHERE category_id = %(category_id)s
+    """,
+    'category subtree (category_tree)': """
+        WITH root AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+        SELECT t.category_id, t.direct_children, t.descendants
+        FROM root
+        JOIN category_tree t ON t.path ~ (root.path::text || '.*{0,2}')::lquery
+    """,
+    'category ancestors (category_tree)': """
+        WITH node AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+        SELECT t.category_id FROM node JOIN category_tree t ON t.path @> node.path
+    """,
+    'products in category subtree (category_tree)': """
+        WITH root AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+        SELECT p.id, p.name
+        FROM root
+        JOIN category_tree t ON t.path <@ root.path
+        JOIN products p ON p.category_id = t.category_id
+        ORDER BY p.id
+        LIMIT 51
+    """,
+    'top 5 products last month (view)': """
+        SELECT * FROM top_5_products_last_month
+    """,
+    'top products (get_dashboard_stats)': """
+        SELECT p.name, s.sold_amount
+        FROM product_sales_total s
+        JOIN products p ON s.product_id = p.id
+        ORDER BY s.sold_amount DESC
+        LIMIT 10
+    """,
+}
+
+
+# Отчеты за период: запрос и допустимое число прочитанных секций каждой таблицы
+PRUNING_CHECKS = {
+    'customer spend last month': ("""
+        SELECT c.name, SUM(oi.quantity * oi.price)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
+        JOIN customers c ON c.id = o.customer_id
+        WHERE o.order_date >= NOW() - INTERVAL '1 month'
+            AND oi.order_date >= NOW() - INTERVAL '1 month'
+        GROUP BY c.id, c.name
+    """, 2),
+    'orders last week by status': ("""
+        SELECT current_status, COUNT(*)
+        FROM orders
+        WHERE order_date >= NOW() - INTERVAL '7 days'
+        GROUP BY current_status
+    """, 2),
+}
+PARTITION_NAME = re.compile(r'^(orders|order_items)_\d{4}_\d{2}$')
+
+
+def scanned_partitions(plan):
+    """Секции orders / order_items, которые план действительно читал: {таблица: {секции}}"""
+    found = {}
+    relation = plan.get('Relation Name', '')
+    match = PARTITION_NAME.match(relation)
+    # Секции, отброшенные при выполнении, остаются в плане с Actual Loops = 0
+    if match and plan.get('Actual Loops', 1) > 0:
+        found.setdefault(match.group(1), set()).add(relation)
+    for child in plan.get('Plans', []):
+        for table, partitions in scanned_partitions(child).items():
+            found.setdefault(table, set()).update(partitions)
+    return found
+
+
+def seq_scans(plan):
+    """Все Seq Scan узлы плана (имя таблицы)"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def run_checks(conn, min_rows):
+    failures = []
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT relname, reltuples FROM pg_class
+            WHERE relkind IN ('r', 'p') AND relnamespace = 'public'::regnamespace
+        """)
+        table_rows = dict(cursor.fetchall())
+        params = sample_params(cursor)
+
+        for name, query in CHECKS.items():
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+            plan = cursor.fetchone()[0][0]
+            conn.rollback()
+
+            offending = sorted({t for t in seq_scans(plan['Plan']) if table_rows.get(t, 0) > min_rows})
+            status = 'FAIL' if offending else 'ok'
+            print(f"[{status:>4}] {name}: {plan['Execution Time']:.2f} ms"
+                  + (f" - seq scan on {', '.join(offending)}" if offending else ''))
+            if offending:
+                failures.append({'query': name, 'seq_scans': offending, 'plan': plan})
+
+        for name, (query, max_partitions) in PRUNING_CHECKS.items():
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query)
+            plan = cursor.fetchone()[0][0]
+            conn.rollback()
+
+            scanned = scanned_partitions(plan['Plan'])
+            offending = {table: sorted(names) for table, names in scanned.items() if len(names) > max_partitions}
+            status = 'FAIL' if offending else 'ok'
+            print(f"[{status:>4}] {name}: {plan['Execution Time']:.2f} ms, partitions "
+                  + ', '.join(f"{table} {len(names)}" for table, names in sorted(scanned.items())))
+            if offending:
+                failures.append({'query': name, 'partitions': offending, 'plan': plan})
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=Config.DB_DSN)
+    parser.add_argument('--generate', action='store_true', help='load the synthetic dataset first')
+    parser.add_argument('--scale', type=float, default=1.0, help='dataset size multiplier (see benchmarks.datagen)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--min-rows', type=int, default=10_000,
+                        help='ignore seq scans on tables smaller than this')
+    parser.add_argument('--plans', help='write failing plans to this JSON file')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.generate:
+            datagen.generate(conn, datagen.scaled_sizes(args.scale), args.seed)
+        failures = run_checks(conn, args.min_rows)
+    finally:
+        conn.close()
+
+    if args.plans and failures:
+        with open(args.plans, 'w', encoding='utf-8') as f:
+            json.dump(failures, f, indent=2, ensure_ascii=False)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
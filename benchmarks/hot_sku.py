@@ -0,0 +1,184 @@
+"""
+Пропускная способность резервирования одного "горячего" товара.
+
+Каждый поток добавляет по одной единице товара в свой заказ, все потоки
+конкурируют за одну строку products. Сравниваются:
+    legacy - исходный сценарий из app.py (блокировки заказа, товара и позиции
+             и пять запросов в транзакции);
+    atomic - inventory.reserve_item (один условный UPDATE + upsert).
+
+С --shards режим atomic повторяется для товара с остатком, разбитым на
+указанное число шардов (inventory.set_stock_shards), и печатается рост
+пропускной способности относительно одного шарда.
+
+Запуск из корня репозитория при поднятом PostgreSQL:
+    python -m benchmarks.hot_sku --threads 32 --duration 10
+    python -m benchmarks.hot_sku --threads 64 --mode atomic --shards 1 2 4 8 16
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from config import Config
+from inventory import reserve_item, set_stock_shards
+
+BENCH_PRODUCT_NAME = 'bench-hot-sku'
+BENCH_STOCK = 10 ** 9
+
+
+def legacy_reserve(cursor, order_id, product_id, quantity):
+    """Исходный сценарий AddToOrderService.post"""
+    cursor.execute("SELECT id, current_status FROM orders WHERE id = %s FOR UPDATE", (order_id,))
+    cursor.fetchone()
+    cursor.execute("""
+        SELECT id, name, quantity as stock_quantity, price
+        FROM products WHERE id = %s FOR UPDATE
+    """, (product_id,))
+    product = cursor.fetchone()
+    cursor.execute("""
+        SELECT id, quantity, price FROM order_items
+        WHERE order_id = %s AND product_id = %s FOR UPDATE
+    """, (order_id, product_id))
+    existing_item = cursor.fetchone()
+    if existing_item:
+        cursor.execute("UPDATE order_items SET quantity = %s WHERE id = %s",
+                       (existing_item['quantity'] + quantity, existing_item['id']))
+    else:
+        cursor.execute("""
+            INSERT INTO order_items (order_id, order_date, product_id, quantity, price)
+            SELECT id, order_date, %s, %s, %s FROM orders WHERE id = %s
+        """, (product_id, quantity, product['price'], order_id))
+    cursor.execute("UPDATE products SET quantity = quantity - %s WHERE id = %s", (quantity, product_id))
+
+
+def atomic_reserve(cursor, order_id, product_id, quantity):
+    reserve_item(cursor, order_id, product_id, quantity)
+
+
+MODES = {
+    'legacy': legacy_reserve,
+    'atomic': atomic_reserve,
+}
+
+
+def setup(dsn, orders_count, shards=0):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("SELECT min(id) AS id FROM categories")
+            category_id = cursor.fetchone()['id']
+            cursor.execute("SELECT min(id) AS id FROM customers")
+            customer_id = cursor.fetchone()['id']
+            cursor.execute("""
+                INSERT INTO products (name, quantity, price, category_id)
+                VALUES (%s, %s, 100, %s) RETURNING id
+            """, (BENCH_PRODUCT_NAME, BENCH_STOCK, category_id))
+            product_id = cursor.fetchone()['id']
+            if shards:
+                set_stock_shards(cursor, product_id, shards)
+            cursor.execute("""
+                INSERT INTO orders (customer_id, current_status)
+                SELECT %s, 'new' FROM generate_series(1, %s)
+                RETURNING id
+            """, (customer_id, orders_count))
+            order_ids = [row['id'] for row in cursor.fetchall()]
+        conn.commit()
+        return product_id, order_ids
+    finally:
+        conn.close()
+
+
+def teardown(dsn, product_id, order_ids):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM orders WHERE id = ANY(%s)", (order_ids,))
+            cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run(dsn, mode, threads, duration, shards=0):
+    product_id, order_ids = setup(dsn, threads, shards)
+    reserve = MODES[mode]
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+    stop = threading.Event()
+
+    def worker(i):
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    try:
+                        reserve(cursor, order_ids[i], product_id, 1)
+                        conn.commit()
+                        latencies[i].append(time.perf_counter() - started)
+                    except psycopg2.Error:
+                        conn.rollback()
+                        errors[i] += 1
+        finally:
+            conn.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    teardown(dsn, product_id, order_ids)
+
+    samples = sorted(x for per_thread in latencies for x in per_thread)
+    return {
+        'mode': mode,
+        'shards': shards,
+        'threads': threads,
+        'transactions': len(samples),
+        'errors': sum(errors),
+        'tps': len(samples) / elapsed,
+        'p50_ms': statistics.median(samples) * 1000 if samples else None,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000 if samples else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=Config.DB_DSN)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per mode')
+    parser.add_argument('--mode', nargs='+', choices=sorted(MODES), default=['legacy', 'atomic'])
+    parser.add_argument('--shards', nargs='+', type=int, default=[],
+                        help='also run atomic mode with stock split across this many shards')
+    args = parser.parse_args()
+
+    def report(result, label):
+        print(
+            f"{label:>10}: {result['transactions']} tx, {result['tps']:.1f} tx/s, "
+            f"p50 {result['p50_ms'] or 0:.2f} ms, p99 {result['p99_ms'] or 0:.2f} ms, "
+            f"errors {result['errors']}"
+        )
+
+    for mode in args.mode:
+        report(run(args.dsn, mode, args.threads, args.duration), mode)
+
+    baseline = None
+    for shards in args.shards:
+        result = run(args.dsn, 'atomic', args.threads, args.duration, shards)
+        report(result, f"shards={shards}")
+        baseline = baseline or result['tps']
+        if baseline:
+            print(f"{'':>10}  x{result['tps'] / baseline:.2f} vs shards={args.shards[0]}")
+
+
+if __name__ == '__main__':
+    main()
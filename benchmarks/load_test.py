@@ -0,0 +1,387 @@
+"""
+Нагрузочный тест добавления товаров в заказ (/api/orders/add-item, /api/orders/add-items).
+
+Клиент асинхронный (asyncio, keep-alive HTTP/1.1), поэтому одним процессом
+держит тысячи одновременных запросов. Трафик синтезируется или воспроизводится:
+    - по умолчанию замкнутый цикл: --concurrency соединений шлют запросы без пауз;
+    - --rate N - открытая модель: запросы приходят пуассоновским потоком N в секунду,
+      задержка считается от запланированного времени прихода, то есть включает
+      ожидание свободного соединения, если сервер не успевает;
+    - --zipf S - популярность товаров по закону Ципфа ("горячие" товары), 0 - равномерно;
+    - --cart-size 1-5 - размер корзины, корзины больше одной позиции идут в /add-items
+      (asgi_app.py поддерживает только /add-item);
+    - --replay FILE - JSONL с телами запросов (или {"path": ..., "body": ...}) по кругу.
+Для каждого адреса печатает запросы в секунду, перцентили задержки и разбивку
+ответов по кодам и текстам ошибок.
+
+С --dsn остатки и позиции товаров снимаются до и после прогона и проверяется
+согласованность: остаток не отрицательный, уменьшение остатка каждого товара
+равно приросту его количества в позициях заказов и не больше, чем подтверждено
+ответами 200 плюс запросы с неизвестным исходом. Проверка верна, если в это время
+базу не меняет никто, кроме теста. --new-orders N создает N новых заказов для прогона.
+
+    docker-compose up postgres api api-async
+    python -m benchmarks.load_test http://localhost:5000 http://localhost:8000 \\
+        --concurrency 500 --duration 30 --orders 2 5 --products 1-11
+    python -m benchmarks.load_test http://localhost:5000 --rate 300 --concurrency 200 \\
+        --zipf 1.1 --cart-size 1-5 --products 1-11 \\
+        --dsn "host=localhost dbname=postgres user=postgres password=postgres" --new-orders 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from itertools import accumulate, cycle
+from urllib.parse import urlsplit
+
+import psycopg2
+
+ADD_ITEM_PATH = '/api/orders/add-item'
+ADD_ITEMS_PATH = '/api/orders/add-items'
+# Перцентили задержки в отчете
+PERCENTILES = (0.50, 0.90, 0.95, 0.99, 0.999)
+
+
+class HttpConnection:
+    """Минимальный HTTP/1.1-клиент с переподключением, если сервер закрыл соединение"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        version, status = lines[0].split(' ', 2)[:2]
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            payload = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            payload = await self.reader.read()
+
+        if version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close' \
+                or 'content-length' not in headers:
+            await self.close()
+        return int(status), payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+
+def percentile(samples, q):
+    """Перцентиль по отсортированному списку"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def classify(status, payload):
+    """Класс ответа для статистики: код и текст ошибки"""
+    if status == 200:
+        return '200'
+    try:
+        error = json.loads(payload).get('error')
+    except ValueError:
+        error = None
+    return f"{status} {error}" if error else str(status)
+
+
+def body_lines(body):
+    """Позиции тела запроса: [(product_id, quantity)]"""
+    if 'items' in body:
+        return [(line['product_id'], line['quantity']) for line in body['items']]
+    return [(body['product_id'], body['quantity'])]
+
+
+def as_request(request):
+    """(путь, тело) из результата make_body; тело без пути отправляется по числу позиций"""
+    if isinstance(request, tuple):
+        return request
+    return (ADD_ITEMS_PATH if 'items' in request else ADD_ITEM_PATH), request
+
+
+async def run(base_url, concurrency, duration, make_body, rate=None, seed=None):
+    """
+    Прогон на duration секунд. make_body() возвращает тело запроса или (путь, тело).
+    Без rate - замкнутый цикл на concurrency соединениях, с rate - пуассоновский
+    поток rate запросов в секунду, который обслуживают concurrency соединений
+    """
+    url = urlsplit(base_url)
+    latencies = []
+    results = Counter()
+    reserved = Counter()   # товар -> количество, подтвержденное ответами 200
+    unknown = Counter()    # товар -> количество в запросах без ответа (исход неизвестен)
+    unsent = 0
+    deadline = time.perf_counter() + duration
+    arrivals = asyncio.Queue() if rate else None
+
+    async def schedule():
+        rng = random.Random(seed)
+        arrival = time.perf_counter()
+        while arrival < deadline:
+            arrivals.put_nowait(arrival)
+            arrival += rng.expovariate(rate)
+            await asyncio.sleep(max(0, arrival - time.perf_counter()))
+        for _ in range(concurrency):
+            arrivals.put_nowait(None)
+
+    async def worker():
+        nonlocal unsent
+        conn = HttpConnection(url.hostname, url.port or 80)
+        try:
+            while True:
+                if arrivals is not None:
+                    arrival = await arrivals.get()
+                    if arrival is None:
+                        break
+                    if time.perf_counter() >= deadline:
+                        # Очередь, не обслуженная до конца прогона
+                        unsent += 1
+                        continue
+                elif time.perf_counter() >= deadline:
+                    break
+                path, body = as_request(make_body())
+                started = time.perf_counter() if arrivals is None else arrival
+                try:
+                    status, payload = await conn.request('POST', path, json.dumps(body).encode())
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    await conn.close()
+                    results[f"connection error: {type(e).__name__}"] += 1
+                    unknown.update(dict(body_lines(body)))
+                    continue
+                latencies.append(time.perf_counter() - started)
+                results[classify(status, payload)] += 1
+                if status == 200:
+                    for product_id, quantity in body_lines(body):
+                        reserved[product_id] += quantity
+        finally:
+            await conn.close()
+
+    started = time.perf_counter()
+    tasks = [worker() for _ in range(concurrency)]
+    if arrivals is not None:
+        tasks.append(schedule())
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    report = {
+        'url': base_url,
+        'concurrency': concurrency,
+        'rate': rate,
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'unsent': unsent,
+        'results': dict(results),
+        'errors_5xx': sum(count for result, count in results.items() if result[:1] == '5'),
+        'reserved': dict(reserved),
+        'unknown': dict(unknown),
+    }
+    for q in PERCENTILES:
+        report[f"p{q * 100:g}_ms"] = percentile(latencies, q) * 1000 if latencies else None
+    report['max_ms'] = latencies[-1] * 1000 if latencies else None
+    return report
+
+
+def id_range(value):
+    """'1-11' -> [1..11], '5' -> [5]"""
+    if '-' in value:
+        start, end = value.split('-', 1)
+        return list(range(int(start), int(end) + 1))
+    return [int(value)]
+
+
+def synthetic_traffic(rng, order_ids, product_ids, zipf, cart_sizes, quantities):
+    """
+    Генератор тел запросов: случайный заказ, корзина из cart_sizes разных товаров,
+    популярность товаров по Ципфу с показателем zipf (ранги товаров случайны)
+    """
+    popularity = product_ids[:]
+    rng.shuffle(popularity)
+    cum_weights = list(accumulate(1 / rank ** zipf for rank in range(1, len(popularity) + 1)))
+
+    def make_body():
+        size = min(rng.choice(cart_sizes), len(popularity))
+        products = set()
+        while len(products) < size:
+            products.update(rng.choices(popularity, cum_weights=cum_weights, k=size - len(products)))
+        lines = [{'product_id': product_id, 'quantity': rng.choice(quantities)} for product_id in products]
+        order_id = rng.choice(order_ids)
+        if size == 1:
+            return dict(lines[0], order_id=order_id)
+        return {'order_id': order_id, 'items': lines}
+    return make_body
+
+
+def replay_traffic(path):
+    """Тела запросов из JSONL по кругу; возвращает (make_body, товары из файла)"""
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                requests.append((record['path'], record['body']) if 'path' in record else as_request(record))
+    if not requests:
+        raise SystemExit(f'No requests in {path}')
+    product_ids = sorted({product_id for _, body in requests for product_id, _ in body_lines(body)})
+    return cycle(requests).__next__, product_ids
+
+
+def create_orders(dsn, count, rng):
+    """count новых заказов со статусом new у случайных клиентов"""
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM customers ORDER BY random() LIMIT %s", (count,))
+            customer_ids = [row[0] for row in cursor.fetchall()]
+            if not customer_ids:
+                raise SystemExit('No customers to create orders for')
+            cursor.execute("""
+                INSERT INTO orders (customer_id, current_status)
+                SELECT unnest(%s::int[]), 'new'
+                RETURNING id
+            """, ([rng.choice(customer_ids) for _ in range(count)],))
+            order_ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        return order_ids
+    finally:
+        conn.close()
+
+
+STOCK_SNAPSHOT_SQL = """
+    SELECT p.id,
+        CASE WHEN p.stock_shards > 0
+            THEN (SELECT COALESCE(sum(s.quantity), 0) FROM product_stock_shards s WHERE s.product_id = p.id)
+            ELSE p.quantity END AS stock,
+        LEAST(p.quantity,
+            (SELECT min(s.quantity) FROM product_stock_shards s WHERE s.product_id = p.id)) AS min_counter,
+        (SELECT COALESCE(sum(oi.quantity), 0) FROM order_items oi WHERE oi.product_id = p.id) AS in_orders
+    FROM products p
+    WHERE p.id = ANY(%s::int[])
+"""
+
+
+def stock_snapshot(dsn, product_ids):
+    """Остаток (с учетом шардов), наименьший счетчик остатка и количество в позициях по товарам"""
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(STOCK_SNAPSHOT_SQL, (list(product_ids),))
+            return {row[0]: {'stock': row[1], 'min_counter': row[2], 'in_orders': row[3]} for row in cursor.fetchall()}
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def check_stock(before, after, reports):
+    """Согласованность остатков после прогона; возвращает отчет с полем ok"""
+    reserved, unknown = Counter(), Counter()
+    for report in reports:
+        reserved.update(report['reserved'])
+        unknown.update(report['unknown'])
+
+    negative, mismatched, unconfirmed = [], [], []
+    for product_id, state in after.items():
+        if state['stock'] < 0 or state['min_counter'] < 0:
+            negative.append({'product_id': product_id, **state})
+        if product_id not in before:
+            continue
+        taken = before[product_id]['stock'] - state['stock']
+        added = state['in_orders'] - before[product_id]['in_orders']
+        if taken != added:
+            mismatched.append({'product_id': product_id, 'stock_decrement': taken, 'added_to_orders': added})
+        # Подтвержденное клиенту должно быть списано; сверх него - только запросы без ответа
+        if not reserved[product_id] <= added <= reserved[product_id] + unknown[product_id]:
+            unconfirmed.append({'product_id': product_id, 'added_to_orders': added,
+                                'confirmed': reserved[product_id], 'unknown': unknown[product_id]})
+    return {
+        'ok': not (negative or mismatched or unconfirmed),
+        'products': len(after),
+        'negative_stock': negative,
+        'stock_vs_orders_mismatch': mismatched,
+        'orders_vs_responses_mismatch': unconfirmed,
+    }
+
+
+def print_report(report):
+    print(f"{report['url']}: {report['requests']} requests, {report['rps']:.1f} req/s"
+          + (f" (target {report['rate']:g}/s, unsent {report['unsent']})" if report['rate'] else '')
+          + ', ' + ', '.join(f"p{q * 100:g} {report[f'p{q * 100:g}_ms'] or 0:.2f} ms" for q in PERCENTILES)
+          + f", max {report['max_ms'] or 0:.2f} ms")
+    for result, count in sorted(report['results'].items(), key=lambda x: -x[1]):
+        print(f"    {result}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('urls', nargs='+', help='base URLs of the servers to compare')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30, help='seconds per server')
+    parser.add_argument('--rate', type=float, help='open-loop arrival rate, requests per second')
+    parser.add_argument('--orders', nargs='+', default=['2', '5'], help='order ids or ranges (1-100)')
+    parser.add_argument('--products', nargs='+', default=['1-11'], help='product ids or ranges')
+    parser.add_argument('--zipf', type=float, default=0, help='product popularity skew exponent, 0 - uniform')
+    parser.add_argument('--cart-size', default='1', help='items per request, a number or a range (1-5)')
+    parser.add_argument('--quantity', default='1', help='quantity per item, a number or a range')
+    parser.add_argument('--replay', help='JSONL file with request bodies to replay instead of synthetic traffic')
+    parser.add_argument('--dsn', help='database to check stock consistency against after each run')
+    parser.add_argument('--new-orders', type=int, default=0, help='create this many new orders for the run (needs --dsn)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.replay:
+        make_body, product_ids = replay_traffic(args.replay)
+    else:
+        if args.new_orders and not args.dsn:
+            parser.error('--new-orders needs --dsn')
+        order_ids = (create_orders(args.dsn, args.new_orders, rng) if args.new_orders
+                     else [i for value in args.orders for i in id_range(value)])
+        product_ids = [i for value in args.products for i in id_range(value)]
+        make_body = synthetic_traffic(rng, order_ids, product_ids, args.zipf,
+                                      id_range(args.cart_size), id_range(args.quantity))
+
+    reports = []
+    for base_url in args.urls:
+        before = stock_snapshot(args.dsn, product_ids) if args.dsn else None
+        report = asyncio.run(run(base_url, args.concurrency, args.duration, make_body, args.rate, args.seed))
+        print_report(report)
+        if args.dsn:
+            report['stock_check'] = check_stock(before, stock_snapshot(args.dsn, product_ids), [report])
+            check = report['stock_check']
+            print(f"    stock check: {'ok' if check['ok'] else 'FAILED'} ({check['products']} products, "
+                  f"{len(check['negative_stock'])} negative, {len(check['stock_vs_orders_mismatch'])} "
+                  f"stock/orders mismatches, {len(check['orders_vs_responses_mismatch'])} orders/responses mismatches)")
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Проверка маршрутизации Database между primary и репликами.
+
+Нужны два экземпляра PostgreSQL, например primary и потоковая реплика из
+docker-compose.replica.yml (подойдут и два независимых сервера):
+    docker-compose -f docker-compose.yml -f docker-compose.replica.yml up -d postgres postgres-replica
+    DB_REPLICA_DSNS="host=localhost port=5433 dbname=postgres user=postgres password=postgres" \\
+        python -m benchmarks.replica_routing
+
+Экземпляр, на который попал запрос, определяется по адресу и порту сервера
+и сравнивается с прямыми подключениями к DB_DSN и DB_REPLICA_DSNS.
+Код возврата 1, если хотя бы одна проверка не прошла.
+"""
+import argparse
+import sys
+
+import psycopg2
+
+from config import Config
+from database import Database
+
+SERVER_SQL = "SELECT inet_server_addr()::text || ':' || inet_server_port()"
+
+
+def server_of(cursor):
+    cursor.execute(SERVER_SQL)
+    return cursor.fetchone()[0]
+
+
+def direct_server(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            return server_of(cursor)
+    finally:
+        conn.close()
+
+
+def routed_server(readonly):
+    with Database.connection(readonly=readonly) as conn:
+        with conn.cursor() as cursor:
+            return server_of(cursor)
+
+
+def check(name, ok, detail):
+    print(f"{'PASS' if ok else 'FAIL'} {name}: {detail}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reads', type=int, default=20, help='read connections to route')
+    args = parser.parse_args()
+
+    if not Config.DB_REPLICA_DSNS:
+        parser.error('DB_REPLICA_DSNS is not set')
+
+    primary = direct_server(Config.DB_DSN)
+    replicas = {direct_server(dsn) for dsn in Config.DB_REPLICA_DSNS}
+    if primary in replicas:
+        parser.error(f'primary and replica resolve to the same server {primary}')
+
+    results = []
+    Database.init_pool()
+    try:
+        written_on = Database.run_in_transaction(server_of, operation='routing_check')
+        results.append(check('transactions use primary', written_on == primary, written_on))
+
+        read_from = [routed_server(readonly=False) for _ in range(args.reads)]
+        results.append(check('default connections use primary', set(read_from) == {primary}, set(read_from)))
+
+        read_from = [routed_server(readonly=True) for _ in range(args.reads)]
+        results.append(check(
+            'reads are spread over all replicas', set(read_from) == replicas, set(read_from)
+        ))
+
+        try:
+            with Database.connection(readonly=True) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("CREATE TEMPORARY TABLE replica_routing_check (id int)")
+            results.append(check('replica connections are read-only', False, 'write succeeded'))
+        except psycopg2.Error as e:
+            results.append(check('replica connections are read-only', True, e.pgcode))
+
+        # Любое отставание, в т.ч. нулевое, считается недопустимым
+        max_lag = Config.DB_REPLICA_MAX_LAG
+        Config.DB_REPLICA_MAX_LAG = -1
+        Database._replica_lag.clear()
+        try:
+            read_from = routed_server(readonly=True)
+            results.append(check('lagging replicas fall back to primary', read_from == primary, read_from))
+        finally:
+            Config.DB_REPLICA_MAX_LAG = max_lag
+            Database._replica_lag.clear()
+    finally:
+        Database.close_pool()
+
+    # Недоступная реплика: чтение уходит в primary
+    replica_dsns = Config.DB_REPLICA_DSNS
+    Config.DB_REPLICA_DSNS = ['host=127.0.0.1 port=1 dbname=postgres connect_timeout=1']
+    Database.init_pool()
+    try:
+        read_from = routed_server(readonly=True)
+        results.append(check('unavailable replicas fall back to primary', read_from == primary, read_from))
+    finally:
+        Database.close_pool()
+        Config.DB_REPLICA_DSNS = replica_dsns
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
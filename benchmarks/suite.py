@@ -0,0 +1,245 @@
+"""
+Сквозной бенчмарк: функции слоя данных (streamlit_app, inventory, catalog),
+отчетные запросы sql_queries.sql и /api/orders/add-item под конкурентной нагрузкой.
+
+Запускать на базе с данными benchmarks.datagen:
+    python -m benchmarks.datagen --scale 0.1
+    python -m benchmarks.suite --url http://localhost:5000 --output results.json
+    python -m benchmarks.suite --baseline results.json --output results-new.json
+
+Результаты (p50/p95/max в мс по каждому сценарию, размеры таблиц, коммит)
+пишутся в JSON. С --baseline сценарии сравниваются с прошлым запуском,
+код возврата 1, если p50 какого-то сценария вырос больше чем на --threshold.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from psycopg2.extras import RealDictCursor
+
+from benchmarks.load_test import percentile, run
+from catalog import catalog
+from database import Database
+from inventory import ACTIVE_ORDER_STATUSES, ReservationError, reserve_item, reserve_items
+from migrate import split_statements
+
+SQL_QUERIES = Path(__file__).resolve().parent.parent / 'sql_queries.sql'
+# Разница p50 меньше этой величины считается шумом
+MIN_REGRESSION_MS = 1.0
+
+
+def measure(func, repeat):
+    """Время выполнения func: прогрев и repeat замеров"""
+    func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        'runs': repeat,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def sample_ids(cursor):
+    """Id для параметров сценариев: активные заказы, популярные и случайные товары, клиент"""
+    cursor.execute("""
+        SELECT id FROM orders
+        WHERE current_status = ANY(%s::status[])
+        ORDER BY order_date DESC, id DESC
+        LIMIT 1000
+    """, (list(ACTIVE_ORDER_STATUSES),))
+    active_orders = [row['id'] for row in cursor.fetchall()]
+    cursor.execute("SELECT product_id FROM product_sales_total ORDER BY sold_amount DESC LIMIT 100")
+    hot_products = [row['product_id'] for row in cursor.fetchall()]
+    cursor.execute("SELECT id FROM products TABLESAMPLE SYSTEM (1) LIMIT 1000")
+    products = [row['id'] for row in cursor.fetchall()] or hot_products
+    cursor.execute("SELECT id, customer_id FROM orders ORDER BY id DESC LIMIT 1")
+    last_order = cursor.fetchone()
+    if not active_orders or not products or not last_order:
+        raise SystemExit('No data to benchmark, load it with benchmarks.datagen first')
+    return {
+        'active_orders': active_orders,
+        'hot_products': hot_products or products,
+        'products': products,
+        'order_id': last_order['id'],
+        'customer_id': last_order['customer_id'],
+    }
+
+
+def rolled_back(func):
+    """Сценарий записи: выполняется в транзакции, которая затем откатывается"""
+    def scenario():
+        with Database.connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    func(cursor)
+            except ReservationError:
+                pass
+            finally:
+                conn.rollback()
+    return scenario
+
+
+def data_layer_scenarios(ids):
+    """Функции чтения streamlit_app без кэша Streamlit, резервирование inventory и кэш справочника"""
+    import streamlit_app
+
+    def raw(func):
+        # cached_query оборачивает исходную функцию через functools.wraps
+        return func.__wrapped__
+
+    orders_page = raw(streamlit_app.get_orders_page)
+    products_page = raw(streamlit_app.get_products_page)
+    _, orders_cursor = orders_page()
+    _, products_cursor = products_page()
+
+    return {
+        'get_orders_page first': lambda: orders_page(),
+        'get_orders_page next': lambda: orders_page(after=orders_cursor),
+        'get_orders_page active': lambda: orders_page(ACTIVE_ORDER_STATUSES),
+        'get_orders_page customer search': lambda: orders_page(search='Customer 4242'),
+        'get_order_details': lambda: raw(streamlit_app.get_order_details)((ids['order_id'],)),
+        'get_order_details x100': lambda: raw(streamlit_app.get_order_details)(tuple(ids['active_orders'][:100])),
+        'get_products_page first': lambda: products_page(),
+        'get_products_page next': lambda: products_page(after=products_cursor),
+        'get_products_page search': lambda: products_page(search='Product 4242'),
+        'get_product_stock': lambda: raw(streamlit_app.get_product_stock)(random.choice(ids['products'])),
+        'get_customers': lambda: raw(streamlit_app.get_customers)(),
+        'get_dashboard_stats': lambda: raw(streamlit_app.get_dashboard_stats)(),
+        'catalog.get_products': lambda: catalog.get_products(random.sample(ids['products'], 10)),
+        'reserve_item (rolled back)': rolled_back(lambda cursor: reserve_item(
+            cursor, random.choice(ids['active_orders']), random.choice(ids['hot_products']), 1
+        )),
+        'reserve_items x5 (rolled back)': rolled_back(lambda cursor: reserve_items(
+            cursor, random.choice(ids['active_orders']),
+            [{'product_id': product_id, 'quantity': 1} for product_id in random.sample(ids['products'], 5)]
+        )),
+    }
+
+
+def report_scenarios():
+    """Запросы sql_queries.sql; для CREATE VIEW замеряется чтение представления"""
+    scenarios = {}
+    for number, statement in enumerate(split_statements(SQL_QUERIES.read_text(encoding='utf-8')), 1):
+        words = statement.split()
+        if words[:2] == ['CREATE', 'VIEW']:
+            query, name = f"SELECT * FROM {words[2]}", f"view {words[2]}"
+        elif words[0].upper() in ('SELECT', 'WITH'):
+            query, name = statement, f"query {number}"
+        else:
+            continue
+
+        def scenario(query=query):
+            with Database.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query)
+                    cursor.fetchall()
+                conn.rollback()
+        scenarios[name] = scenario
+    return scenarios
+
+
+def table_sizes():
+    with Database.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT relname, reltuples::bigint FROM pg_class
+                WHERE relkind IN ('r', 'p', 'm') AND relnamespace = 'public'::regnamespace
+                ORDER BY relname
+            """)
+            return dict(cursor.fetchall())
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Сценарии, у которых p50 вырос больше чем на threshold относительно baseline"""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not previous.get('p50_ms') or not current.get('p50_ms'):
+            continue
+        ratio = current['p50_ms'] / previous['p50_ms']
+        if ratio > 1 + threshold and current['p50_ms'] - previous['p50_ms'] > MIN_REGRESSION_MS:
+            regressions.append((name, previous['p50_ms'], current['p50_ms'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='measured runs per scenario')
+    parser.add_argument('--reports-repeat', type=int, default=3, help='measured runs per report query')
+    parser.add_argument('--url', help='base URL of the API for the add-item load scenario')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of endpoint load')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='results file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative p50 slowdown')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    Database.init_pool()
+    with Database.connection(readonly=True) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            ids = sample_ids(cursor)
+
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'tables': table_sizes(),
+        'scenarios': {},
+    }
+    groups = [('data_layer', data_layer_scenarios(ids), args.repeat),
+              ('reports', report_scenarios(), args.reports_repeat)]
+    for group, scenarios, repeat in groups:
+        for name, scenario in scenarios.items():
+            stats = measure(scenario, repeat)
+            results['scenarios'][f"{group}/{name}"] = stats
+            print(f"{group}/{name}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms")
+
+    if args.url:
+        def make_body():
+            return {
+                'order_id': random.choice(ids['active_orders']),
+                'product_id': random.choice(ids['hot_products']),
+                'quantity': 1
+            }
+        report = asyncio.run(run(args.url, args.concurrency, args.duration, make_body))
+        results['scenarios']['endpoint/add-item'] = report
+        print(f"endpoint/add-item: {report['rps']:.1f} req/s, "
+              f"p50 {report['p50_ms'] or 0:.2f} ms, p99 {report['p99_ms'] or 0:.2f} ms, {report['results']}")
+
+    Database.close_pool()
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: p50 {before:.2f} -> {after:.2f} ms (x{ratio:.2f})")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,554 @@
+"""
+Массовый импорт и экспорт заказов через COPY.
+
+Импорт: файл CSV (с заголовком) или NDJSON, одна запись - одна позиция:
+    external_id, customer_id, order_date, status, product_id, quantity
+external_id - номер заказа во внешней системе, позиции с одним external_id
+образуют один заказ (вместо external_id можно указать order_id - так
+повторно загружается файл экспорта). order_date и status необязательны,
+цена позиции берется из products.
+
+Записи потоком загружаются во временную таблицу через COPY FROM STDIN,
+проверяются набором запросов (клиент, товар, статус, согласованность полей
+заказа, остатки), затем заказы, позиции и списание остатков записываются
+несколькими INSERT/UPDATE ... SELECT. Заказ, в котором отклонена хотя бы
+одна запись, не создается целиком; причины отказа возвращаются по номерам
+записей. Остатки распределяются между заказами в порядке файла.
+
+Экспорт: COPY (SELECT ...) TO STDOUT в CSV, строки пишутся в файл по мере
+чтения и целиком в памяти не хранятся.
+
+Запуск: python bulk_orders.py import orders.csv [--rejected rejected.csv] [--dry-run]
+        python bulk_orders.py import orders.ndjson --format ndjson
+        python bulk_orders.py export orders.csv [--since 2025-01-01] [--until 2025-02-01] [--status new]
+"""
+import argparse
+import csv
+import json
+import queue
+import sys
+import threading
+from datetime import datetime
+
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from config import Config
+from database import Database
+from metrics import BULK_IMPORT_ROWS, timed_step
+
+FORMATS = ('csv', 'ndjson')
+MAX_INT = 2 ** 31 - 1
+# Символов в одной порции, которую COPY FROM читает из потока записей
+COPY_READ_SIZE = 64 * 1024
+# Порций CSV в очереди потокового экспорта
+EXPORT_QUEUE_CHUNKS = 64
+
+STAGE_SQL = """
+    CREATE TEMP TABLE import_rows (
+        line INT PRIMARY KEY,
+        external_id TEXT,
+        customer_id INT,
+        order_date TIMESTAMP,
+        status TEXT,
+        product_id INT,
+        quantity INT,
+        error TEXT
+    )
+"""
+
+# Проверки по порядку; каждая отмечает только еще не отклоненные записи
+VALIDATION_SQL = [
+    ('customers', """
+        UPDATE import_rows r SET error = 'Customer not found'
+        WHERE r.error IS NULL
+            AND NOT EXISTS (SELECT 1 FROM customers c WHERE c.id = r.customer_id)
+    """),
+    ('products', """
+        UPDATE import_rows r SET error = 'Product not found'
+        WHERE r.error IS NULL
+            AND NOT EXISTS (SELECT 1 FROM products p WHERE p.id = r.product_id)
+    """),
+    ('statuses', """
+        UPDATE import_rows SET error = 'Invalid status'
+        WHERE error IS NULL AND status <> ALL(enum_range(NULL::status)::text[])
+    """),
+    ('order_fields', """
+        UPDATE import_rows r SET error = 'Conflicting order fields'
+        FROM (
+            SELECT external_id FROM import_rows
+            GROUP BY external_id
+            HAVING count(DISTINCT customer_id) > 1
+                OR count(DISTINCT order_date) > 1
+                OR count(DISTINCT status) > 1
+        ) c
+        WHERE r.external_id = c.external_id AND r.error IS NULL
+    """),
+]
+
+# Заказ отклоняется целиком, если отклонена хотя бы одна его запись
+REJECT_ORDERS_SQL = """
+    UPDATE import_rows SET error = 'Order has rejected rows'
+    WHERE error IS NULL
+        AND external_id IN (SELECT external_id FROM import_rows WHERE error IS NOT NULL)
+"""
+
+# Пробный прогон секции не создает: записи за месяцы без секции orders отклоняются
+MISSING_PARTITION_SQL = """
+    UPDATE import_rows SET error = 'No partition for order month'
+    WHERE error IS NULL
+        AND to_regclass(format('public.%I', 'orders' || to_char(COALESCE(order_date, LOCALTIMESTAMP), '_YYYY_MM'))) IS NULL
+"""
+
+# Остатки затрагиваемых товаров (строки products или шарды) блокируются по возрастанию id
+LOCK_PRODUCTS_SQL = """
+    SELECT p.id FROM products p
+    WHERE p.id IN (SELECT product_id FROM import_rows WHERE error IS NULL)
+        AND p.stock_shards = 0
+    ORDER BY p.id
+    FOR UPDATE
+"""
+LOCK_SHARDS_SQL = """
+    SELECT s.product_id FROM product_stock_shards s
+    WHERE s.product_id IN (SELECT product_id FROM import_rows WHERE error IS NULL)
+    ORDER BY s.product_id, s.shard
+    FOR UPDATE
+"""
+
+# Нарастающий итог спроса на товар по заказам в порядке файла; записи товаров,
+# на которых итог превысил остаток, отклоняются. Спрос заказа, отклоненного
+# из-за другого товара, тоже входит в итог - оценка с запасом, зато одним запросом
+STOCK_CHECK_SQL = """
+    WITH demand AS (
+        SELECT external_id, product_id, sum(quantity) AS quantity, min(line) AS first_line
+        FROM import_rows
+        WHERE error IS NULL
+        GROUP BY external_id, product_id
+    ), ordered AS (
+        SELECT demand.*, min(first_line) OVER (PARTITION BY external_id) AS order_line
+        FROM demand
+    ), cumulative AS (
+        SELECT o.external_id, o.product_id,
+            sum(o.quantity) OVER (
+                PARTITION BY o.product_id ORDER BY o.order_line ROWS UNBOUNDED PRECEDING
+            ) AS needed,
+            CASE WHEN p.stock_shards > 0
+                THEN (SELECT COALESCE(sum(s.quantity), 0) FROM product_stock_shards s WHERE s.product_id = p.id)
+                ELSE p.quantity END AS available
+        FROM ordered o
+        JOIN products p ON p.id = o.product_id
+    )
+    UPDATE import_rows r SET error = 'Insufficient stock'
+    FROM cumulative c
+    WHERE r.external_id = c.external_id AND r.product_id = c.product_id
+        AND c.needed > c.available AND r.error IS NULL
+"""
+
+# Id заказов выделяются заранее из последовательности orders, чтобы связать их с external_id
+ALLOCATE_ORDERS_SQL = """
+    CREATE TEMP TABLE import_orders ON COMMIT DROP AS
+    SELECT external_id, nextval(pg_get_serial_sequence('orders', 'id')) AS order_id,
+        min(customer_id) AS customer_id, COALESCE(max(order_date), LOCALTIMESTAMP) AS order_date,
+        min(status) AS status, min(line) AS first_line
+    FROM import_rows
+    WHERE error IS NULL
+    GROUP BY external_id
+"""
+
+WRITE_SQL = [
+    ('orders', """
+        INSERT INTO orders (id, customer_id, order_date, current_status)
+        OVERRIDING SYSTEM VALUE
+        SELECT order_id, customer_id, order_date, status::status
+        FROM import_orders
+        ORDER BY order_id
+    """),
+    ('items', """
+        INSERT INTO order_items (order_id, order_date, product_id, quantity, price)
+        SELECT o.order_id, o.order_date, r.product_id, sum(r.quantity), p.price
+        FROM import_rows r
+        JOIN import_orders o ON o.external_id = r.external_id
+        JOIN products p ON p.id = r.product_id
+        WHERE r.error IS NULL
+        GROUP BY o.order_id, o.order_date, r.product_id, p.price
+        ORDER BY o.order_id, r.product_id
+    """),
+    ('stock', """
+        UPDATE products p
+        SET quantity = p.quantity - d.quantity
+        FROM (
+            SELECT product_id, sum(quantity) AS quantity
+            FROM import_rows
+            WHERE error IS NULL
+            GROUP BY product_id
+        ) d
+        WHERE p.id = d.product_id AND p.stock_shards = 0
+    """),
+    # Шарды уже заблокированы этой транзакцией, списание не может не пройти
+    ('sharded_stock', """
+        SELECT d.product_id
+        FROM (
+            SELECT product_id, sum(quantity) AS quantity
+            FROM import_rows
+            WHERE error IS NULL
+            GROUP BY product_id
+        ) d
+        JOIN products p ON p.id = d.product_id
+        WHERE p.stock_shards > 0 AND NOT take_sharded_stock(d.product_id, d.quantity::int)
+    """),
+]
+
+EXPORT_SQL = """
+    SELECT o.id AS order_id, o.customer_id, o.order_date, o.current_status AS status,
+        oi.product_id, oi.quantity, oi.price
+    FROM orders o
+    LEFT JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
+    WHERE {filters}
+    ORDER BY o.id, oi.product_id
+"""
+
+
+def read_records(lines, fmt):
+    """Записи файла: словари полей; None - запись, которую не удалось разобрать"""
+    if fmt == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    for text in lines:
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else None
+
+
+def positive_int(value):
+    """Целое 1..2^31-1 из числа JSON или строки CSV, иначе None"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and 0 < value <= MAX_INT:
+        return value
+    return None
+
+
+def parse_record(record):
+    """
+    Разбор записи: (external_id, customer_id, order_date, status, product_id, quantity, error).
+    Ошибки формата отмечаются здесь, проверки по данным БД - в VALIDATION_SQL
+    """
+    if record is None:
+        return None, None, None, None, None, None, 'Malformed record'
+
+    external_id = record.get('external_id') or record.get('order_id')
+    external_id = str(external_id).strip() if external_id not in (None, '') else None
+    customer_id = positive_int(record.get('customer_id'))
+    product_id = positive_int(record.get('product_id'))
+    quantity = positive_int(record.get('quantity'))
+    status = record.get('status') or 'new'
+
+    order_date, error = record.get('order_date') or None, None
+    if order_date is not None:
+        try:
+            order_date = datetime.fromisoformat(str(order_date))
+        except ValueError:
+            order_date, error = None, 'Invalid order_date'
+
+    if external_id is None:
+        error = 'Missing required field: external_id'
+    elif customer_id is None:
+        error = 'Customer id must be a positive integer'
+    elif product_id is None:
+        error = 'Product id must be a positive integer'
+    elif quantity is None:
+        error = 'Quantity must be a positive integer'
+    return external_id, customer_id, order_date, str(status), product_id, quantity, error
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return r'\N'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyStream:
+    """Файловый объект для copy_expert: строки COPY из итератора записей, читаются порциями"""
+
+    def __init__(self, records):
+        self._lines = (
+            '\t'.join(copy_value(value) for value in (line, *parse_record(record))) + '\n'
+            for line, record in enumerate(records, 1)
+        )
+        self._buffer = ''
+
+    def read(self, size=COPY_READ_SIZE):
+        size = COPY_READ_SIZE if size is None or size < 0 else size
+        parts, length = [self._buffer], len(self._buffer)
+        for text in self._lines:
+            parts.append(text)
+            length += len(text)
+            if length >= size:
+                break
+        data = ''.join(parts)
+        chunk, self._buffer = data[:size], data[size:]
+        return chunk
+
+
+def ensure_partitions(conn, cursor):
+    """
+    Секции orders/order_items за месяцы загруженных в import_rows заказов
+    (migrations/0009_partition_orders.sql). Создаются отдельной короткой транзакцией
+    до блокировок товаров: DDL блокирует orders целиком, поэтому не ждет дольше
+    ORDER_PARTITIONS_LOCK_TIMEOUT и не держит блокировку до конца импорта.
+    Если все секции уже есть, create_order_partitions таблицы не блокирует
+    """
+    cursor.execute("""
+        SELECT min(COALESCE(order_date, LOCALTIMESTAMP))::date AS first,
+            max(COALESCE(order_date, LOCALTIMESTAMP))::date AS last
+        FROM import_rows
+        WHERE error IS NULL
+    """)
+    dates = cursor.fetchone()
+    if dates['first'] is not None:
+        cursor.execute("SELECT set_config('lock_timeout', %s, true)", (str(Config.ORDER_PARTITIONS_LOCK_TIMEOUT),))
+        cursor.execute("SELECT create_order_partitions(%s, %s)", (dates['first'], dates['last']))
+    conn.commit()
+
+
+def import_orders(conn, lines, fmt='csv', dry_run=False, rejected_limit=1000, rejected_out=None):
+    """
+    Импорт заказов из строк файла lines на conn. Записи загружаются во временную
+    таблицу и фиксируются, затем создаются недостающие секции, а проверки и запись
+    заказов выполняются одной транзакцией.
+
+    Возвращает {'orders', 'accepted_rows', 'rejected_rows', 'rejected', 'dry_run'}:
+    rejected - первые rejected_limit отклоненных записей {'line', 'external_id', 'error'};
+    все отклоненные записи в CSV пишутся в rejected_out, если он задан.
+    С dry_run=True выполняются только проверки: без блокировок остатков и записи
+    заказов, записи за месяцы без секций отклоняются.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            with timed_step('import_orders', 'copy'):
+                cursor.execute(STAGE_SQL)
+                cursor.copy_expert(
+                    "COPY import_rows (line, external_id, customer_id, order_date, status,"
+                    " product_id, quantity, error) FROM STDIN",
+                    CopyStream(read_records(lines, fmt))
+                )
+                cursor.execute("ANALYZE import_rows")
+            # Временная таблица переживает коммит; транзакция импорта начинается после секций
+            with timed_step('import_orders', 'partitions'):
+                if dry_run:
+                    cursor.execute(MISSING_PARTITION_SQL)
+                else:
+                    ensure_partitions(conn, cursor)
+
+            for step, statement in VALIDATION_SQL:
+                with timed_step('import_orders', step):
+                    cursor.execute(statement)
+            with timed_step('import_orders', 'stock_check'):
+                cursor.execute(REJECT_ORDERS_SQL)
+                # Пробный прогон остатки не блокирует: проверка по текущему снимку
+                if not dry_run:
+                    cursor.execute(LOCK_PRODUCTS_SQL)
+                    cursor.execute(LOCK_SHARDS_SQL)
+                cursor.execute(STOCK_CHECK_SQL)
+                cursor.execute(REJECT_ORDERS_SQL)
+
+            orders = 0
+            if not dry_run:
+                with timed_step('import_orders', 'allocate'):
+                    cursor.execute(ALLOCATE_ORDERS_SQL)
+                for step, statement in WRITE_SQL:
+                    with timed_step('import_orders', step):
+                        cursor.execute(statement)
+                        if step == 'orders':
+                            orders = cursor.rowcount
+                        elif step == 'sharded_stock' and cursor.fetchall():
+                            raise RuntimeError('Sharded stock changed during import')
+
+            cursor.execute("""
+                SELECT count(*) FILTER (WHERE error IS NULL) AS accepted,
+                    count(*) FILTER (WHERE error IS NOT NULL) AS rejected
+                FROM import_rows
+            """)
+            counts = cursor.fetchone()
+            cursor.execute("""
+                SELECT line, external_id, error FROM import_rows
+                WHERE error IS NOT NULL
+                ORDER BY line
+                LIMIT %s
+            """, (rejected_limit,))
+            rejected = cursor.fetchall()
+            if rejected_out is not None:
+                cursor.copy_expert(
+                    "COPY (SELECT line, external_id, error FROM import_rows"
+                    " WHERE error IS NOT NULL ORDER BY line) TO STDOUT WITH (FORMAT csv, HEADER true)",
+                    rejected_out
+                )
+
+        if dry_run:
+            conn.rollback()
+        else:
+            with timed_step('import_orders', 'commit'):
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # Соединение возвращается в пул: временная таблица удаляется явно
+        # (вместе с разорванным соединением ее уже нет)
+        if not conn.closed:
+            with conn.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS import_rows")
+            conn.commit()
+
+    if not dry_run:
+        BULK_IMPORT_ROWS.labels('accepted').inc(counts['accepted'])
+        BULK_IMPORT_ROWS.labels('rejected').inc(counts['rejected'])
+    return {
+        'orders': 0 if dry_run else orders,
+        'accepted_rows': counts['accepted'],
+        'rejected_rows': counts['rejected'],
+        'rejected': rejected,
+        'dry_run': dry_run,
+    }
+
+
+def export_query(cursor, since=None, until=None, status=None):
+    """SELECT для COPY TO с подставленными фильтрами (COPY не принимает параметры)"""
+    filters = [sql.SQL('true')]
+    if since is not None:
+        filters.append(sql.SQL('o.order_date >= {}').format(sql.Literal(since)))
+    if until is not None:
+        filters.append(sql.SQL('o.order_date < {}').format(sql.Literal(until)))
+    if status is not None:
+        filters.append(sql.SQL('o.current_status = {}::status').format(sql.Literal(status)))
+    query = sql.SQL(EXPORT_SQL).format(filters=sql.SQL(' AND ').join(filters))
+    return sql.SQL('COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)').format(query).as_string(cursor)
+
+
+def export_orders(conn, out, since=None, until=None, status=None):
+    """Выгрузка заказов с позициями в CSV: COPY TO пишет в out порциями по мере чтения"""
+    with conn.cursor() as cursor:
+        with timed_step('export_orders', 'copy'):
+            cursor.copy_expert(export_query(cursor, since, until, status), out)
+    conn.rollback()
+
+
+class _QueueWriter:
+    """Файловый объект для copy_expert: порции уходят в очередь потребителя"""
+
+    def __init__(self, chunks, stop):
+        self._chunks = chunks
+        self._stop = stop
+
+    def write(self, data):
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(data, timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+        # Потребитель ушел: исключение прерывает COPY
+        raise BrokenPipeError('Export consumer is gone')
+
+
+def stream_export(since=None, until=None, status=None):
+    """
+    Генератор порций CSV для потокового HTTP-ответа. COPY TO выполняется
+    в отдельном потоке на соединении с реплики и пишет в ограниченную очередь,
+    поэтому в памяти держится не больше EXPORT_QUEUE_CHUNKS порций.
+    """
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            with Database.connection(readonly=True) as conn:
+                export_orders(conn, _QueueWriter(chunks, stop), since, until, status)
+            result = done
+        except Exception as e:
+            result = e
+        while not stop.is_set():
+            try:
+                chunks.put(result, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    threading.Thread(target=produce, name='orders-export', daemon=True).start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='import orders from a CSV or NDJSON file')
+    import_parser.add_argument('file', help="input file, '-' for stdin")
+    import_parser.add_argument('--format', choices=FORMATS,
+                               help='input format (default: by file extension, csv for stdin)')
+    import_parser.add_argument('--rejected', help='write all rejected rows to this CSV file')
+    import_parser.add_argument('--dry-run', action='store_true', help='validate only, do not create orders')
+
+    export_parser = commands.add_parser('export', help='export orders with items to CSV')
+    export_parser.add_argument('file', help="output file, '-' for stdout")
+    export_parser.add_argument('--since', type=datetime.fromisoformat, help='order_date lower bound (inclusive)')
+    export_parser.add_argument('--until', type=datetime.fromisoformat, help='order_date upper bound (exclusive)')
+    export_parser.add_argument('--status')
+    args = parser.parse_args()
+
+    Database.init_pool(minconn=1, maxconn=1)
+    try:
+        if args.command == 'import':
+            fmt = args.format or ('ndjson' if args.file.endswith(('.ndjson', '.jsonl')) else 'csv')
+            source = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8', newline='')
+            rejected_out = open(args.rejected, 'w', encoding='utf-8', newline='') if args.rejected else None
+            try:
+                with Database.connection() as conn:
+                    report = import_orders(conn, source, fmt, args.dry_run, rejected_limit=20,
+                                           rejected_out=rejected_out)
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+                if rejected_out is not None:
+                    rejected_out.close()
+            for row in report['rejected']:
+                print(f"line {row['line']} ({row['external_id']}): {row['error']}", file=sys.stderr)
+            if args.dry_run:
+                summary = f"Validated {report['accepted_rows']} rows"
+            else:
+                summary = f"Imported {report['accepted_rows']} rows into {report['orders']} orders"
+            print(f"{summary}, rejected {report['rejected_rows']} rows")
+        else:
+            out = sys.stdout if args.file == '-' else open(args.file, 'w', encoding='utf-8', newline='')
+            try:
+                with Database.connection(readonly=True) as conn:
+                    export_orders(conn, out, args.since, args.until, args.status)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+    finally:
+        Database.close_pool()
+
+
+if __name__ == '__main__':
+    main()
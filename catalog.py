@@ -0,0 +1,189 @@
+"""
+Кэш справочника товаров и категорий в памяти процесса.
+
+Хранит название, цену и категорию товара и дерево категорий с корнем
+каждой категории. Остатков в кэше нет: они меняются при каждом
+резервировании и читаются только из БД. Постраничный список товаров
+тоже читается из БД keyset-запросом по индексу (name, id): перебор
+всего справочника в памяти на каждую страницу дороже.
+
+Изменения products/categories приходят через LISTEN/NOTIFY
+(канал catalog_changes, migrations/0005_catalog_notify.sql): поток
+слушателя сбрасывает измененные записи. Записи старше CATALOG_CACHE_TTL
+перечитываются на случай пропущенных уведомлений.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+from config import Config
+from database import Database
+from metrics import CATALOG_INVALIDATIONS, CATALOG_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'catalog_changes'
+LISTEN_PING_INTERVAL = 30  # проверка соединения слушателя без уведомлений, секунды
+LISTEN_RECONNECT_DELAY = 1
+
+
+class Catalog:
+    """
+    LRU товаров по id и дерево категорий.
+    Возвращаемые словари общие для всех потоков, изменять их нельзя.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._products = OrderedDict()  # id -> (время загрузки, товар)
+        self._categories = None         # (время загрузки, {id: категория})
+        # Растет при каждом сбросе: чтение, начатое до сброса, в кэш не попадает
+        self._generation = 0
+        self._listener_pid = None
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
+
+    def start_listener(self):
+        """Запуск потока LISTEN в текущем процессе (после fork - заново)"""
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, name='catalog-listener', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                conn = psycopg2.connect(Config.DB_DSN)
+                try:
+                    conn.autocommit = True
+                    with conn.cursor() as cursor:
+                        cursor.execute(f"LISTEN {CHANNEL}")
+                        # Изменения, сделанные без подписки, неизвестны
+                        self.clear()
+                        logger.info("Catalog cache subscribed to %s", CHANNEL)
+                        while True:
+                            if select.select([conn], [], [], LISTEN_PING_INTERVAL) == ([], [], []):
+                                cursor.execute("SELECT 1")
+                            conn.poll()
+                            while conn.notifies:
+                                self.invalidate(conn.notifies.pop(0).payload)
+                finally:
+                    conn.close()
+            except (psycopg2.Error, OSError) as e:
+                logger.error(f"Catalog listener failed: {e}")
+                time.sleep(LISTEN_RECONNECT_DELAY)
+
+    def invalidate(self, payload):
+        """Сброс по уведомлению '<таблица>:<id>'"""
+        table, _, key = payload.partition(':')
+        CATALOG_INVALIDATIONS.labels(table).inc()
+        with self._lock:
+            self._generation += 1
+            if table == 'products':
+                self._products.pop(int(key), None)
+            elif table == 'categories':
+                self._categories = None
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._products.clear()
+            self._categories = None
+
+    def get_products(self, product_ids):
+        """Товары по id: {id: {'id', 'name', 'price', 'category_id'}}; несуществующих id в ответе нет"""
+        self.start_listener()
+        found, missing = {}, []
+        with self._lock:
+            generation = self._generation
+            for product_id in set(product_ids):
+                entry = self._products.get(product_id)
+                if self._fresh(entry):
+                    self._products.move_to_end(product_id)
+                    found[product_id] = entry[1]
+                else:
+                    missing.append(product_id)
+        CATALOG_LOOKUPS.labels('hit').inc(len(found))
+        if not missing:
+            return found
+
+        # Отсутствие товара не кэшируется: новый товар доступен сразу после коммита
+        CATALOG_LOOKUPS.labels('miss').inc(len(missing))
+        loaded_at = time.monotonic()
+        with Database.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, name, price, category_id
+                    FROM products
+                    WHERE id = ANY(%s::int[])
+                """, (missing,))
+                loaded = [
+                    {'id': row[0], 'name': row[1], 'price': row[2], 'category_id': row[3]}
+                    for row in cursor.fetchall()
+                ]
+
+        with self._lock:
+            if self._generation == generation:
+                for product in loaded:
+                    self._products[product['id']] = (loaded_at, product)
+                    self._products.move_to_end(product['id'])
+                while len(self._products) > self.maxsize:
+                    self._products.popitem(last=False)
+        found.update((product['id'], product) for product in loaded)
+        return found
+
+    def get_product(self, product_id):
+        return self.get_products([product_id]).get(product_id)
+
+    def categories(self):
+        """Категории: {id: {'id', 'name', 'parent_id', 'root_id', 'children'}}"""
+        self.start_listener()
+        with self._lock:
+            entry, generation = self._categories, self._generation
+        if self._fresh(entry):
+            return entry[1]
+
+        loaded_at = time.monotonic()
+        with Database.connection() as conn:
+            with conn.cursor() as cursor:
+                # Корни уже посчитаны триггерами в category_roots
+                cursor.execute("""
+                    SELECT c.id, c.name, c.parent_id, COALESCE(r.root_id, c.id)
+                    FROM categories c
+                    LEFT JOIN category_roots r ON r.category_id = c.id
+                """)
+                categories = {
+                    row[0]: {'id': row[0], 'name': row[1], 'parent_id': row[2], 'root_id': row[3], 'children': []}
+                    for row in cursor.fetchall()
+                }
+        for category in sorted(categories.values(), key=lambda c: (c['name'], c['id'])):
+            parent = categories.get(category['parent_id'])
+            if parent is not None:
+                parent['children'].append(category['id'])
+
+        with self._lock:
+            if self._generation == generation:
+                self._categories = (loaded_at, categories)
+        return categories
+
+    def category_path(self, category_id):
+        """Названия категорий от корня до category_id"""
+        categories = self.categories()
+        path, seen = [], set()
+        while category_id in categories and category_id not in seen:
+            seen.add(category_id)
+            path.append(categories[category_id]['name'])
+            category_id = categories[category_id]['parent_id']
+        return path[::-1]
+
+
+catalog = Catalog(Config.CATALOG_CACHE_SIZE, Config.CATALOG_CACHE_TTL)
@@ -0,0 +1,105 @@
+"""
+Запросы к дереву категорий (category_tree, migrations/0011_category_tree.sql).
+
+Поддерево, предки и товары поддерева читаются одним запросом по GiST-индексу
+ltree-пути вместо рекурсивного обхода parent_id; число прямых потомков и
+размер поддерева хранятся готовыми. Курсор - RealDictCursor.
+"""
+
+# Наибольшее число узлов поддерева и товаров в одном ответе
+MAX_SUBTREE_NODES = 1000
+MAX_PRODUCTS_PAGE = 200
+
+NODE_COLUMNS = """
+    t.category_id, c.name, c.parent_id, t.path::text AS path, nlevel(t.path) AS depth,
+    t.direct_children, t.descendants
+"""
+
+ROOTS_SQL = f"""
+    SELECT {NODE_COLUMNS}
+    FROM categories c
+    JOIN category_tree t ON t.category_id = c.id
+    WHERE c.parent_id IS NULL
+    ORDER BY c.name, c.id
+"""
+
+NODE_SQL = f"""
+    SELECT {NODE_COLUMNS}
+    FROM category_tree t
+    JOIN categories c ON c.id = t.category_id
+    WHERE t.category_id = %(category_id)s
+"""
+
+# Предки от корня, последний - сам узел
+ANCESTORS_SQL = f"""
+    WITH node AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+    SELECT {NODE_COLUMNS}
+    FROM node
+    JOIN category_tree t ON t.path @> node.path
+    JOIN categories c ON c.id = t.category_id
+    ORDER BY nlevel(t.path)
+"""
+
+# Узлы поддерева до depth уровней ниже корня, в порядке обхода в глубину
+SUBTREE_SQL = f"""
+    WITH root AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+    SELECT {NODE_COLUMNS}
+    FROM root
+    JOIN category_tree t ON t.path ~ (root.path::text || '.*{{0,' || %(depth)s || '}}')::lquery
+    JOIN categories c ON c.id = t.category_id
+    ORDER BY t.path
+    LIMIT %(limit)s
+"""
+
+# Товары всего поддерева, keyset-пагинация по id
+SUBTREE_PRODUCTS_SQL = """
+    WITH root AS (SELECT path FROM category_tree WHERE category_id = %(category_id)s)
+    SELECT p.id, p.name, p.price, p.category_id
+    FROM root
+    JOIN category_tree t ON t.path <@ root.path
+    JOIN products p ON p.category_id = t.category_id
+    WHERE p.id > %(after)s
+    ORDER BY p.id
+    LIMIT %(limit)s
+"""
+
+
+def root_categories(cursor):
+    """Корневые категории со счетчиками"""
+    cursor.execute(ROOTS_SQL)
+    return cursor.fetchall()
+
+
+def category_node(cursor, category_id):
+    """Категория со счетчиками или None"""
+    cursor.execute(NODE_SQL, {'category_id': category_id})
+    return cursor.fetchone()
+
+
+def ancestors(cursor, category_id):
+    """Путь от корня до категории включительно"""
+    cursor.execute(ANCESTORS_SQL, {'category_id': category_id})
+    return cursor.fetchall()
+
+
+def subtree(cursor, category_id, depth=1, limit=MAX_SUBTREE_NODES):
+    """Категория и ее потомки не глубже depth уровней (не больше limit узлов)"""
+    if depth < 0:
+        raise ValueError('Depth must be a non-negative integer')
+    if not 1 <= limit <= MAX_SUBTREE_NODES:
+        raise ValueError(f'Limit must be between 1 and {MAX_SUBTREE_NODES}')
+    cursor.execute(SUBTREE_SQL, {'category_id': category_id, 'depth': depth, 'limit': limit})
+    return cursor.fetchall()
+
+
+def subtree_products(cursor, category_id, after=0, limit=50):
+    """
+    Страница товаров категории и всех ее потомков по id.
+    Возвращает (товары, курсор следующей страницы или None)
+    """
+    if not 1 <= limit <= MAX_PRODUCTS_PAGE:
+        raise ValueError(f'Limit must be between 1 and {MAX_PRODUCTS_PAGE}')
+    cursor.execute(SUBTREE_PRODUCTS_SQL, {'category_id': category_id, 'after': after, 'limit': limit + 1})
+    rows = cursor.fetchall()
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -10,4 +10,79 @@ class Config:
     DB_USER = os.getenv('DB_USER', 'postgres')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
     
-    DB_DSN = f"dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD} host={DB_HOST} port={DB_PORT}"
\ No newline at end of file
+    DB_DSN = f"dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD} host={DB_HOST} port={DB_PORT}"
+
+    # Реплики для чтения: DSN через запятую, пусто - все запросы идут в primary
+    DB_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(',') if dsn.strip()]
+    # Допустимое отставание реплики в секундах, при превышении чтение уходит в primary
+    # (пусто - отставание не проверяется)
+    _replica_max_lag = os.getenv('DB_REPLICA_MAX_LAG', '5')
+    DB_REPLICA_MAX_LAG = float(_replica_max_lag) if _replica_max_lag else None
+    DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '1'))  # секунды между проверками
+
+    # Пул соединений
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '2'))
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))  # секунды ожидания свободного соединения
+    DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', '30'))  # проверка простаивавших соединений
+
+    # Бюджет соединений для gunicorn.conf.py: max_connections PostgreSQL и резерв
+    # под остальные сервисы. Пустой резерв считается из их пулов (gunicorn.conf.py,
+    # reserved_connections): ASGI-пул, Streamlit, worker.py, maintenance.py и администрирование
+    DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', '100'))
+    _reserved_connections = os.getenv('DB_RESERVED_CONNECTIONS', '')
+    DB_RESERVED_CONNECTIONS = int(_reserved_connections) if _reserved_connections else None
+    DB_SERVICE_POOL_MAX = int(os.getenv('DB_SERVICE_POOL_MAX', '2'))  # пул процесса worker.py и maintenance.py
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))  # экземпляров worker.py (--scale worker)
+    DB_ADMIN_CONNECTIONS = int(os.getenv('DB_ADMIN_CONNECTIONS', '5'))  # миграции, psql, CLI-скрипты
+
+    # Повтор транзакций при deadlock / serialization failure (Database.run_in_transaction)
+    DB_TX_RETRIES = int(os.getenv('DB_TX_RETRIES', '3'))
+    DB_TX_RETRY_BACKOFF = float(os.getenv('DB_TX_RETRY_BACKOFF', '0.05'))  # базовая пауза, секунды
+    DB_TX_RETRY_BACKOFF_MAX = float(os.getenv('DB_TX_RETRY_BACKOFF_MAX', '1'))
+
+    # Таймауты транзакций изменения заказа, миллисекунды
+    ORDER_TX_LOCK_TIMEOUT = int(os.getenv('ORDER_TX_LOCK_TIMEOUT', '2000'))
+    ORDER_TX_STATEMENT_TIMEOUT = int(os.getenv('ORDER_TX_STATEMENT_TIMEOUT', '5000'))
+
+    # Кэш справочника товаров и категорий (catalog.py)
+    CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '10000'))  # товаров в LRU
+    # Срок жизни записей на случай пропущенных уведомлений, секунды
+    CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '300'))
+
+    # Кэш ответов GET заказа, позиций и остатка (response_cache.py)
+    READ_CACHE_SIZE = int(os.getenv('READ_CACHE_SIZE', '10000'))  # ответов в LRU, 0 - без кэша
+    # Срок жизни ответа - наибольшее отставание от БД, секунды
+    READ_CACHE_TTL = float(os.getenv('READ_CACHE_TTL', '2'))
+
+    # Обработка очереди событий заказов (worker.py)
+    ORDER_EVENTS_BATCH_SIZE = int(os.getenv('ORDER_EVENTS_BATCH_SIZE', '500'))
+    ORDER_EVENTS_POLL_INTERVAL = float(os.getenv('ORDER_EVENTS_POLL_INTERVAL', '1'))  # пауза при пустой очереди, секунды
+    ORDER_EVENTS_MAX_ATTEMPTS = int(os.getenv('ORDER_EVENTS_MAX_ATTEMPTS', '10'))
+    ORDER_EVENTS_RETRY_DELAY = float(os.getenv('ORDER_EVENTS_RETRY_DELAY', '5'))  # первая пауза перед повтором, секунды
+    WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '9101'))  # 0 - не публиковать метрики
+
+    # Массовый импорт заказов (bulk_orders.py): отклоненных строк в ответе API
+    BULK_IMPORT_REJECTED_LIMIT = int(os.getenv('BULK_IMPORT_REJECTED_LIMIT', '1000'))
+    # Детали заказов (order_details.py): заказов в одном запросе /api/orders/details
+    ORDER_DETAILS_MAX_IDS = int(os.getenv('ORDER_DETAILS_MAX_IDS', '500'))
+
+    # Асинхронный пул asgi_app.py (asyncpg)
+    ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', '5'))
+    ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', '20'))
+
+    # Периодические задачи (maintenance.py), секунды
+    DASHBOARD_REFRESH_INTERVAL = float(os.getenv('DASHBOARD_REFRESH_INTERVAL', '60'))
+    IDEMPOTENCY_CLEANUP_INTERVAL = float(os.getenv('IDEMPOTENCY_CLEANUP_INTERVAL', '3600'))
+    # Срок хранения ключей идемпотентности, секунды
+    IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+    ORDER_PARTITIONS_INTERVAL = float(os.getenv('ORDER_PARTITIONS_INTERVAL', '3600'))
+    # Сверка сводки customer_spend с полным пересчетом (читает всю историю заказов)
+    CUSTOMER_SPEND_RECONCILE_INTERVAL = float(os.getenv('CUSTOMER_SPEND_RECONCILE_INTERVAL', '86400'))
+
+    # Секции orders/order_items по месяцам (migrations/0009_partition_orders.sql)
+    ORDER_PARTITIONS_AHEAD = int(os.getenv('ORDER_PARTITIONS_AHEAD', '3'))  # месяцев вперед
+    # Месяцев в "горячих" таблицах, более старые секции уходят в схему archive (0 - не архивировать)
+    ORDER_RETENTION_MONTHS = int(os.getenv('ORDER_RETENTION_MONTHS', '24'))
+    # Ожидание блокировки orders при создании и отсоединении секций, миллисекунды
+    ORDER_PARTITIONS_LOCK_TIMEOUT = int(os.getenv('ORDER_PARTITIONS_LOCK_TIMEOUT', '5000'))
\ No newline at end of file
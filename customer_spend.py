@@ -0,0 +1,40 @@
+"""
+Чтение сводки сумм покупок клиентов (customer_spend, migrations/0010_customer_spend.sql).
+
+Сводку обновляет worker.py по событиям заказов, поэтому она отстает от заказов
+на время обработки очереди; maintenance.py периодически сверяет ее с полным отчетом.
+Оба запроса читают по индексу и не зависят от объема истории заказов.
+"""
+
+# Наибольший размер топа клиентов
+MAX_TOP_CUSTOMERS = 100
+
+TOP_CUSTOMERS_SQL = """
+    SELECT s.customer_id, c.name, s.amount, s.updated_at
+    FROM customer_spend s
+    JOIN customers c ON c.id = s.customer_id
+    WHERE s.amount > 0
+    ORDER BY s.amount DESC, s.customer_id
+    LIMIT %s
+"""
+
+CUSTOMER_SPEND_SQL = """
+    SELECT c.id AS customer_id, c.name, COALESCE(s.amount, 0) AS amount, s.updated_at
+    FROM customers c
+    LEFT JOIN customer_spend s ON s.customer_id = c.id
+    WHERE c.id = %s
+"""
+
+
+def top_customers(cursor, limit=10):
+    """Клиенты с наибольшей суммой покупок: [(customer_id, name, amount, updated_at)]"""
+    if not 1 <= limit <= MAX_TOP_CUSTOMERS:
+        raise ValueError(f'Limit must be between 1 and {MAX_TOP_CUSTOMERS}')
+    cursor.execute(TOP_CUSTOMERS_SQL, (limit,))
+    return cursor.fetchall()
+
+
+def customer_spend(cursor, customer_id):
+    """Сумма покупок клиента (customer_id, name, amount, updated_at) или None, если клиента нет"""
+    cursor.execute(CUSTOMER_SPEND_SQL, (customer_id,))
+    return cursor.fetchone()
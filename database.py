@@ -1,46 +1,393 @@
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2 import pool, sql
-from psycopg2.extras import RealDictCursor
-from flask import current_app
+from psycopg2 import extensions, pool
 from config import Config
+from metrics import (
+    POOL_WAIT, READ_FALLBACKS, REPLICA_LAG, record_db_error, record_pool_state, record_retry, timed_step
+)
+
+logger = logging.getLogger(__name__)
+
+# deadlock_detected, serialization_failure: транзакцию можно безопасно повторить целиком
+RETRYABLE_SQLSTATES = {'40P01', '40001'}
+
+# Отставание реплики в секундах; реплика, догнавшая primary, считается без отставания,
+# даже если последняя примененная транзакция была давно. На primary всегда 0
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class PoolTimeoutError(pool.PoolError):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений на время жизни процесса.
+
+    В отличие от psycopg2.pool.*ConnectionPool не закрывает соединения сверх
+    minconn при возврате, ждет освобождения соединения не дольше timeout
+    и проверяет соединения, простаивавшие дольше healthcheck_interval.
+    Соединения пула с readonly=True открываются в режиме только для чтения.
+    """
+
+    def __init__(self, dsn, minconn, maxconn, timeout, healthcheck_interval, readonly=False):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: min={minconn}, max={maxconn}")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.readonly = readonly
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, время последнего использования)
+        self._size = 0        # всего открытых соединений (свободных и выданных)
+        self._closed = False
+
+        # Прогрев пула
+        try:
+            for _ in range(minconn):
+                self._idle.append((self._connect(), time.monotonic()))
+                self._size += 1
+        except Exception:
+            self.closeall()
+            raise
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        if self.readonly:
+            conn.set_session(readonly=True)
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        # LIFO: чаще используем одни и те же "теплые" соединения
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout}s waiting for a database connection"
+                        )
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, last_used):
+                return conn
+
+            logger.warning("Discarding broken database connection")
+            self._discard(conn)
+
+    def putconn(self, conn):
+        if self._closed or conn.closed:
+            self._discard(conn)
+            return
+
+        # Возвращаем соединение в пул в согласованном состоянии
+        try:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+                return
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        """(выданные соединения, свободные соединения)"""
+        with self._cond:
+            return self._size - len(self._idle), len(self._idle)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+                self._size -= 1
+            self._cond.notify_all()
+
 
 class Database:
+    """
+    Пулы соединений процесса: primary и, если заданы Config.DB_REPLICA_DSNS, реплики.
+
+    Соединения с readonly=True выдаются репликами по кругу; если реплика недоступна
+    или отстает больше Config.DB_REPLICA_MAX_LAG, чтение уходит в primary.
+    Записи, блокировки (FOR UPDATE / FOR SHARE) и run_in_transaction всегда идут в primary.
+    """
+    POOL_NAME = 'primary'
     _connection_pool = None
-    
+    _replica_pools = []   # [(имя, пул)]
+    _replica_lag = {}     # имя реплики -> (время проверки, отставание)
+    _checked_out = {}     # id(conn) -> (имя, пул) для выданных соединений
+    _next_replica = 0
+    _pool_pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def init_pool(cls, minconn=None, maxconn=None):
+        """
+        Создание пулов процесса. minconn/maxconn переопределяют Config
+        (gunicorn.conf.py считает размер пула воркера из числа воркеров и потоков).
+        """
+        minconn = Config.DB_POOL_MIN if minconn is None else minconn
+        maxconn = Config.DB_POOL_MAX if maxconn is None else maxconn
+        with cls._lock:
+            if cls._connection_pool is not None and cls._pool_pid == os.getpid():
+                return
+            # Пулы, унаследованные от родителя через fork, не закрываем:
+            # их сокеты принадлежат родительскому процессу
+            cls._connection_pool = None
+            cls._replica_pools = []
+            cls._replica_lag = {}
+            cls._checked_out = {}
+            try:
+                cls._connection_pool = ConnectionPool(
+                    dsn=Config.DB_DSN,
+                    minconn=min(minconn, maxconn),
+                    maxconn=maxconn,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    healthcheck_interval=Config.DB_POOL_HEALTHCHECK_INTERVAL
+                )
+                # Реплики без прогрева: недоступная при старте реплика не мешает работе через primary
+                for number, dsn in enumerate(Config.DB_REPLICA_DSNS, 1):
+                    cls._replica_pools.append((f'replica{number}', ConnectionPool(
+                        dsn=dsn,
+                        minconn=0,
+                        maxconn=maxconn,
+                        timeout=Config.DB_POOL_TIMEOUT,
+                        healthcheck_interval=Config.DB_POOL_HEALTHCHECK_INTERVAL,
+                        readonly=True
+                    )))
+                cls._pool_pid = os.getpid()
+                logger.info(
+                    "Database connection pool initialized (min=%s, max=%s, replicas=%s, pid=%s)",
+                    min(minconn, maxconn), maxconn, len(cls._replica_pools), cls._pool_pid
+                )
+            except Exception as e:
+                logger.error(f"Error initializing connection pool: {e}")
+                raise
+
     @classmethod
-    def init_pool(cls):
+    def _getconn(cls, name, conn_pool, timeout):
+        started = time.perf_counter()
         try:
-            cls._connection_pool = pool.SimpleConnectionPool(
-                minconn=1,
-                maxconn=10,
-                dsn=Config.DB_DSN
-            )
-            current_app.logger.info("Database connection pool initialized")
-        except Exception as e:
-            current_app.logger.error(f"Error initializing connection pool: {e}")
-            raise
-    
+            conn = conn_pool.getconn(timeout)
+            with cls._lock:
+                cls._checked_out[id(conn)] = (name, conn_pool)
+            logger.debug("Got connection from pool %s", name)
+            return conn
+        finally:
+            POOL_WAIT.labels(name).observe(time.perf_counter() - started)
+            record_pool_state(name, conn_pool)
+
+    @classmethod
+    def _replica_lag_ok(cls, name, conn):
+        """Отставание реплики в пределах DB_REPLICA_MAX_LAG (проверяется не чаще DB_REPLICA_LAG_CHECK_INTERVAL)"""
+        max_lag = Config.DB_REPLICA_MAX_LAG
+        if max_lag is None:
+            return True
+        now = time.monotonic()
+        checked_at, lag = cls._replica_lag.get(name, (None, None))
+        if checked_at is None or now - checked_at >= Config.DB_REPLICA_LAG_CHECK_INTERVAL:
+            with conn.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+            conn.rollback()
+            cls._replica_lag[name] = (now, lag)
+            REPLICA_LAG.labels(name).set(lag)
+        return lag <= max_lag
+
+    @classmethod
+    def _get_replica_connection(cls, timeout):
+        """Соединение с первой по кругу подходящей репликой или None"""
+        replicas = cls._replica_pools
+        with cls._lock:
+            start = cls._next_replica
+            cls._next_replica = (start + 1) % len(replicas)
+
+        for offset in range(len(replicas)):
+            name, replica_pool = replicas[(start + offset) % len(replicas)]
+            conn = None
+            try:
+                conn = cls._getconn(name, replica_pool, timeout)
+                if cls._replica_lag_ok(name, conn):
+                    return conn
+                logger.warning("Replica %s lags behind, reading from primary", name)
+                READ_FALLBACKS.labels(name, 'lag').inc()
+            except psycopg2.Error as e:
+                logger.warning(f"Replica {name} is unavailable: {e}")
+                READ_FALLBACKS.labels(name, 'unavailable').inc()
+            if conn is not None:
+                cls.return_connection(conn)
+        return None
+
     @classmethod
-    def get_connection(cls):
-        if cls._connection_pool is None:
+    def get_connection(cls, timeout=None, readonly=False):
+        """
+        Соединение из пула; readonly=True - для запросов только на чтение,
+        которые допускают отставание реплики
+        """
+        if cls._connection_pool is None or cls._pool_pid != os.getpid():
             cls.init_pool()
         try:
-            conn = cls._connection_pool.getconn()
-            current_app.logger.debug("Got connection from pool")
-            return conn
+            if readonly and cls._replica_pools:
+                conn = cls._get_replica_connection(timeout)
+                if conn is not None:
+                    return conn
+            return cls._getconn(cls.POOL_NAME, cls._connection_pool, timeout)
         except Exception as e:
-            current_app.logger.error(f"Error getting connection: {e}")
+            logger.error(f"Error getting connection: {e}")
             raise
-    
+
     @classmethod
     def return_connection(cls, conn):
-        if cls._connection_pool and conn:
-            cls._connection_pool.putconn(conn)
-            current_app.logger.debug("Returned connection to pool")
-    
+        if not conn:
+            return
+        with cls._lock:
+            name, conn_pool = cls._checked_out.pop(id(conn), (cls.POOL_NAME, cls._connection_pool))
+        if conn_pool:
+            conn_pool.putconn(conn)
+            logger.debug("Returned connection to pool %s", name)
+            record_pool_state(name, conn_pool)
+
+    @classmethod
+    @contextmanager
+    def connection(cls, timeout=None, readonly=False):
+        """Соединение из пула на время блока with, возвращается в пул при выходе"""
+        conn = cls.get_connection(timeout, readonly)
+        try:
+            yield conn
+        finally:
+            cls.return_connection(conn)
+
+    @classmethod
+    def run_in_transaction(cls, func, operation='transaction', retries=None, cursor_factory=None,
+                           lock_timeout=None, statement_timeout=None):
+        """
+        Выполнение func(cursor) одной транзакцией с коммитом, результат func возвращается.
+
+        При deadlock / serialization failure транзакция откатывается и повторяется
+        до retries раз с паузой (экспоненциальной со случайным разбросом), поэтому
+        func не должна иметь побочных эффектов вне БД. lock_timeout и
+        statement_timeout (мс) действуют только внутри транзакции.
+        """
+        retries = Config.DB_TX_RETRIES if retries is None else retries
+        attempt = 0
+        while True:
+            with cls.connection() as conn:
+                try:
+                    with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                        if lock_timeout is not None or statement_timeout is not None:
+                            cursor.execute(
+                                "SELECT set_config('lock_timeout', %s, true), "
+                                "set_config('statement_timeout', %s, true)",
+                                (str(lock_timeout or 0), str(statement_timeout or 0))
+                            )
+                        result = func(cursor)
+                    with timed_step(operation, 'commit'):
+                        conn.commit()
+                    return result
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    record_db_error(e)
+                    if e.pgcode not in RETRYABLE_SQLSTATES:
+                        raise
+                    if attempt >= retries:
+                        record_retry(operation, e, exhausted=True)
+                        raise
+                    record_retry(operation, e)
+                    logger.warning(
+                        "Retrying %s after %s (attempt %s of %s)", operation, e.pgcode, attempt + 1, retries
+                    )
+                except Exception:
+                    conn.rollback()
+                    raise
+            # Пауза после возврата соединения в пул, чтобы не держать его во время ожидания
+            backoff = min(Config.DB_TX_RETRY_BACKOFF_MAX, Config.DB_TX_RETRY_BACKOFF * 2 ** attempt)
+            time.sleep(random.uniform(0, backoff))
+            attempt += 1
+
     @classmethod
     def close_pool(cls):
-        if cls._connection_pool:
-            cls._connection_pool.closeall()
-            cls._connection_pool = None
-            current_app.logger.info("Database connection pool closed")
\ No newline at end of file
+        with cls._lock:
+            if cls._connection_pool and cls._pool_pid == os.getpid():
+                cls._connection_pool.closeall()
+                for _, replica_pool in cls._replica_pools:
+                    replica_pool.closeall()
+                cls._connection_pool = None
+                cls._replica_pools = []
+                logger.info("Database connection pools closed")
+
+
+# Пул живет все время работы процесса и закрывается только при его завершении
+atexit.register(Database.close_pool)
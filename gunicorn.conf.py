@@ -0,0 +1,135 @@
+"""
+Production-запуск API: gunicorn -c gunicorn.conf.py app:app
+
+Число воркеров, потоков и preload настраиваются через переменные окружения.
+Пул соединений создается в каждом воркере после fork, его размер выводится
+из числа воркеров и потоков так, чтобы соединения всех воркеров с primary
+(пул и слушатель LISTEN справочника catalog.py) не превышали
+DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS. Пулы реплик того же размера
+открываются к серверам реплик; выгрузка CSV и импорт берут соединения из пула.
+"""
+import multiprocessing
+import os
+
+import psycopg2
+from prometheus_client import multiprocess
+
+from config import Config
+from database import Database
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+accesslog = '-'
+errorlog = '-'
+
+
+# Соединения воркера с primary вне пула: слушатель LISTEN справочника (catalog.py)
+WORKER_EXTRA_CONNECTIONS = 1
+
+
+def required_reserve():
+    """
+    Наибольшее число соединений остальных сервисов с primary: пул ASGI-версии API,
+    пул Streamlit и его слушатель справочника, пулы worker.py и maintenance.py,
+    администрирование
+    """
+    return (
+        Config.ASYNC_DB_POOL_MAX
+        + Config.DB_POOL_MAX + 1
+        + (Config.WORKER_PROCESSES + 1) * Config.DB_SERVICE_POOL_MAX
+        + Config.DB_ADMIN_CONNECTIONS
+    )
+
+
+def reserved_connections():
+    """DB_RESERVED_CONNECTIONS или, если он не задан, резерв по пулам остальных сервисов"""
+    if Config.DB_RESERVED_CONNECTIONS is None:
+        return required_reserve()
+    return Config.DB_RESERVED_CONNECTIONS
+
+
+def worker_pool_size():
+    """Максимальный размер пула одного воркера"""
+    reserved = reserved_connections()
+    budget = Config.DB_MAX_CONNECTIONS - reserved
+    per_worker = budget // workers - WORKER_EXTRA_CONNECTIONS
+    if per_worker < 1:
+        raise RuntimeError(
+            f"{workers} workers do not fit into {budget} database connections "
+            f"(DB_MAX_CONNECTIONS={Config.DB_MAX_CONNECTIONS}, reserved for other services {reserved}, "
+            f"{WORKER_EXTRA_CONNECTIONS} connection per worker outside the pool)"
+        )
+    # Потоку нужно не больше одного соединения одновременно
+    return min(threads, per_worker, Config.DB_POOL_MAX)
+
+
+def server_max_connections(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW max_connections")
+            return int(cursor.fetchone()[0])
+    finally:
+        conn.close()
+
+
+def on_starting(server):
+    # Каталог метрик воркеров для multiprocess-режима prometheus_client очищается при старте
+    metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            os.remove(os.path.join(metrics_dir, name))
+
+    if reserved_connections() < required_reserve():
+        server.log.warning(
+            "DB_RESERVED_CONNECTIONS=%s is below the pools of other services (%s: async API, "
+            "Streamlit, %s worker.py processes, maintenance, admin); they may exhaust max_connections",
+            Config.DB_RESERVED_CONNECTIONS, required_reserve(), Config.WORKER_PROCESSES
+        )
+    pool_size = worker_pool_size()
+    primary_total = (pool_size + WORKER_EXTRA_CONNECTIONS) * workers
+    server.log.info(
+        "Database pool per worker: max %s (%s workers x %s threads, %s primary connections total, "
+        "%s reserved for other services)",
+        pool_size, workers, threads, primary_total, reserved_connections()
+    )
+    # Сверяем лимит с настройкой серверов, если они доступны. Streamlit читает и из реплик
+    targets = [('primary', Config.DB_DSN, primary_total + reserved_connections())]
+    targets += [
+        (f'replica{number}', dsn, pool_size * workers + Config.DB_POOL_MAX + Config.DB_ADMIN_CONNECTIONS)
+        for number, dsn in enumerate(Config.DB_REPLICA_DSNS, 1)
+    ]
+    for name, dsn, needed in targets:
+        try:
+            max_connections = server_max_connections(dsn)
+            if needed > max_connections:
+                server.log.warning(
+                    "Pools may open %s connections to %s with max_connections=%s, "
+                    "lower DB_MAX_CONNECTIONS or GUNICORN_WORKERS",
+                    needed, name, max_connections
+                )
+        except psycopg2.Error as e:
+            server.log.warning(f"Could not check max_connections of {name}: {e}")
+
+
+def post_fork(server, worker):
+    # Соединения не должны переходить через fork: каждый воркер открывает свои
+    pool_size = worker_pool_size()
+    Database.init_pool(minconn=min(Config.DB_POOL_MIN, pool_size), maxconn=pool_size)
+
+
+def worker_exit(server, worker):
+    Database.close_pool()
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,92 @@
+"""
+Ключи идемпотентности (заголовок Idempotency-Key) для запросов изменения заказа.
+
+Ключ записывается в idempotency_keys в той же транзакции, что и резервирование,
+вместе с ответом. Повтор запроса с тем же ключом возвращает сохраненный ответ,
+не трогая остатки; параллельный повтор ждет на уникальном индексе коммита или
+отката первого запроса. Неуспешные запросы откатываются вместе с ключом и
+при повторе выполняются заново. Старые ключи удаляет maintenance.py.
+"""
+import hashlib
+import json
+
+from metrics import IDEMPOTENT_REPLAYS
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# Параметры: endpoint, key, request_hash
+CLAIM_KEY_SQL = """
+    INSERT INTO idempotency_keys (endpoint, key, request_hash)
+    VALUES (%(endpoint)s, %(key)s, %(request_hash)s)
+    ON CONFLICT (endpoint, key) DO NOTHING
+    RETURNING key
+"""
+
+STORED_RESPONSE_SQL = """
+    SELECT request_hash, status_code, response
+    FROM idempotency_keys
+    WHERE endpoint = %(endpoint)s AND key = %(key)s
+"""
+
+# Параметры: endpoint, key, status_code, response (JSON-строка)
+SAVE_RESPONSE_SQL = """
+    UPDATE idempotency_keys
+    SET status_code = %(status_code)s, response = %(response)s::jsonb
+    WHERE endpoint = %(endpoint)s AND key = %(key)s
+"""
+
+
+def valid_key(key):
+    return 0 < len(key) <= MAX_KEY_LENGTH
+
+
+def key_params(endpoint, key, data):
+    """Параметры запросов по ключу; тело запроса сравнивается по хэшу канонического JSON"""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return {
+        'endpoint': endpoint,
+        'key': key,
+        'request_hash': hashlib.sha256(canonical.encode()).hexdigest()
+    }
+
+
+def stored_response(row, params):
+    """(ответ, код) для повтора по строке STORED_RESPONSE_SQL"""
+    if row['request_hash'] != params['request_hash']:
+        IDEMPOTENT_REPLAYS.labels(params['endpoint'], 'mismatch').inc()
+        return {'error': 'Idempotency key was already used with a different request'}, 422
+    IDEMPOTENT_REPLAYS.labels(params['endpoint'], 'replayed').inc()
+    response = row['response']
+    # asyncpg возвращает jsonb строкой
+    return (json.loads(response) if isinstance(response, str) else response), row['status_code']
+
+
+def save_params(params, response, status_code):
+    return dict(params, response=json.dumps(response), status_code=status_code)
+
+
+def idempotent(cursor, endpoint, key, data, handler):
+    """
+    Выполнение handler(cursor) -> (ответ, код) в текущей транзакции с ключом key
+    (None - без ключа). Возвращает (ответ, код, повтор ли это).
+    """
+    if key is None:
+        return (*handler(cursor), False)
+
+    params = key_params(endpoint, key, data)
+    cursor.execute(CLAIM_KEY_SQL, params)
+    if not cursor.fetchone():
+        cursor.execute(STORED_RESPONSE_SQL, params)
+        row = cursor.fetchone()
+        if row:
+            return (*stored_response(row, params), True)
+
+    response, status_code = handler(cursor)
+    cursor.execute(SAVE_RESPONSE_SQL, save_params(params, response, status_code))
+    return response, status_code, False
+
+
+def replay_headers(replayed):
+    return {REPLAYED_HEADER: 'true'} if replayed else {}
@@ -42,7 +42,9 @@ CREATE TABLE order_items (
     quantity INT NOT NULL,
     price DECIMAL(10, 2) NOT NULL, -- Цена на момент продажи
     FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
-    FOREIGN KEY (product_id) REFERENCES products(id)
+    FOREIGN KEY (product_id) REFERENCES products(id),
+    -- Одна позиция на товар в заказе, повторное добавление увеличивает количество (upsert)
+    CONSTRAINT order_items_order_product_key UNIQUE (order_id, product_id)
 );
 
 -- Категории
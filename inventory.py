@@ -0,0 +1,394 @@
+"""Резервирование товаров под заказ"""
+from metrics import timed_step
+
+ORDER_STATUSES = ('new', 'processing', 'shipped', 'delivered')
+ACTIVE_ORDER_STATUSES = ('new', 'processing')
+MAX_INT = 2 ** 31 - 1  # id и количества - INT PostgreSQL
+
+
+class ReservationError(Exception):
+    """Ошибка резервирования, которую можно вернуть клиенту как есть"""
+
+    def __init__(self, payload, status_code=400):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status_code = status_code
+
+
+def positive_int(value):
+    """Целое из JSON в пределах INT: bool - подкласс int, но числом не считается"""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 < value <= MAX_INT
+
+
+def validate_order_id(order_id):
+    """Текст ошибки или None"""
+    if not positive_int(order_id):
+        return 'Order id must be a positive integer'
+    return None
+
+
+def validate_item(order_id, product_id, quantity):
+    """Проверка полей запроса add-item (app.py и asgi_app.py). Возвращает текст ошибки или None"""
+    if not positive_int(order_id):
+        return validate_order_id(order_id)
+    if not positive_int(product_id):
+        return 'Product id must be a positive integer'
+    if not positive_int(quantity):
+        return 'Quantity must be a positive integer'
+    return None
+
+
+def validate_lines(lines):
+    """Проверка строк корзины. Возвращает список ошибок вида {'line': i, 'error': ...}"""
+    errors = []
+    for i, line in enumerate(lines):
+        if not isinstance(line, dict):
+            errors.append({'line': i, 'error': 'Item must be an object'})
+            continue
+        for field in ('product_id', 'quantity'):
+            if field not in line:
+                errors.append({'line': i, 'error': f'Missing required field: {field}'})
+                break
+        else:
+            if not positive_int(line['product_id']):
+                errors.append({'line': i, 'error': 'Product id must be a positive integer'})
+            elif not positive_int(line['quantity']):
+                errors.append({'line': i, 'error': 'Quantity must be a positive integer'})
+    return errors
+
+
+# Дата заказа по id (order_dates, migrations/0013_order_dates.sql). Условие
+# order_date = (подзапрос) отсекает секции orders при выполнении: читается индекс
+# одной секции вместо индексов всех месячных секций. Параметр: order_id
+ORDER_DATE_SQL = "(SELECT order_date FROM order_dates WHERE order_id = %(order_id)s)"
+
+
+def lock_order(cursor, order_id):
+    """
+    Проверка, что заказ существует и его еще можно менять.
+    Разделяемая блокировка не дает сменить статус до конца транзакции,
+    но не сериализует параллельные добавления в один заказ.
+    """
+    cursor.execute(f"""
+        SELECT id, order_date, current_status FROM orders
+        WHERE id = %(order_id)s AND order_date = {ORDER_DATE_SQL}
+        FOR SHARE
+    """, {'order_id': order_id})
+    order = cursor.fetchone()
+
+    if not order:
+        raise ReservationError({'error': 'Order not found'}, 404)
+
+    if order['current_status'] not in ACTIVE_ORDER_STATUSES:
+        raise ReservationError({'error': 'Cannot modify order in current status'}, 400)
+
+    return order
+
+
+# Проверка статуса заказа, условное списание остатка и upsert позиции одним выражением.
+# Остаток товара с stock_shards > 0 списывается из шардов (take_sharded_stock,
+# migrations/0008_product_stock_shards.sql), строка products при этом не блокируется.
+# Параметры: order_id, product_id, quantity, statuses
+RESERVE_ITEM_SQL = f"""
+    WITH ord AS (
+        SELECT id, order_date FROM orders
+        WHERE id = %(order_id)s AND order_date = {ORDER_DATE_SQL}
+            AND current_status = ANY(%(statuses)s::status[])
+        FOR SHARE
+    ), stock AS (
+        UPDATE products
+        SET quantity = quantity - %(quantity)s
+        WHERE id = %(product_id)s
+            AND stock_shards = 0
+            AND quantity >= %(quantity)s
+            AND EXISTS (SELECT 1 FROM ord)
+        RETURNING id, name, price
+    ), sharded AS (
+        -- Порядок условий AND не гарантирован: проверка заказа внутри CASE,
+        -- чтобы шард не списывался без позиции заказа
+        SELECT id, name, price FROM products
+        WHERE id = %(product_id)s
+            AND CASE WHEN stock_shards > 0 AND EXISTS (SELECT 1 FROM ord)
+                THEN take_sharded_stock(id, %(quantity)s) ELSE false END
+    ), reserved AS (
+        SELECT id, name, price FROM stock
+        UNION ALL
+        SELECT id, name, price FROM sharded
+    ), item AS (
+        INSERT INTO order_items (order_id, order_date, product_id, quantity, price)
+        SELECT %(order_id)s, ord.order_date, reserved.id, %(quantity)s, reserved.price
+        FROM reserved, ord
+        ON CONFLICT ON CONSTRAINT order_items_order_product_key
+        DO UPDATE SET quantity = order_items.quantity + EXCLUDED.quantity
+        RETURNING quantity, xmax = 0 AS inserted
+    )
+    SELECT reserved.name, reserved.price, item.quantity, item.inserted
+    FROM reserved, item
+"""
+
+# Остаток товара: сумма шардов или products.quantity. Параметр: product_id
+STOCK_QUANTITY_SQL = """
+    SELECT CASE WHEN p.stock_shards > 0
+        THEN (SELECT COALESCE(sum(s.quantity), 0) FROM product_stock_shards s WHERE s.product_id = p.id)
+        ELSE p.quantity END AS stock_quantity
+    FROM products p
+    WHERE p.id = %(product_id)s
+"""
+
+# Неблокирующее чтение для определения причины отказа. Параметры: order_id, product_id
+RESERVATION_STATUS_SQL = f"""
+    SELECT
+        (SELECT current_status FROM orders
+         WHERE id = %(order_id)s AND order_date = {ORDER_DATE_SQL}) AS order_status,
+        ({STOCK_QUANTITY_SQL}) AS stock_quantity
+"""
+
+
+def reserve_item_params(order_id, product_id, quantity):
+    return {
+        'order_id': order_id,
+        'product_id': product_id,
+        'quantity': quantity,
+        'statuses': list(ACTIVE_ORDER_STATUSES)
+    }
+
+
+def reservation_result(row):
+    """Результат резервирования по строке RESERVE_ITEM_SQL"""
+    return {
+        'action': 'added' if row['inserted'] else 'updated',
+        'final_quantity': row['quantity'],
+        'product_name': row['name'],
+        'price_per_unit': float(row['price'])
+    }
+
+
+def reservation_error(row, quantity):
+    """ReservationError по строке RESERVATION_STATUS_SQL"""
+    if row['order_status'] is None:
+        return ReservationError({'error': 'Order not found'}, 404)
+
+    if row['order_status'] not in ACTIVE_ORDER_STATUSES:
+        return ReservationError({'error': 'Cannot modify order in current status'}, 400)
+
+    if row['stock_quantity'] is None:
+        return ReservationError({'error': 'Product not found'}, 404)
+
+    return ReservationError({
+        'error': 'Insufficient stock',
+        'available_quantity': row['stock_quantity'],
+        'requested_quantity': quantity
+    }, 400)
+
+
+def reserve_item(cursor, order_id, product_id, quantity):
+    """
+    Резервирование одной позиции одним запросом.
+
+    Проверка статуса заказа, условное списание остатка
+    (UPDATE ... WHERE quantity >= n) и upsert позиции заказа выполняются
+    одним выражением, поэтому строка товара блокируется только на время
+    этого запроса и коммита, а у товара с шардированным остатком - только
+    один из шардов. Причина отказа выясняется отдельным
+    неблокирующим чтением только если резервирование не удалось.
+    """
+    with timed_step('add_item', 'reserve'):
+        cursor.execute(RESERVE_ITEM_SQL, reserve_item_params(order_id, product_id, quantity))
+        row = cursor.fetchone()
+
+    if not row:
+        with timed_step('add_item', 'diagnose'):
+            cursor.execute(RESERVATION_STATUS_SQL, {'order_id': order_id, 'product_id': product_id})
+            status = cursor.fetchone()
+        raise reservation_error(status, quantity)
+
+    return reservation_result(row)
+
+
+def reserve_items(cursor, order_id, lines):
+    """
+    Резервирование нескольких позиций в одной транзакции.
+
+    lines - провалидированный список {'product_id': ..., 'quantity': ...},
+    cursor - RealDictCursor без автокоммита. Товары блокируются по возрастанию
+    id, чтобы параллельные корзины с общими товарами не взаимоблокировались;
+    товары с шардированным остатком не блокируются, остаток списывается из шардов.
+    Списание остальных остатков и upsert в order_items выполняются одним запросом.
+    Возвращает результат по каждой строке; если хотя бы одну строку нельзя
+    зарезервировать, бросает ReservationError со списком результатов.
+    """
+    with timed_step('add_items', 'order_lock'):
+        order = lock_order(cursor, order_id)
+
+    # Одинаковые товары в корзине суммируются
+    requested = {}
+    for line in lines:
+        requested[line['product_id']] = requested.get(line['product_id'], 0) + line['quantity']
+    product_ids = sorted(requested)
+
+    with timed_step('add_items', 'product_lock'):
+        cursor.execute("""
+            SELECT id, name, quantity as stock_quantity, price, stock_shards
+            FROM products
+            WHERE id = ANY(%s) AND stock_shards = 0
+            ORDER BY id
+            FOR UPDATE
+        """, (product_ids,))
+        products = {row['id']: row for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT id, name, price, stock_shards
+            FROM products
+            WHERE id = ANY(%s) AND stock_shards > 0
+        """, (product_ids,))
+        sharded = {row['id']: row for row in cursor.fetchall()}
+
+    with timed_step('add_items', 'shards'):
+        for product_id in sorted(sharded):
+            product = sharded[product_id]
+            if take_sharded_stock(cursor, product_id, requested[product_id]):
+                product['stock_quantity'] = requested[product_id]
+            else:
+                cursor.execute(STOCK_QUANTITY_SQL, {'product_id': product_id})
+                product['stock_quantity'] = cursor.fetchone()['stock_quantity']
+        products.update(sharded)
+
+    results = []
+    failed = False
+    for line in lines:
+        product = products.get(line['product_id'])
+        result = {'product_id': line['product_id'], 'quantity': line['quantity']}
+        if not product:
+            result['error'] = 'Product not found'
+        elif product['stock_quantity'] < requested[line['product_id']]:
+            result.update({
+                'error': 'Insufficient stock',
+                'available_quantity': product['stock_quantity'],
+                'requested_quantity': requested[line['product_id']]
+            })
+        failed = failed or 'error' in result
+        results.append(result)
+
+    if failed:
+        raise ReservationError({'error': 'Some items cannot be reserved', 'items': results}, 400)
+
+    with timed_step('add_items', 'write'):
+        cursor.execute("""
+            WITH req AS (
+                SELECT * FROM unnest(%(product_ids)s::int[], %(quantities)s::int[])
+                    AS r(product_id, quantity)
+            ), stock AS (
+                UPDATE products p
+                SET quantity = p.quantity - req.quantity
+                FROM req
+                WHERE p.id = req.product_id AND p.stock_shards = 0
+                RETURNING p.id, p.price
+            ), priced AS (
+                SELECT id, price FROM stock
+                UNION ALL
+                SELECT id, price FROM products WHERE id = ANY(%(sharded_ids)s::int[])
+            )
+            INSERT INTO order_items (order_id, order_date, product_id, quantity, price)
+            SELECT %(order_id)s, %(order_date)s, req.product_id, req.quantity, priced.price
+            FROM req
+            JOIN priced ON priced.id = req.product_id
+            ON CONFLICT ON CONSTRAINT order_items_order_product_key
+            DO UPDATE SET quantity = order_items.quantity + EXCLUDED.quantity
+            RETURNING product_id, quantity,
+                CASE WHEN xmax = 0 THEN 'added' ELSE 'updated' END AS action
+        """, {
+            'order_id': order_id,
+            'order_date': order['order_date'],
+            'product_ids': product_ids,
+            'sharded_ids': sorted(sharded),
+            'quantities': [requested[pid] for pid in product_ids]
+        })
+        applied = {row['product_id']: row for row in cursor.fetchall()}
+
+    for result in results:
+        product = products[result['product_id']]
+        item = applied[result['product_id']]
+        result.update({
+            'action': item['action'],
+            'final_quantity': item['quantity'],
+            'product_name': product['name'],
+            'price_per_unit': float(product['price'])
+        })
+
+    return results
+
+
+def take_sharded_stock(cursor, product_id, quantity):
+    """Списание из шардов остатка товара; False, если суммарного остатка не хватает"""
+    cursor.execute("SELECT take_sharded_stock(%s, %s) AS taken", (product_id, quantity))
+    return cursor.fetchone()['taken']
+
+
+def set_stock_shards(cursor, product_id, shards):
+    """
+    Включение (shards > 0) или отключение (shards = 0) шардированного остатка товара.
+
+    Текущий остаток (products.quantity или сумма старых шардов) делится поровну
+    между shards строками product_stock_shards, при отключении переносится
+    обратно в products.quantity. Строка товара и шарды блокируются, поэтому
+    резервирования, ждущие старый шард, завершатся отказом - клиент повторит.
+    Возвращает суммарный остаток.
+    """
+    if shards < 0:
+        raise ValueError('shards must be non-negative')
+    cursor.execute("SELECT quantity, stock_shards FROM products WHERE id = %s FOR UPDATE", (product_id,))
+    product = cursor.fetchone()
+    if not product:
+        raise ReservationError({'error': 'Product not found'}, 404)
+
+    total = product['quantity']
+    if product['stock_shards'] > 0:
+        cursor.execute("""
+            SELECT quantity FROM product_stock_shards
+            WHERE product_id = %s
+            ORDER BY shard
+            FOR UPDATE
+        """, (product_id,))
+        total = sum(row['quantity'] for row in cursor.fetchall())
+        cursor.execute("DELETE FROM product_stock_shards WHERE product_id = %s", (product_id,))
+
+    if shards > 0:
+        cursor.execute("""
+            INSERT INTO product_stock_shards (product_id, shard, quantity)
+            SELECT %(product_id)s, shard,
+                %(total)s / %(shards)s + CASE WHEN shard < %(total)s %% %(shards)s THEN 1 ELSE 0 END
+            FROM generate_series(0, %(shards)s - 1) AS shard
+        """, {'product_id': product_id, 'total': total, 'shards': shards})
+    cursor.execute(
+        "UPDATE products SET quantity = %s, stock_shards = %s WHERE id = %s",
+        (total, shards, product_id)
+    )
+    return total
+
+
+def main():
+    """Включение/отключение шардированного остатка: python inventory.py PRODUCT_ID SHARDS"""
+    import argparse
+
+    from psycopg2.extras import RealDictCursor
+
+    from database import Database
+
+    parser = argparse.ArgumentParser(description='Split stock of a hot product across counter rows')
+    parser.add_argument('product_id', type=int)
+    parser.add_argument('shards', type=int, help='number of stock shards, 0 to disable sharding')
+    args = parser.parse_args()
+
+    Database.init_pool(minconn=1, maxconn=1)
+    try:
+        total = Database.run_in_transaction(
+            lambda cursor: set_stock_shards(cursor, args.product_id, args.shards),
+            operation='set_stock_shards',
+            cursor_factory=RealDictCursor
+        )
+    finally:
+        Database.close_pool()
+    print(f"Product {args.product_id}: {total} in stock across {args.shards or 1} row(s)")
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Периодические задачи обслуживания БД.
+
+Запуск: python maintenance.py           - бесконечный цикл по расписанию задач
+        python maintenance.py --once    - однократный запуск всех задач
+        python maintenance.py --task refresh_dashboard_snapshot
+"""
+import argparse
+import logging
+import time
+from contextlib import contextmanager
+from datetime import date
+
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Строк за одно удаление при очистке
+CLEANUP_BATCH_SIZE = 10_000
+
+# Зарегистрированные задачи: имя -> (интервал в секундах, функция(cursor))
+TASKS = {}
+
+
+def task(interval):
+    """Регистрация периодической задачи; функция получает курсор в режиме autocommit"""
+    def decorator(func):
+        TASKS[func.__name__] = (interval, func)
+        return func
+    return decorator
+
+
+@task(Config.DASHBOARD_REFRESH_INTERVAL)
+def refresh_dashboard_snapshot(cursor):
+    """Пересчет снимка метрик дашборда без блокировки чтения"""
+    cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY dashboard_stats_snapshot")
+
+
+@task(Config.IDEMPOTENCY_CLEANUP_INTERVAL)
+def cleanup_idempotency_keys(cursor):
+    """Удаление ключей идемпотентности старше IDEMPOTENCY_KEY_TTL порциями, чтобы не держать длинных блокировок"""
+    deleted = 0
+    while True:
+        cursor.execute("""
+            DELETE FROM idempotency_keys
+            WHERE ctid = ANY(ARRAY(
+                SELECT ctid FROM idempotency_keys
+                WHERE created_at < now() - %s * INTERVAL '1 second'
+                LIMIT %s
+            ))
+        """, (Config.IDEMPOTENCY_KEY_TTL, CLEANUP_BATCH_SIZE))
+        deleted += cursor.rowcount
+        if cursor.rowcount < CLEANUP_BATCH_SIZE:
+            break
+    logger.info("Deleted %s expired idempotency keys", deleted)
+
+
+@contextmanager
+def lock_timeout(cursor, milliseconds):
+    """lock_timeout для DDL задачи: не ждать дольше, блокируя очередь запросов к таблице"""
+    cursor.execute("SELECT set_config('lock_timeout', %s, false)", (str(milliseconds),))
+    try:
+        yield
+    finally:
+        cursor.execute("RESET lock_timeout")
+
+
+def add_months(day, months):
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+@task(Config.ORDER_PARTITIONS_INTERVAL)
+def ensure_order_partitions(cursor):
+    """Секции orders/order_items на ORDER_PARTITIONS_AHEAD месяцев вперед"""
+    today = date.today()
+    with lock_timeout(cursor, Config.ORDER_PARTITIONS_LOCK_TIMEOUT):
+        cursor.execute(
+            "SELECT create_order_partitions(%s, %s)",
+            (today, add_months(today, Config.ORDER_PARTITIONS_AHEAD))
+        )
+        created = cursor.fetchone()[0]
+    if created:
+        logger.info("Created %s order partitions", created)
+
+
+@task(Config.ORDER_PARTITIONS_INTERVAL)
+def archive_order_partitions(cursor):
+    """
+    Отсоединение секций старше ORDER_RETENTION_MONTHS месяцев в схему archive.
+    Каждый месяц - отдельная транзакция; не дождавшийся блокировки месяц переносится на следующий запуск
+    """
+    if Config.ORDER_RETENTION_MONTHS <= 0:
+        return
+    cutoff = add_months(date.today(), -Config.ORDER_RETENTION_MONTHS)
+    cursor.execute("""
+        SELECT to_date(right(c.relname, 7), 'YYYY_MM') AS month
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'orders'::regclass
+            AND c.relname ~ '^orders_[0-9]{4}_[0-9]{2}$'
+            AND to_date(right(c.relname, 7), 'YYYY_MM') < %s
+        ORDER BY month
+    """, (cutoff,))
+    months = [row[0] for row in cursor.fetchall()]
+    with lock_timeout(cursor, Config.ORDER_PARTITIONS_LOCK_TIMEOUT):
+        for month in months:
+            cursor.execute("SELECT archive_order_partition(%s)", (month,))
+            logger.info("Archived order partitions for %s", month.strftime('%Y-%m'))
+
+
+@task(Config.CUSTOMER_SPEND_RECONCILE_INTERVAL)
+def reconcile_customer_spend(cursor):
+    """Сверка сводки customer_spend с отчетом по заказам; расхождения исправляются и пишутся в лог"""
+    cursor.execute("SELECT customer_id, drift FROM reconcile_customer_spend() ORDER BY customer_id")
+    drifts = cursor.fetchall()
+    if drifts:
+        logger.warning("Customer spend rollup drifted for %s customers, fixed (first: %s)",
+                       len(drifts), ', '.join(f"{customer_id}: {drift:+}" for customer_id, drift in drifts[:10]))
+    else:
+        logger.info("Customer spend rollup is consistent")
+
+
+def run_task(name):
+    _, func = TASKS[name]
+    started = time.monotonic()
+    try:
+        with Database.connection() as conn:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                func(cursor)
+        logger.info("Task %s finished in %.2fs", name, time.monotonic() - started)
+    except Exception as e:
+        logger.error(f"Task {name} failed: {e}")
+
+
+def run_forever():
+    next_run = {name: 0 for name in TASKS}
+    while True:
+        now = time.monotonic()
+        for name, (interval, _) in TASKS.items():
+            if next_run[name] <= now:
+                run_task(name)
+                next_run[name] = time.monotonic() + interval
+        time.sleep(max(0, min(next_run.values()) - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='run every task once and exit')
+    parser.add_argument('--task', choices=sorted(TASKS), help='run a single task once and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    # Задачи выполняются по очереди на одном соединении
+    Database.init_pool(minconn=1, maxconn=Config.DB_SERVICE_POOL_MAX)
+
+    if args.task:
+        run_task(args.task)
+    elif args.once:
+        for name in TASKS:
+            run_task(name)
+    else:
+        run_forever()
+
+
+if __name__ == '__main__':
+    main()
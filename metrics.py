@@ -0,0 +1,146 @@
+"""
+Метрики Prometheus для API и слоя работы с БД.
+
+Под gunicorn метрики воркеров собираются через multiprocess-режим
+prometheus_client: переменная PROMETHEUS_MULTIPROC_DIR указывает на общий
+каталог (см. gunicorn.conf.py).
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+
+# Границы гистограмм для быстрых операций (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'HTTP request latency',
+    ['endpoint', 'method'], buckets=LATENCY_BUCKETS
+)
+RESPONSES = Counter(
+    'api_responses_total', 'HTTP responses by status code and error',
+    ['endpoint', 'status', 'result']
+)
+IDEMPOTENT_REPLAYS = Counter(
+    'api_idempotent_replays_total', 'Requests answered from a stored idempotency key',
+    ['endpoint', 'result']
+)
+DB_STEP_LATENCY = Histogram(
+    'db_step_duration_seconds', 'Duration of individual SQL steps of an operation',
+    ['operation', 'step'], buckets=LATENCY_BUCKETS
+)
+POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a pooled connection',
+    ['pool'], buckets=LATENCY_BUCKETS
+)
+POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pooled connections by state',
+    ['pool', 'state'], multiprocess_mode='livesum'
+)
+POOL_MAX_CONNECTIONS = Gauge(
+    'db_pool_max_connections', 'Pool size limit',
+    ['pool'], multiprocess_mode='livesum'
+)
+REPLICA_LAG = Gauge(
+    'db_replica_lag_seconds', 'Last measured replication lag',
+    ['pool'], multiprocess_mode='max'
+)
+READ_FALLBACKS = Counter(
+    'db_read_fallbacks_total', 'Reads sent to the primary instead of a replica',
+    ['pool', 'reason']
+)
+CATALOG_LOOKUPS = Counter(
+    'catalog_cache_lookups_total', 'Product catalog cache lookups',
+    ['result']
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    'response_cache_lookups_total', 'GET response cache lookups',
+    ['endpoint', 'result']
+)
+CATALOG_INVALIDATIONS = Counter(
+    'catalog_cache_invalidations_total', 'Catalog cache invalidations by changed table',
+    ['table']
+)
+ORDER_EVENTS_PROCESSED = Counter(
+    'order_events_processed_total', 'Order events drained from the outbox',
+    ['event_type']
+)
+ORDER_EVENTS_FAILED = Counter(
+    'order_events_failed_total', 'Order event processing failures',
+    ['event_type']
+)
+ORDER_EVENTS_PENDING = Gauge(
+    'order_events_pending', 'Order events waiting in the outbox by state',
+    ['state'], multiprocess_mode='max'
+)
+ORDER_EVENTS_OLDEST_AGE = Gauge(
+    'order_events_oldest_age_seconds', 'Age of the oldest ready order event',
+    multiprocess_mode='max'
+)
+BULK_IMPORT_ROWS = Counter(
+    'bulk_import_rows_total', 'Rows of bulk order imports by result',
+    ['result']
+)
+DB_ERRORS = Counter(
+    'db_errors_total', 'Database errors by kind',
+    ['kind', 'sqlstate']
+)
+TX_RETRIES = Counter(
+    'db_transaction_retries_total', 'Transactions retried after a retryable error',
+    ['operation', 'sqlstate']
+)
+TX_RETRIES_EXHAUSTED = Counter(
+    'db_transaction_retries_exhausted_total', 'Transactions failed after all retries',
+    ['operation', 'sqlstate']
+)
+
+# SQLSTATE -> вид ошибки
+SQLSTATE_KINDS = {
+    '40P01': 'deadlock',
+    '40001': 'serialization_failure',
+    '55P03': 'lock_not_available',  # в т.ч. превышение lock_timeout
+    '57014': 'query_canceled',      # в т.ч. превышение statement_timeout
+}
+
+
+@contextmanager
+def timed_step(operation, step):
+    """Замер длительности шага операции (отдельного SQL-запроса или коммита)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        DB_STEP_LATENCY.labels(operation, step).observe(time.perf_counter() - started)
+
+
+def record_db_error(error):
+    """Учет ошибки драйвера БД (psycopg2 или asyncpg) по SQLSTATE"""
+    sqlstate = getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None) or ''
+    DB_ERRORS.labels(SQLSTATE_KINDS.get(sqlstate, 'other'), sqlstate).inc()
+
+
+def record_retry(operation, error, exhausted=False):
+    """Учет повтора транзакции или отказа после исчерпания попыток (psycopg2 или asyncpg)"""
+    counter = TX_RETRIES_EXHAUSTED if exhausted else TX_RETRIES
+    counter.labels(operation, getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None) or '').inc()
+
+
+def record_pool_state(pool_name, pool):
+    in_use, idle = pool.stats()
+    POOL_CONNECTIONS.labels(pool_name, 'in_use').set(in_use)
+    POOL_CONNECTIONS.labels(pool_name, 'idle').set(idle)
+    POOL_MAX_CONNECTIONS.labels(pool_name).set(pool.maxconn)
+
+
+def metrics_response():
+    """Текст метрик и его content type"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
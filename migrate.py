@@ -0,0 +1,114 @@
+"""
+Применение версионных миграций схемы из каталога migrations/.
+
+Файлы NNNN_описание.sql применяются по порядку номеров, примененные версии
+хранятся в таблице schema_migrations. Каждый файл выполняется в отдельной
+транзакции; файлы с первой строкой "-- migrate: no-transaction" (например,
+CREATE INDEX CONCURRENTLY) выполняются по одному выражению в autocommit.
+
+Запуск: python migrate.py [--dry-run]
+"""
+import argparse
+import logging
+import re
+from pathlib import Path
+
+import psycopg2
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).with_name('migrations')
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+# Произвольный ключ advisory-блокировки, чтобы миграции не применялись параллельно
+MIGRATIONS_LOCK_ID = 7264001
+
+
+def list_migrations():
+    """Список (версия, путь) в порядке применения"""
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob('*.sql')):
+        match = re.match(r'^(\d+)_', path.name)
+        if not match:
+            raise ValueError(f"Migration file name must start with a version number: {path.name}")
+        migrations.append((path.stem, path))
+    return migrations
+
+
+def split_statements(script):
+    """Разбивка скрипта на выражения по ';' в конце строки (без поддержки $$-тел функций)"""
+    statements = []
+    current = []
+    for line in script.splitlines():
+        if line.strip().startswith('--'):
+            continue
+        current.append(line)
+        if line.rstrip().endswith(';'):
+            statement = '\n'.join(current).strip()
+            if statement != ';':
+                statements.append(statement)
+            current = []
+    tail = '\n'.join(current).strip()
+    if tail:
+        statements.append(tail)
+    return statements
+
+
+def migrate(dsn, dry_run=False):
+    conn = psycopg2.connect(dsn)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version VARCHAR(255) PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            try:
+                cursor.execute("SELECT version FROM schema_migrations")
+                applied = {row[0] for row in cursor.fetchall()}
+
+                for version, path in list_migrations():
+                    if version in applied:
+                        continue
+                    logger.info("Applying migration %s", version)
+                    if dry_run:
+                        continue
+
+                    script = path.read_text(encoding='utf-8')
+                    if script.lstrip().startswith(NO_TRANSACTION_MARKER):
+                        for statement in split_statements(script):
+                            cursor.execute(statement)
+                        cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+                    else:
+                        conn.autocommit = False
+                        try:
+                            cursor.execute(script)
+                            cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+                            conn.commit()
+                        except Exception:
+                            conn.rollback()
+                            raise
+                        finally:
+                            conn.autocommit = True
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=Config.DB_DSN)
+    parser.add_argument('--dry-run', action='store_true', help='only list pending migrations')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    migrate(args.dsn, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+-- migrate: no-transaction
+-- Индексы для горячих запросов по заказам, позициям и категориям.
+-- Создаются CONCURRENTLY, чтобы не блокировать запись на больших таблицах.
+-- order_items(order_id, product_id) уже покрыт ограничением order_items_order_product_key.
+
+-- Позиции заказа: детали и суммы заказа читаются только из индекса (index-only scan)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_items_order_id_covering
+    ON order_items (order_id) INCLUDE (product_id, quantity, price);
+
+-- Продажи по товару (топ товаров, проверка перед удалением товара)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_items_product_id
+    ON order_items (product_id) INCLUDE (order_id, quantity);
+
+-- Заказы клиента (отчет по сумме товаров по клиентам)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_customer_id
+    ON orders (customer_id);
+
+-- Список заказов с фильтром по статусу, отсортированный по дате
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_status_order_date
+    ON orders (current_status, order_date DESC);
+
+-- Отчеты за период (top_5_products_last_month)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_order_date
+    ON orders (order_date);
+
+-- Активные заказы - небольшая часть таблицы, частичный индекс остается маленьким
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_active_order_date
+    ON orders (order_date DESC) INCLUDE (customer_id)
+    WHERE current_status IN ('new', 'processing');
+
+-- Дерево категорий и товары категории
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_categories_parent_id
+    ON categories (parent_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_category_id
+    ON products (category_id);
@@ -0,0 +1,191 @@
+-- Корневая категория для каждой категории и сводные таблицы продаж товаров.
+-- Поддерживаются триггерами, поэтому отчеты читают готовые данные вместо
+-- рекурсивного обхода дерева и агрегации всех позиций заказов.
+
+-- 1. Корневая категория
+CREATE TABLE category_roots (
+    category_id INT PRIMARY KEY REFERENCES categories(id) ON DELETE CASCADE,
+    root_id INT NOT NULL
+);
+
+-- Пересчет корня для категории и всего ее поддерева
+CREATE OR REPLACE FUNCTION refresh_category_roots(start_id INT) RETURNS void AS $$
+    WITH RECURSIVE up AS (
+        SELECT id, parent_id FROM categories WHERE id = start_id
+        UNION ALL
+        SELECT c.id, c.parent_id FROM categories c JOIN up ON c.id = up.parent_id
+    ), down AS (
+        SELECT id FROM categories WHERE id = start_id
+        UNION ALL
+        SELECT c.id FROM categories c JOIN down ON c.parent_id = down.id
+    )
+    INSERT INTO category_roots (category_id, root_id)
+    SELECT down.id, up.id
+    FROM down, up
+    WHERE up.parent_id IS NULL
+    ON CONFLICT (category_id) DO UPDATE SET root_id = EXCLUDED.root_id;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION categories_roots_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_category_roots(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаление категории обнуляет parent_id у дочерних (ON DELETE SET NULL),
+-- это UPDATE, и они пересчитываются как новые корни
+CREATE TRIGGER categories_roots_insert
+    AFTER INSERT ON categories
+    FOR EACH ROW EXECUTE FUNCTION categories_roots_trigger();
+
+CREATE TRIGGER categories_roots_update
+    AFTER UPDATE OF parent_id ON categories
+    FOR EACH ROW
+    WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+    EXECUTE FUNCTION categories_roots_trigger();
+
+WITH RECURSIVE tree AS (
+    SELECT id, id AS root_id FROM categories WHERE parent_id IS NULL
+    UNION ALL
+    SELECT c.id, tree.root_id FROM categories c JOIN tree ON c.parent_id = tree.id
+)
+INSERT INTO category_roots (category_id, root_id)
+SELECT id, root_id FROM tree;
+
+-- 2. Продажи товаров по дням и за все время
+CREATE TABLE product_sales_daily (
+    sale_date DATE NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    sold_amount BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, product_id)
+);
+
+CREATE TABLE product_sales_total (
+    product_id INT PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    sold_amount BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX ix_product_sales_total_sold_amount ON product_sales_total (sold_amount DESC);
+
+CREATE OR REPLACE FUNCTION apply_product_sales_delta(p_product_id INT, p_order_id INT, p_delta BIGINT)
+RETURNS void AS $$
+DECLARE
+    v_order_date DATE;
+BEGIN
+    IF p_delta = 0 THEN
+        RETURN;
+    END IF;
+
+    SELECT order_date::date INTO v_order_date FROM orders WHERE id = p_order_id;
+    IF NOT FOUND THEN
+        -- Заказ удаляется целиком, его позиции уже вычтены триггером на orders
+        RETURN;
+    END IF;
+
+    IF v_order_date IS NOT NULL THEN
+        INSERT INTO product_sales_daily (sale_date, product_id, sold_amount)
+        VALUES (v_order_date, p_product_id, p_delta)
+        ON CONFLICT (sale_date, product_id)
+        DO UPDATE SET sold_amount = product_sales_daily.sold_amount + EXCLUDED.sold_amount;
+    END IF;
+
+    INSERT INTO product_sales_total (product_id, sold_amount)
+    VALUES (p_product_id, p_delta)
+    ON CONFLICT (product_id)
+    DO UPDATE SET sold_amount = product_sales_total.sold_amount + EXCLUDED.sold_amount;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION order_items_sales_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_product_sales_delta(OLD.product_id, OLD.order_id, -OLD.quantity);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_product_sales_delta(NEW.product_id, NEW.order_id, NEW.quantity);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER order_items_sales
+    AFTER INSERT OR DELETE OR UPDATE OF order_id, product_id, quantity ON order_items
+    FOR EACH ROW EXECUTE FUNCTION order_items_sales_trigger();
+
+CREATE OR REPLACE FUNCTION orders_sales_trigger() RETURNS trigger AS $$
+BEGIN
+    -- Вычитаем позиции заказа из дня со старой датой (удаление или смена даты)
+    IF OLD.order_date IS NOT NULL THEN
+        UPDATE product_sales_daily s
+        SET sold_amount = s.sold_amount - oi.quantity
+        FROM order_items oi
+        WHERE oi.order_id = OLD.id
+            AND s.product_id = oi.product_id
+            AND s.sale_date = OLD.order_date::date;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        UPDATE product_sales_total s
+        SET sold_amount = s.sold_amount - oi.quantity
+        FROM order_items oi
+        WHERE oi.order_id = OLD.id AND s.product_id = oi.product_id;
+        RETURN OLD;
+    END IF;
+
+    IF NEW.order_date IS NOT NULL THEN
+        INSERT INTO product_sales_daily (sale_date, product_id, sold_amount)
+        SELECT NEW.order_date::date, oi.product_id, oi.quantity
+        FROM order_items oi
+        WHERE oi.order_id = NEW.id
+        ON CONFLICT (sale_date, product_id)
+        DO UPDATE SET sold_amount = product_sales_daily.sold_amount + EXCLUDED.sold_amount;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER orders_sales_delete
+    BEFORE DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_sales_trigger();
+
+CREATE TRIGGER orders_sales_date_update
+    AFTER UPDATE OF order_date ON orders
+    FOR EACH ROW
+    WHEN (OLD.order_date::date IS DISTINCT FROM NEW.order_date::date)
+    EXECUTE FUNCTION orders_sales_trigger();
+
+INSERT INTO product_sales_daily (sale_date, product_id, sold_amount)
+SELECT o.order_date::date, oi.product_id, SUM(oi.quantity)
+FROM order_items oi
+JOIN orders o ON o.id = oi.order_id
+WHERE o.order_date IS NOT NULL
+GROUP BY o.order_date::date, oi.product_id;
+
+INSERT INTO product_sales_total (product_id, sold_amount)
+SELECT product_id, SUM(quantity)
+FROM order_items
+GROUP BY product_id;
+
+-- 3. Топ-5 товаров за последний месяц по сводным таблицам
+-- (граница месяца считается с точностью до дня)
+DROP VIEW IF EXISTS top_5_products_last_month;
+
+CREATE VIEW top_5_products_last_month AS
+SELECT
+    p.name AS product,
+    root_category.name AS category_1_lvl,
+    s.sold_amount
+FROM (
+    SELECT product_id, SUM(sold_amount) AS sold_amount
+    FROM product_sales_daily
+    WHERE sale_date > (NOW() - INTERVAL '1 month')::date
+        AND sale_date <= NOW()::date
+    GROUP BY product_id
+    ORDER BY SUM(sold_amount) DESC
+    LIMIT 5
+) s
+INNER JOIN products p ON p.id = s.product_id
+LEFT JOIN category_roots cr ON cr.category_id = p.category_id
+LEFT JOIN categories root_category ON root_category.id = cr.root_id
+ORDER BY s.sold_amount DESC;
@@ -0,0 +1,35 @@
+-- migrate: no-transaction
+-- Keyset-пагинация списков заказов и товаров и поиск по подстроке.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Курсор (order_date, id) не работает с NULL, у всех заказов есть дата по умолчанию
+UPDATE orders SET order_date = CURRENT_TIMESTAMP WHERE order_date IS NULL;
+ALTER TABLE orders ALTER COLUMN order_date SET NOT NULL;
+
+-- Заказы: новые сверху, с фильтром по статусу и без
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_order_date_id
+    ON orders (order_date DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_status_order_date_id
+    ON orders (current_status, order_date DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_orders_active_order_date_id
+    ON orders (order_date DESC, id DESC) INCLUDE (customer_id)
+    WHERE current_status IN ('new', 'processing');
+
+-- Заменены индексами с id выше (по ним же выполняются и выборки по диапазону дат)
+DROP INDEX CONCURRENTLY IF EXISTS ix_orders_status_order_date;
+DROP INDEX CONCURRENTLY IF EXISTS ix_orders_order_date;
+DROP INDEX CONCURRENTLY IF EXISTS ix_orders_active_order_date;
+
+-- Товары по названию
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_name_id
+    ON products (name, id);
+
+-- Поиск подстроки (ILIKE '%...%') по названию товара и имени клиента
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_name_trgm
+    ON products USING gin (name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_customers_name_trgm
+    ON customers USING gin (name gin_trgm_ops);
@@ -0,0 +1,42 @@
+-- Снимок метрик дашборда. Чтение - одна строка независимо от объема данных,
+-- пересчет выполняется периодически (maintenance.py) через
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY и не блокирует чтение.
+
+CREATE MATERIALIZED VIEW dashboard_stats_snapshot AS
+WITH order_totals AS (
+    SELECT o.id, o.current_status, COALESCE(SUM(oi.quantity * oi.price), 0) AS amount
+    FROM orders o
+    LEFT JOIN order_items oi ON oi.order_id = o.id
+    GROUP BY o.id, o.current_status
+)
+SELECT
+    1 AS id,
+    NOW() AS refreshed_at,
+    (SELECT COUNT(*) FROM order_totals) AS total_orders,
+    (SELECT COALESCE(SUM(amount), 0) FROM order_totals) AS total_revenue,
+    (SELECT COALESCE(AVG(amount), 0) FROM order_totals) AS avg_order_value,
+    (
+        SELECT COALESCE(jsonb_agg(jsonb_build_object(
+            'current_status', current_status, 'count', count
+        ) ORDER BY current_status), '[]'::jsonb)
+        FROM (
+            SELECT current_status, COUNT(*) AS count
+            FROM order_totals
+            GROUP BY current_status
+        ) s
+    ) AS status_stats,
+    (
+        SELECT COALESCE(jsonb_agg(jsonb_build_object(
+            'name', name, 'total_sold', total_sold
+        ) ORDER BY total_sold DESC), '[]'::jsonb)
+        FROM (
+            SELECT p.name, t.sold_amount AS total_sold
+            FROM product_sales_total t
+            JOIN products p ON p.id = t.product_id
+            ORDER BY t.sold_amount DESC
+            LIMIT 10
+        ) s
+    ) AS top_products;
+
+-- Уникальный индекс обязателен для REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX ix_dashboard_stats_snapshot_id ON dashboard_stats_snapshot (id);
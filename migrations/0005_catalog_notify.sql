@@ -0,0 +1,27 @@
+-- Уведомления об изменении справочника товаров и категорий для кэша catalog.py.
+-- Полезная нагрузка - '<таблица>:<id>' в канале catalog_changes; NOTIFY доставляется
+-- после коммита, одинаковые уведомления одной транзакции склеиваются.
+-- Остатки (products.quantity) в кэш не входят, их изменение уведомлений не порождает.
+
+CREATE OR REPLACE FUNCTION catalog_notify_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('catalog_changes', TG_TABLE_NAME || ':' || COALESCE(NEW.id, OLD.id));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_catalog_notify
+    AFTER INSERT OR DELETE ON products
+    FOR EACH ROW EXECUTE FUNCTION catalog_notify_trigger();
+
+CREATE TRIGGER products_catalog_update_notify
+    AFTER UPDATE OF name, price, category_id ON products
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name
+        OR OLD.price IS DISTINCT FROM NEW.price
+        OR OLD.category_id IS DISTINCT FROM NEW.category_id)
+    EXECUTE FUNCTION catalog_notify_trigger();
+
+CREATE TRIGGER categories_catalog_notify
+    AFTER INSERT OR UPDATE OR DELETE ON categories
+    FOR EACH ROW EXECUTE FUNCTION catalog_notify_trigger();
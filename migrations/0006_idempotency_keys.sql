@@ -0,0 +1,14 @@
+-- Ключи идемпотентности запросов изменения заказа (idempotency.py).
+-- Строка вставляется в транзакции запроса, ответ дописывается перед коммитом;
+-- ключи старше IDEMPOTENCY_KEY_TTL удаляет задача maintenance.py.
+CREATE TABLE idempotency_keys (
+    endpoint VARCHAR(64) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INT,
+    response JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (endpoint, key)
+);
+
+CREATE INDEX ix_idempotency_keys_created_at ON idempotency_keys (created_at);
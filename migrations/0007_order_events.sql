@@ -0,0 +1,143 @@
+-- Очередь событий заказов (outbox). События пишутся триггерами в той же транзакции,
+-- что и изменение заказа, и обрабатываются worker.py вне пути запроса.
+-- Сводные таблицы продаж (0002) теперь обновляет worker по событиям, а не триггеры:
+-- все изменения - коммутативные приращения, поэтому пачки можно обрабатывать
+-- параллельно несколькими воркерами в любом порядке.
+
+CREATE TABLE order_events (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    event_type VARCHAR(32) NOT NULL,
+    order_id INT NOT NULL,
+    product_id INT,
+    -- lines - приращения по позициям: product_id, customer_id, sale_date, quantity, amount
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    -- Повторы после ошибок обработки; после ORDER_EVENTS_MAX_ATTEMPTS available_at = 'infinity'
+    attempts INT NOT NULL DEFAULT 0,
+    available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_error TEXT
+);
+
+CREATE INDEX ix_order_events_available_at ON order_events (available_at, id);
+
+-- Позиции заказа как приращения со знаком p_sign
+CREATE OR REPLACE FUNCTION order_item_lines(p_order_id INT, p_sign INT, p_sale_date DATE, p_customer_id INT)
+RETURNS jsonb AS $$
+    SELECT COALESCE(jsonb_agg(jsonb_build_object(
+        'product_id', product_id,
+        'customer_id', p_customer_id,
+        'sale_date', p_sale_date,
+        'quantity', p_sign * quantity,
+        'amount', p_sign * quantity * price
+    )), '[]'::jsonb)
+    FROM order_items
+    WHERE order_id = p_order_id;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION orders_events_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO order_events (event_type, order_id, payload)
+        VALUES ('order_created', NEW.id, jsonb_build_object(
+            'customer_id', NEW.customer_id, 'status', NEW.current_status
+        ));
+        RETURN NULL;
+    END IF;
+
+    -- BEFORE DELETE: позиции еще не удалены каскадом
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO order_events (event_type, order_id, payload)
+        VALUES ('order_deleted', OLD.id, jsonb_build_object(
+            'customer_id', OLD.customer_id,
+            'lines', order_item_lines(OLD.id, -1, OLD.order_date::date, OLD.customer_id)
+        ));
+        RETURN OLD;
+    END IF;
+
+    IF NEW.current_status IS DISTINCT FROM OLD.current_status THEN
+        INSERT INTO order_events (event_type, order_id, payload)
+        VALUES ('order_status_changed', NEW.id, jsonb_build_object(
+            'customer_id', NEW.customer_id, 'old_status', OLD.current_status, 'new_status', NEW.current_status
+        ));
+    END IF;
+
+    -- Смена дня заказа или клиента переносит его позиции в сводках
+    IF NEW.order_date::date IS DISTINCT FROM OLD.order_date::date
+            OR NEW.customer_id IS DISTINCT FROM OLD.customer_id THEN
+        INSERT INTO order_events (event_type, order_id, payload)
+        VALUES ('order_changed', NEW.id, jsonb_build_object(
+            'customer_id', NEW.customer_id,
+            'lines', order_item_lines(OLD.id, -1, OLD.order_date::date, OLD.customer_id)
+                || order_item_lines(NEW.id, 1, NEW.order_date::date, NEW.customer_id)
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER orders_events_insert
+    AFTER INSERT ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_events_trigger();
+
+CREATE TRIGGER orders_events_update
+    AFTER UPDATE OF current_status, order_date, customer_id ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_events_trigger();
+
+CREATE TRIGGER orders_events_delete
+    BEFORE DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_events_trigger();
+
+CREATE OR REPLACE FUNCTION order_items_events_trigger() RETURNS trigger AS $$
+DECLARE
+    v_lines jsonb := '[]'::jsonb;
+    v_order RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT order_date::date AS sale_date, customer_id INTO v_order FROM orders WHERE id = OLD.order_id;
+        -- Заказ удаляется целиком: его позиции уже в событии order_deleted
+        IF FOUND THEN
+            v_lines := v_lines || jsonb_build_array(jsonb_build_object(
+                'product_id', OLD.product_id,
+                'customer_id', v_order.customer_id,
+                'sale_date', v_order.sale_date,
+                'quantity', -OLD.quantity,
+                'amount', -OLD.quantity * OLD.price
+            ));
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT order_date::date AS sale_date, customer_id INTO v_order FROM orders WHERE id = NEW.order_id;
+        v_lines := v_lines || jsonb_build_array(jsonb_build_object(
+            'product_id', NEW.product_id,
+            'customer_id', v_order.customer_id,
+            'sale_date', v_order.sale_date,
+            'quantity', NEW.quantity,
+            'amount', NEW.quantity * NEW.price
+        ));
+    END IF;
+
+    IF v_lines <> '[]'::jsonb THEN
+        INSERT INTO order_events (event_type, order_id, product_id, payload)
+        VALUES (
+            CASE TG_OP WHEN 'INSERT' THEN 'item_added' WHEN 'UPDATE' THEN 'item_changed' ELSE 'item_removed' END,
+            COALESCE(NEW.order_id, OLD.order_id),
+            COALESCE(NEW.product_id, OLD.product_id),
+            jsonb_build_object('lines', v_lines)
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER order_items_events
+    AFTER INSERT OR DELETE OR UPDATE OF order_id, product_id, quantity, price ON order_items
+    FOR EACH ROW EXECUTE FUNCTION order_items_events_trigger();
+
+-- Синхронное обновление сводок продаж заменено обработкой событий в worker.py
+DROP TRIGGER order_items_sales ON order_items;
+DROP TRIGGER orders_sales_delete ON orders;
+DROP TRIGGER orders_sales_date_update ON orders;
+DROP FUNCTION order_items_sales_trigger();
+DROP FUNCTION orders_sales_trigger();
+DROP FUNCTION apply_product_sales_delta(INT, INT, BIGINT);
@@ -0,0 +1,74 @@
+-- Шардированный остаток для "горячих" товаров. У товара с stock_shards = N > 0
+-- остаток хранится в N строках product_stock_shards, резервирование списывает
+-- его из одного случайного шарда и не блокирует строку products, поэтому
+-- параллельные резервирования одного товара не выстраиваются в очередь.
+-- products.quantity для таких товаров - сумма шардов, ее пересчитывает worker.py.
+
+ALTER TABLE products ADD COLUMN stock_shards INT NOT NULL DEFAULT 0 CHECK (stock_shards >= 0);
+
+CREATE TABLE product_stock_shards (
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    shard INT NOT NULL,
+    quantity INT NOT NULL CHECK (quantity >= 0),
+    PRIMARY KEY (product_id, shard)
+);
+
+-- Списание p_quantity из шардов товара, false - если суммарного остатка не хватает
+CREATE OR REPLACE FUNCTION take_sharded_stock(p_product_id INT, p_quantity INT) RETURNS boolean AS $$
+DECLARE
+    v_shard INT;
+    v_total BIGINT;
+    v_count INT;
+BEGIN
+    -- Случайный шард с достаточным остатком; шарды, занятые другими транзакциями, пропускаются
+    SELECT shard INTO v_shard
+    FROM product_stock_shards
+    WHERE product_id = p_product_id AND quantity >= p_quantity
+    ORDER BY random()
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED;
+
+    IF FOUND THEN
+        UPDATE product_stock_shards SET quantity = quantity - p_quantity
+        WHERE product_id = p_product_id AND shard = v_shard;
+        RETURN true;
+    END IF;
+
+    -- Все подходящие шарды заняты: ожидание случайного из них
+    -- (после ожидания условие перепроверяется по новой версии строки)
+    SELECT shard INTO v_shard
+    FROM product_stock_shards
+    WHERE product_id = p_product_id AND quantity >= p_quantity
+    ORDER BY random()
+    LIMIT 1
+    FOR UPDATE;
+
+    IF FOUND THEN
+        UPDATE product_stock_shards SET quantity = quantity - p_quantity
+        WHERE product_id = p_product_id AND shard = v_shard;
+        RETURN true;
+    END IF;
+
+    -- Ни в одном шарде не хватает остатка - перебалансировка: все шарды блокируются
+    -- по порядку, остаток после списания делится между ними поровну
+    PERFORM 1 FROM product_stock_shards WHERE product_id = p_product_id ORDER BY shard FOR UPDATE;
+    SELECT COALESCE(sum(quantity), 0), count(*) INTO v_total, v_count
+    FROM product_stock_shards
+    WHERE product_id = p_product_id;
+
+    IF v_count = 0 OR v_total < p_quantity THEN
+        RETURN false;
+    END IF;
+
+    UPDATE product_stock_shards s
+    SET quantity = (v_total - p_quantity) / v_count
+        + CASE WHEN r.rn <= (v_total - p_quantity) % v_count THEN 1 ELSE 0 END
+    FROM (
+        SELECT shard, row_number() OVER (ORDER BY shard) AS rn
+        FROM product_stock_shards
+        WHERE product_id = p_product_id
+    ) r
+    WHERE s.product_id = p_product_id AND s.shard = r.shard;
+    RETURN true;
+END;
+$$ LANGUAGE plpgsql;
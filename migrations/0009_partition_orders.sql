@@ -0,0 +1,262 @@
+-- Помесячное секционирование orders и order_items по order_date.
+-- Позиции хранят дату своего заказа и лежат в секции того же месяца, поэтому
+-- отчеты с фильтром по дате читают только последние секции (partition pruning).
+-- Секции на будущие месяцы создает задача ensure_order_partitions, старые секции
+-- задача archive_order_partitions отсоединяет и переносит в схему archive
+-- (maintenance.py).
+--
+-- Таблицы пересоздаются с копированием данных в одной транзакции:
+-- на большой базе миграцию нужно выполнять в окно обслуживания.
+
+-- 1. Старые таблицы уступают имена новым; снимок дашборда зависит от них
+DROP MATERIALIZED VIEW dashboard_stats_snapshot;
+
+ALTER TABLE order_items RENAME TO order_items_unpartitioned;
+ALTER TABLE orders RENAME TO orders_unpartitioned;
+ALTER INDEX orders_pkey RENAME TO orders_unpartitioned_pkey;
+ALTER INDEX order_items_pkey RENAME TO order_items_unpartitioned_pkey;
+ALTER TABLE order_items_unpartitioned
+    RENAME CONSTRAINT order_items_order_product_key TO order_items_unpartitioned_order_product_key;
+
+-- 2. Секционированные таблицы. Ключи включают order_date - так требует секционирование
+CREATE TABLE orders (
+    id INT GENERATED ALWAYS AS IDENTITY,
+    customer_id INT NOT NULL REFERENCES customers(id),
+    order_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    current_status status DEFAULT 'new',
+    CONSTRAINT orders_pkey PRIMARY KEY (id, order_date)
+) PARTITION BY RANGE (order_date);
+
+CREATE TABLE order_items (
+    id INT GENERATED ALWAYS AS IDENTITY,
+    order_id INT NOT NULL,
+    -- Дата заказа: ключ секционирования, совпадает с orders.order_date
+    order_date TIMESTAMP NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id),
+    quantity INT NOT NULL,
+    price DECIMAL(10, 2) NOT NULL, -- Цена на момент продажи
+    CONSTRAINT order_items_pkey PRIMARY KEY (id, order_date)
+) PARTITION BY RANGE (order_date);
+
+-- Секции orders и order_items за месяцы с p_from по p_to (уже существующие пропускаются)
+CREATE OR REPLACE FUNCTION create_order_partitions(p_from DATE, p_to DATE) RETURNS INT AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::date;
+    v_next DATE;
+    v_table TEXT;
+    v_created INT := 0;
+BEGIN
+    WHILE v_month <= p_to LOOP
+        v_next := (v_month + INTERVAL '1 month')::date;
+        FOREACH v_table IN ARRAY ARRAY['orders', 'order_items'] LOOP
+            IF to_regclass(format('public.%I', v_table || to_char(v_month, '_YYYY_MM'))) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+                    v_table || to_char(v_month, '_YYYY_MM'), v_table, v_month, v_next
+                );
+                v_created := v_created + 1;
+            END IF;
+        END LOOP;
+        v_month := v_next;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_order_partitions(
+    COALESCE((SELECT min(order_date)::date FROM orders_unpartitioned), CURRENT_DATE),
+    GREATEST(
+        (SELECT max(order_date)::date FROM orders_unpartitioned),
+        (CURRENT_DATE + INTERVAL '3 months')::date
+    )
+);
+
+-- 3. Перенос данных (триггеры событий создаются позже и не срабатывают)
+INSERT INTO orders (id, customer_id, order_date, current_status)
+OVERRIDING SYSTEM VALUE
+SELECT id, customer_id, order_date, current_status
+FROM orders_unpartitioned;
+
+INSERT INTO order_items (id, order_id, order_date, product_id, quantity, price)
+OVERRIDING SYSTEM VALUE
+SELECT oi.id, oi.order_id, o.order_date, oi.product_id, oi.quantity, oi.price
+FROM order_items_unpartitioned oi
+JOIN orders_unpartitioned o ON o.id = oi.order_id;
+
+SELECT setval(pg_get_serial_sequence('orders', 'id'), COALESCE(max(id), 0) + 1, false) FROM orders;
+SELECT setval(pg_get_serial_sequence('order_items', 'id'), COALESCE(max(id), 0) + 1, false) FROM order_items;
+
+DROP TABLE order_items_unpartitioned;
+DROP TABLE orders_unpartitioned;
+
+-- 4. Ограничения и индексы (0001, 0003) на секционированных таблицах
+ALTER TABLE order_items
+    ADD CONSTRAINT order_items_order_product_key UNIQUE (order_id, product_id, order_date),
+    ADD CONSTRAINT order_items_order_id_fkey FOREIGN KEY (order_id, order_date)
+        REFERENCES orders (id, order_date) ON DELETE CASCADE ON UPDATE CASCADE;
+
+CREATE INDEX ix_order_items_order_id_covering
+    ON order_items (order_id) INCLUDE (product_id, quantity, price);
+
+CREATE INDEX ix_order_items_product_id
+    ON order_items (product_id) INCLUDE (order_id, quantity);
+
+CREATE INDEX ix_orders_customer_id
+    ON orders (customer_id);
+
+CREATE INDEX ix_orders_order_date_id
+    ON orders (order_date DESC, id DESC);
+
+CREATE INDEX ix_orders_status_order_date_id
+    ON orders (current_status, order_date DESC, id DESC);
+
+CREATE INDEX ix_orders_active_order_date_id
+    ON orders (order_date DESC, id DESC) INCLUDE (customer_id)
+    WHERE current_status IN ('new', 'processing');
+
+-- 5. Перенос заказа в другой месяц - это перемещение строк между секциями
+-- (удаление и вставка), которое в PostgreSQL 13 срабатывает как удаление
+-- для каскадных внешних ключей, поэтому запрещен. Внутри месяца дата меняется,
+-- позиции следуют за ней по ON UPDATE CASCADE
+CREATE OR REPLACE FUNCTION orders_partition_guard_trigger() RETURNS trigger AS $$
+BEGIN
+    IF date_trunc('month', NEW.order_date) <> date_trunc('month', OLD.order_date) THEN
+        RAISE EXCEPTION 'order_date of order % cannot be moved to another month', OLD.id
+            USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER orders_partition_guard
+    BEFORE UPDATE OF order_date ON orders
+    FOR EACH ROW
+    WHEN (OLD.order_date IS DISTINCT FROM NEW.order_date)
+    EXECUTE FUNCTION orders_partition_guard_trigger();
+
+-- 6. Триггеры очереди событий (0007). Заказ позиции ищется с датой - в одной секции
+CREATE OR REPLACE FUNCTION order_items_events_trigger() RETURNS trigger AS $$
+DECLARE
+    v_lines jsonb := '[]'::jsonb;
+    v_order RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT order_date::date AS sale_date, customer_id INTO v_order
+        FROM orders
+        WHERE id = OLD.order_id AND order_date = OLD.order_date;
+        -- Заказ удаляется целиком: его позиции уже в событии order_deleted
+        IF FOUND THEN
+            v_lines := v_lines || jsonb_build_array(jsonb_build_object(
+                'product_id', OLD.product_id,
+                'customer_id', v_order.customer_id,
+                'sale_date', v_order.sale_date,
+                'quantity', -OLD.quantity,
+                'amount', -OLD.quantity * OLD.price
+            ));
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT order_date::date AS sale_date, customer_id INTO v_order
+        FROM orders
+        WHERE id = NEW.order_id AND order_date = NEW.order_date;
+        v_lines := v_lines || jsonb_build_array(jsonb_build_object(
+            'product_id', NEW.product_id,
+            'customer_id', v_order.customer_id,
+            'sale_date', v_order.sale_date,
+            'quantity', NEW.quantity,
+            'amount', NEW.quantity * NEW.price
+        ));
+    END IF;
+
+    IF v_lines <> '[]'::jsonb THEN
+        INSERT INTO order_events (event_type, order_id, product_id, payload)
+        VALUES (
+            CASE TG_OP WHEN 'INSERT' THEN 'item_added' WHEN 'UPDATE' THEN 'item_changed' ELSE 'item_removed' END,
+            COALESCE(NEW.order_id, OLD.order_id),
+            COALESCE(NEW.product_id, OLD.product_id),
+            jsonb_build_object('lines', v_lines)
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER orders_events_insert
+    AFTER INSERT ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_events_trigger();
+
+CREATE TRIGGER orders_events_update
+    AFTER UPDATE OF current_status, order_date, customer_id ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_events_trigger();
+
+CREATE TRIGGER orders_events_delete
+    BEFORE DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_events_trigger();
+
+CREATE TRIGGER order_items_events
+    AFTER INSERT OR DELETE OR UPDATE OF order_id, product_id, quantity, price ON order_items
+    FOR EACH ROW EXECUTE FUNCTION order_items_events_trigger();
+
+-- 7. Архив: отсоединение секций месяца p_month. Позиции отсоединяются первыми
+-- и теряют внешний ключ на orders, иначе секцию заказов отсоединить нельзя.
+-- Отсоединенные таблицы остаются доступны для чтения в схеме archive
+CREATE SCHEMA IF NOT EXISTS archive;
+
+CREATE OR REPLACE FUNCTION archive_order_partition(p_month DATE) RETURNS void AS $$
+DECLARE
+    v_suffix TEXT := to_char(p_month, '_YYYY_MM');
+    v_constraint TEXT;
+BEGIN
+    EXECUTE format('ALTER TABLE public.order_items DETACH PARTITION public.%I', 'order_items' || v_suffix);
+    FOR v_constraint IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = format('public.%I', 'order_items' || v_suffix)::regclass
+            AND contype = 'f' AND confrelid = 'public.orders'::regclass
+    LOOP
+        EXECUTE format('ALTER TABLE public.%I DROP CONSTRAINT %I', 'order_items' || v_suffix, v_constraint);
+    END LOOP;
+    EXECUTE format('ALTER TABLE public.orders DETACH PARTITION public.%I', 'orders' || v_suffix);
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', 'order_items' || v_suffix);
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', 'orders' || v_suffix);
+END;
+$$ LANGUAGE plpgsql;
+
+-- 8. Снимок дашборда (0004) поверх секционированных таблиц
+CREATE MATERIALIZED VIEW dashboard_stats_snapshot AS
+WITH order_totals AS (
+    SELECT o.id, o.current_status, COALESCE(SUM(oi.quantity * oi.price), 0) AS amount
+    FROM orders o
+    LEFT JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
+    GROUP BY o.id, o.current_status
+)
+SELECT
+    1 AS id,
+    NOW() AS refreshed_at,
+    (SELECT COUNT(*) FROM order_totals) AS total_orders,
+    (SELECT COALESCE(SUM(amount), 0) FROM order_totals) AS total_revenue,
+    (SELECT COALESCE(AVG(amount), 0) FROM order_totals) AS avg_order_value,
+    (
+        SELECT COALESCE(jsonb_agg(jsonb_build_object(
+            'current_status', current_status, 'count', count
+        ) ORDER BY current_status), '[]'::jsonb)
+        FROM (
+            SELECT current_status, COUNT(*) AS count
+            FROM order_totals
+            GROUP BY current_status
+        ) s
+    ) AS status_stats,
+    (
+        SELECT COALESCE(jsonb_agg(jsonb_build_object(
+            'name', name, 'total_sold', total_sold
+        ) ORDER BY total_sold DESC), '[]'::jsonb)
+        FROM (
+            SELECT p.name, t.sold_amount AS total_sold
+            FROM product_sales_total t
+            JOIN products p ON p.id = t.product_id
+            ORDER BY t.sold_amount DESC
+            LIMIT 10
+        ) s
+    ) AS top_products;
+
+CREATE UNIQUE INDEX ix_dashboard_stats_snapshot_id ON dashboard_stats_snapshot (id);
@@ -0,0 +1,89 @@
+-- Суммы покупок клиентов: сводка для отчета "Сумма товаров по клиентам" (sql_queries.sql),
+-- которая читается по ключу вместо агрегации всей истории заказов.
+-- Сводку обновляет worker.py по событиям позиций и заказов (0007) так же,
+-- как сводки продаж: строки событий уже содержат customer_id и amount.
+-- reconcile_customer_spend() сверяет ее с полным пересчетом (задача maintenance.py).
+
+CREATE TABLE customer_spend (
+    customer_id INT PRIMARY KEY REFERENCES customers(id) ON DELETE CASCADE,
+    amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Топ клиентов читается по индексу без сортировки
+CREATE INDEX ix_customer_spend_amount ON customer_spend (amount DESC, customer_id);
+
+-- Расхождение сводки с полным пересчетом по orders/order_items с учетом событий,
+-- которые worker еще применит (навсегда отложенные, available_at = 'infinity', не учитываются).
+-- Все читается одним снимком, исправление - приращением, поэтому параллельная работа worker
+-- не мешает. Возвращает исправленных клиентов и величину исправления
+CREATE OR REPLACE FUNCTION reconcile_customer_spend()
+RETURNS TABLE (customer_id INT, drift NUMERIC) AS $$
+    WITH expected AS (
+        SELECT o.customer_id, SUM(oi.quantity * oi.price) AS amount
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
+        GROUP BY o.customer_id
+    ), pending AS (
+        SELECT (line->>'customer_id')::int AS customer_id, SUM((line->>'amount')::numeric) AS amount
+        FROM order_events e
+        CROSS JOIN jsonb_array_elements(e.payload->'lines') AS line
+        WHERE e.available_at < 'infinity' AND line->>'customer_id' IS NOT NULL
+        GROUP BY 1
+    ), drift AS (
+        SELECT c.id AS customer_id,
+            COALESCE(x.amount, 0) - COALESCE(p.amount, 0) - COALESCE(s.amount, 0) AS amount
+        FROM customers c
+        LEFT JOIN expected x ON x.customer_id = c.id
+        LEFT JOIN pending p ON p.customer_id = c.id
+        LEFT JOIN customer_spend s ON s.customer_id = c.id
+    ), fixed AS (
+        INSERT INTO customer_spend AS s (customer_id, amount)
+        SELECT d.customer_id, d.amount
+        FROM drift d
+        WHERE d.amount <> 0
+        ORDER BY d.customer_id
+        ON CONFLICT (customer_id) DO UPDATE
+            SET amount = s.amount + EXCLUDED.amount, updated_at = now()
+        RETURNING s.customer_id
+    )
+    SELECT d.customer_id, d.amount
+    FROM drift d
+    JOIN fixed f ON f.customer_id = d.customer_id;
+$$ LANGUAGE sql;
+
+-- Начальное заполнение - та же сверка по пустой сводке
+SELECT count(*) FROM reconcile_customer_spend();
+
+-- Отсоединенные в архив секции (0009) выпадают из отчета, поэтому их суммы вычитаются
+-- из сводки в той же транзакции
+CREATE OR REPLACE FUNCTION archive_order_partition(p_month DATE) RETURNS void AS $$
+DECLARE
+    v_suffix TEXT := to_char(p_month, '_YYYY_MM');
+    v_constraint TEXT;
+BEGIN
+    EXECUTE format($sql$
+        UPDATE customer_spend s
+        SET amount = s.amount - m.amount, updated_at = now()
+        FROM (
+            SELECT o.customer_id, SUM(oi.quantity * oi.price) AS amount
+            FROM public.%I o
+            JOIN public.%I oi ON oi.order_id = o.id
+            GROUP BY o.customer_id
+        ) m
+        WHERE s.customer_id = m.customer_id
+    $sql$, 'orders' || v_suffix, 'order_items' || v_suffix);
+
+    EXECUTE format('ALTER TABLE public.order_items DETACH PARTITION public.%I', 'order_items' || v_suffix);
+    FOR v_constraint IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = format('public.%I', 'order_items' || v_suffix)::regclass
+            AND contype = 'f' AND confrelid = 'public.orders'::regclass
+    LOOP
+        EXECUTE format('ALTER TABLE public.%I DROP CONSTRAINT %I', 'order_items' || v_suffix, v_constraint);
+    END LOOP;
+    EXECUTE format('ALTER TABLE public.orders DETACH PARTITION public.%I', 'orders' || v_suffix);
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', 'order_items' || v_suffix);
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', 'orders' || v_suffix);
+END;
+$$ LANGUAGE plpgsql;
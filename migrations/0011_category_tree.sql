@@ -0,0 +1,140 @@
+-- Дерево категорий как материализованный путь (ltree) рядом со списком смежности.
+-- category_tree.path - id категорий от корня, например '3.17.242'; поддерево и предки
+-- находятся одним запросом по GiST-индексу вместо рекурсивного обхода parent_id.
+-- Число прямых потомков и всех узлов поддерева хранится готовым.
+-- Таблица поддерживается триггерами на categories (как category_roots, 0002);
+-- отдельная таблица не задевает уведомления кэша справочника (0005).
+
+CREATE EXTENSION IF NOT EXISTS ltree;
+
+CREATE TABLE category_tree (
+    category_id INT PRIMARY KEY,
+    path ltree NOT NULL,
+    direct_children INT NOT NULL DEFAULT 0,
+    descendants INT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX ix_category_tree_path ON category_tree USING GIST (path);
+
+-- Приращение счетчиков предков узла с путем p_parent_path (включая его самого).
+-- Строки блокируются в порядке пути, чтобы параллельные изменения не попадали в deadlock
+CREATE OR REPLACE FUNCTION category_tree_adjust(p_parent_path ltree, p_descendants INT, p_children INT)
+RETURNS void AS $$
+    UPDATE category_tree t
+    SET descendants = t.descendants + p_descendants,
+        direct_children = t.direct_children + CASE WHEN t.path = p_parent_path THEN p_children ELSE 0 END
+    FROM (
+        SELECT category_id FROM category_tree
+        WHERE path @> p_parent_path
+        ORDER BY path
+        FOR UPDATE
+    ) a
+    WHERE t.category_id = a.category_id;
+$$ LANGUAGE sql;
+
+-- Пересчет счетчиков предков по фактическому дереву (после удаления категории)
+CREATE OR REPLACE FUNCTION category_tree_recount(p_parent_path ltree) RETURNS void AS $$
+    UPDATE category_tree t
+    SET descendants = (SELECT count(*) FROM category_tree d WHERE d.path <@ t.path) - 1,
+        direct_children = (
+            SELECT count(*) FROM category_tree d WHERE d.path ~ (t.path::text || '.*{1}')::lquery
+        )
+    FROM (
+        SELECT category_id FROM category_tree
+        WHERE path @> p_parent_path
+        ORDER BY path
+        FOR UPDATE
+    ) a
+    WHERE t.category_id = a.category_id;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION categories_tree_trigger() RETURNS trigger AS $$
+DECLARE
+    v_parent_path ltree;
+    v_node RECORD;
+    v_path ltree;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT path INTO v_parent_path FROM category_tree WHERE category_id = NEW.parent_id;
+        INSERT INTO category_tree (category_id, path)
+        VALUES (NEW.id, COALESCE(v_parent_path, ''::ltree) || NEW.id::text);
+        IF v_parent_path IS NOT NULL THEN
+            PERFORM category_tree_adjust(v_parent_path, 1, 1);
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    -- Удаление: дочерние категории становятся корнями (ON DELETE SET NULL) своими
+    -- UPDATE, порядок которых относительно этого триггера не важен - счетчики
+    -- предков пересчитываются по фактическому дереву
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM category_tree WHERE category_id = OLD.id RETURNING path INTO v_path;
+        IF nlevel(v_path) > 1 THEN
+            PERFORM category_tree_recount(subpath(v_path, 0, nlevel(v_path) - 1));
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    -- Перенос поддерева под другого родителя
+    SELECT path, descendants INTO v_node FROM category_tree WHERE category_id = NEW.id;
+    SELECT path INTO v_parent_path FROM category_tree WHERE category_id = NEW.parent_id;
+    IF v_parent_path <@ v_node.path THEN
+        RAISE EXCEPTION 'Category % cannot be moved into its own subtree', NEW.id
+            USING ERRCODE = 'check_violation';
+    END IF;
+
+    IF nlevel(v_node.path) > 1 THEN
+        PERFORM category_tree_adjust(subpath(v_node.path, 0, nlevel(v_node.path) - 1), -(v_node.descendants + 1), -1);
+    END IF;
+    v_path := COALESCE(v_parent_path, ''::ltree) || NEW.id::text;
+    UPDATE category_tree
+    SET path = CASE WHEN path = v_node.path THEN v_path ELSE v_path || subpath(path, nlevel(v_node.path)) END
+    WHERE path <@ v_node.path;
+    IF v_parent_path IS NOT NULL THEN
+        PERFORM category_tree_adjust(v_parent_path, v_node.descendants + 1, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER categories_tree_insert
+    AFTER INSERT ON categories
+    FOR EACH ROW EXECUTE FUNCTION categories_tree_trigger();
+
+CREATE TRIGGER categories_tree_update
+    AFTER UPDATE OF parent_id ON categories
+    FOR EACH ROW
+    WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+    EXECUTE FUNCTION categories_tree_trigger();
+
+CREATE TRIGGER categories_tree_delete
+    AFTER DELETE ON categories
+    FOR EACH ROW EXECUTE FUNCTION categories_tree_trigger();
+
+-- Полное построение по parent_id: пути рекурсивным обходом от корней,
+-- счетчики - по предкам каждого узла, которые уже есть в его пути
+CREATE OR REPLACE FUNCTION rebuild_category_tree() RETURNS void AS $$
+    DELETE FROM category_tree;
+
+    WITH RECURSIVE tree AS (
+        SELECT id, id::text::ltree AS path FROM categories WHERE parent_id IS NULL
+        UNION ALL
+        SELECT c.id, tree.path || c.id::text FROM categories c JOIN tree ON c.parent_id = tree.id
+    )
+    INSERT INTO category_tree (category_id, path)
+    SELECT id, path FROM tree;
+
+    UPDATE category_tree t
+    SET descendants = s.descendants, direct_children = s.direct_children
+    FROM (
+        SELECT subpath(d.path, i - 1, 1)::text::int AS category_id,
+            count(*) AS descendants,
+            count(*) FILTER (WHERE i = nlevel(d.path) - 1) AS direct_children
+        FROM category_tree d
+        CROSS JOIN generate_series(1, nlevel(d.path) - 1) AS i
+        GROUP BY 1
+    ) s
+    WHERE t.category_id = s.category_id;
+$$ LANGUAGE sql;
+
+SELECT rebuild_category_tree();
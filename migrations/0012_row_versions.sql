@@ -0,0 +1,49 @@
+-- Версии строк для ETag ответов GET-эндпоинтов app.py (заказ, позиции, остаток).
+-- Версия берется из общей последовательности при вставке и при каждом изменении
+-- строки, поэтому максимум версий набора строк растет при любом изменении в нем;
+-- удаление строки видно по числу строк. У существующих строк версия 0 - столбец
+-- добавляется без перезаписи таблиц.
+
+CREATE SEQUENCE row_version_seq;
+
+ALTER TABLE orders ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE orders ALTER COLUMN version SET DEFAULT nextval('row_version_seq');
+ALTER TABLE order_items ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE order_items ALTER COLUMN version SET DEFAULT nextval('row_version_seq');
+ALTER TABLE products ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE products ALTER COLUMN version SET DEFAULT nextval('row_version_seq');
+-- Остаток товара с шардами (0008) меняется только в шардах
+ALTER TABLE product_stock_shards ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE product_stock_shards ALTER COLUMN version SET DEFAULT nextval('row_version_seq');
+
+CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := nextval('row_version_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- UPDATE без фактических изменений версию не меняет
+CREATE TRIGGER orders_row_version
+    BEFORE UPDATE ON orders
+    FOR EACH ROW
+    WHEN (OLD IS DISTINCT FROM NEW)
+    EXECUTE FUNCTION bump_row_version();
+
+CREATE TRIGGER order_items_row_version
+    BEFORE UPDATE ON order_items
+    FOR EACH ROW
+    WHEN (OLD IS DISTINCT FROM NEW)
+    EXECUTE FUNCTION bump_row_version();
+
+CREATE TRIGGER products_row_version
+    BEFORE UPDATE ON products
+    FOR EACH ROW
+    WHEN (OLD IS DISTINCT FROM NEW)
+    EXECUTE FUNCTION bump_row_version();
+
+CREATE TRIGGER product_stock_shards_row_version
+    BEFORE UPDATE ON product_stock_shards
+    FOR EACH ROW
+    WHEN (OLD IS DISTINCT FROM NEW)
+    EXECUTE FUNCTION bump_row_version();
@@ -0,0 +1,83 @@
+-- Дата заказа по id. Первичный ключ секционированной orders (0009) - (id, order_date),
+-- поэтому поиск заказа только по id проверяет индекс каждой месячной секции.
+-- Горячие пути (добавление позиции, GET заказа) берут order_date отсюда подзапросом,
+-- и поиск в orders отсекается до одной секции при выполнении запроса.
+-- Таблицу поддерживают триггеры на orders; первичный ключ заодно не дает
+-- появиться двум заказам с одним id в разных секциях.
+
+CREATE TABLE order_dates (
+    order_id INT PRIMARY KEY,
+    order_date TIMESTAMP NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION order_dates_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO order_dates (order_id, order_date) VALUES (NEW.id, NEW.order_date);
+        RETURN NEW;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE order_dates SET order_id = NEW.id, order_date = NEW.order_date WHERE order_id = OLD.id;
+        RETURN NEW;
+    END IF;
+    DELETE FROM order_dates WHERE order_id = OLD.id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Новые заказы не появятся между созданием триггеров и заполнением таблицы
+LOCK TABLE orders IN SHARE MODE;
+
+CREATE TRIGGER orders_dates_insert
+    AFTER INSERT ON orders
+    FOR EACH ROW EXECUTE FUNCTION order_dates_trigger();
+
+-- Внутри месяца дата заказа может меняться (0009)
+CREATE TRIGGER orders_dates_update
+    AFTER UPDATE OF id, order_date ON orders
+    FOR EACH ROW
+    WHEN (OLD.id IS DISTINCT FROM NEW.id OR OLD.order_date IS DISTINCT FROM NEW.order_date)
+    EXECUTE FUNCTION order_dates_trigger();
+
+CREATE TRIGGER orders_dates_delete
+    AFTER DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION order_dates_trigger();
+
+INSERT INTO order_dates (order_id, order_date)
+SELECT id, order_date FROM orders;
+
+-- Заказы архивных секций из orders не читаются, их даты удаляются при отсоединении.
+-- Остальное - как в 0010
+CREATE OR REPLACE FUNCTION archive_order_partition(p_month DATE) RETURNS void AS $$
+DECLARE
+    v_suffix TEXT := to_char(p_month, '_YYYY_MM');
+    v_constraint TEXT;
+BEGIN
+    EXECUTE format($sql$
+        UPDATE customer_spend s
+        SET amount = s.amount - m.amount, updated_at = now()
+        FROM (
+            SELECT o.customer_id, SUM(oi.quantity * oi.price) AS amount
+            FROM public.%I o
+            JOIN public.%I oi ON oi.order_id = o.id
+            GROUP BY o.customer_id
+        ) m
+        WHERE s.customer_id = m.customer_id
+    $sql$, 'orders' || v_suffix, 'order_items' || v_suffix);
+    EXECUTE format(
+        'DELETE FROM order_dates d USING public.%I o WHERE d.order_id = o.id',
+        'orders' || v_suffix
+    );
+
+    EXECUTE format('ALTER TABLE public.order_items DETACH PARTITION public.%I', 'order_items' || v_suffix);
+    FOR v_constraint IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = format('public.%I', 'order_items' || v_suffix)::regclass
+            AND contype = 'f' AND confrelid = 'public.orders'::regclass
+    LOOP
+        EXECUTE format('ALTER TABLE public.%I DROP CONSTRAINT %I', 'order_items' || v_suffix, v_constraint);
+    END LOOP;
+    EXECUTE format('ALTER TABLE public.orders DETACH PARTITION public.%I', 'orders' || v_suffix);
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', 'order_items' || v_suffix);
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', 'orders' || v_suffix);
+END;
+$$ LANGUAGE plpgsql;
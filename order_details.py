@@ -0,0 +1,108 @@
+"""
+Детали заказов одним запросом: заголовок, позиции, суммы по строкам и по заказу.
+
+Результат - DataFrame по позициям (заказ без позиций - одна строка с пустыми
+полями позиции), собранный из кортежей курсора без промежуточных словарей.
+Суммы считаются в БД как quantity * price: order_items.price - цена за единицу.
+Подходит и для одного заказа (API, Streamlit), и для пачки заказов в отчетах.
+"""
+import pandas as pd
+
+# Столбцы заголовка заказа и позиции в результате ORDER_DETAILS_SQL
+HEADER_COLUMNS = ('order_id', 'customer_id', 'customer_name', 'address', 'current_status', 'order_date',
+                  'order_total', 'items_count')
+ITEM_COLUMNS = ('item_id', 'product_id', 'product_name', 'quantity', 'price', 'line_total')
+
+# Типы столбцов: поля позиции nullable (LEFT JOIN), деньги - float64 для векторных расчетов
+DETAILS_DTYPES = {
+    'order_id': 'int64',
+    'customer_id': 'int64',
+    'current_status': 'category',
+    'order_date': 'datetime64[ns]',
+    'order_total': 'float64',
+    'items_count': 'int64',
+    'item_id': 'Int64',
+    'product_id': 'Int64',
+    'quantity': 'Int64',
+    'price': 'float64',
+    'line_total': 'float64',
+}
+
+# Поиск по id проверяет индекс каждой месячной секции; границы order_date отсекают лишние секции
+ORDER_DETAILS_SQL = """
+    SELECT
+        o.id AS order_id, o.customer_id, c.name AS customer_name, c.address,
+        o.current_status, o.order_date,
+        COALESCE(sum(oi.quantity * oi.price) OVER w, 0)::float8 AS order_total,
+        count(oi.id) OVER w AS items_count,
+        oi.id AS item_id, oi.product_id, p.name AS product_name, oi.quantity,
+        oi.price::float8 AS price,
+        (oi.quantity * oi.price)::float8 AS line_total
+    FROM orders o
+    JOIN customers c ON c.id = o.customer_id
+    LEFT JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
+    LEFT JOIN products p ON p.id = oi.product_id
+    WHERE o.id = ANY(%(order_ids)s::int[]){filters}
+    WINDOW w AS (PARTITION BY o.id)
+    ORDER BY o.id, oi.id
+"""
+
+
+def details_frame(cursor):
+    """DataFrame из результата ORDER_DETAILS_SQL: кортежи курсора сразу раскладываются по столбцам"""
+    columns = [column.name for column in cursor.description]
+    frame = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+    return frame.astype(DETAILS_DTYPES)
+
+
+def fetch_order_details(cursor, order_ids, since=None, until=None):
+    """
+    Детали заказов order_ids, по строке на позицию, в порядке (order_id, item_id).
+    since / until - необязательные границы order_date для отсечения секций.
+    Курсор должен возвращать кортежи (не RealDictCursor)
+    """
+    filters = ''
+    if since is not None:
+        filters += ' AND o.order_date >= %(since)s'
+    if until is not None:
+        filters += ' AND o.order_date < %(until)s'
+    cursor.execute(ORDER_DETAILS_SQL.format(filters=filters), {
+        'order_ids': list(order_ids),
+        'since': since,
+        'until': until,
+    })
+    return details_frame(cursor)
+
+
+def order_headers(frame):
+    """Заголовки и итоги заказов: по строке на заказ"""
+    return frame.drop_duplicates('order_id')[list(HEADER_COLUMNS)].reset_index(drop=True)
+
+
+def order_items(frame, order_id=None):
+    """Позиции заказов (или одного заказа) без пустых строк заказов без позиций"""
+    items = frame[frame['item_id'].notna()]
+    if order_id is not None:
+        items = items[items['order_id'] == order_id]
+    return items[['order_id', *ITEM_COLUMNS]].reset_index(drop=True)
+
+
+def details_to_json(frame):
+    """Детали для ответа API: список заказов с итогом и вложенными позициями"""
+    headers = order_headers(frame)
+    items = order_items(frame)
+    items_by_order = {
+        order_id: group.drop(columns='order_id').to_dict('records')
+        for order_id, group in items.groupby('order_id', sort=False)
+    }
+    return [{
+        'order_id': int(header.order_id),
+        'customer_id': int(header.customer_id),
+        'customer_name': header.customer_name,
+        'address': header.address,
+        'status': header.current_status,
+        'order_date': header.order_date.isoformat(),
+        'total': float(header.order_total),
+        'items_count': int(header.items_count),
+        'items': items_by_order.get(header.order_id, []),
+    } for header in headers.itertuples(index=False)]
@@ -0,0 +1,92 @@
+"""
+Чтение заказа, его позиций и остатка товара для GET-эндпоинтов с ETag.
+
+Каждая функция возвращает (тело ответа, ETag) или None, если записи нет.
+ETag строится из версий строк (migrations/0012_row_versions.sql): версия растет
+при каждом изменении строки, у позиций к наибольшей версии добавляется их число,
+чтобы удаление позиции тоже меняло ETag. В ответах только поля строк, по которым
+считается версия: название товара в позициях не отдается, его дает справочник.
+Заказ ищется с датой из order_dates: читается одна месячная секция.
+Курсор - RealDictCursor.
+"""
+from inventory import ORDER_DATE_SQL
+
+ORDER_SQL = f"""
+    SELECT id, customer_id, current_status, order_date, version
+    FROM orders
+    WHERE id = %(order_id)s AND order_date = {ORDER_DATE_SQL}
+"""
+
+# Заказ без позиций - одна строка с пустыми полями позиции
+ORDER_ITEMS_SQL = f"""
+    SELECT oi.id, oi.product_id, oi.quantity, oi.price, oi.version
+    FROM orders o
+    LEFT JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
+    WHERE o.id = %(order_id)s AND o.order_date = {ORDER_DATE_SQL}
+    ORDER BY oi.id
+"""
+
+# Остаток товара с шардами меняется только в product_stock_shards: версия - наибольшая из строк
+PRODUCT_STOCK_SQL = """
+    SELECT
+        p.id, p.stock_shards,
+        CASE WHEN p.stock_shards > 0 THEN COALESCE(s.quantity, 0) ELSE p.quantity END AS stock_quantity,
+        GREATEST(p.version, s.version) AS version
+    FROM products p
+    LEFT JOIN LATERAL (
+        SELECT sum(quantity) AS quantity, max(version) AS version
+        FROM product_stock_shards
+        WHERE product_id = p.id
+    ) s ON p.stock_shards > 0
+    WHERE p.id = %(product_id)s
+"""
+
+
+def etag(*parts):
+    return '-'.join(str(part) for part in parts)
+
+
+def read_order(cursor, order_id):
+    """Заголовок заказа"""
+    cursor.execute(ORDER_SQL, {'order_id': order_id})
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        'order_id': row['id'],
+        'customer_id': row['customer_id'],
+        'status': row['current_status'],
+        'order_date': row['order_date'].isoformat(),
+    }, etag(row['version'])
+
+
+def read_order_items(cursor, order_id):
+    """Позиции заказа с суммами по строкам"""
+    cursor.execute(ORDER_ITEMS_SQL, {'order_id': order_id})
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    items = [row for row in rows if row['id'] is not None]
+    return {
+        'order_id': order_id,
+        'items': [{
+            'item_id': item['id'],
+            'product_id': item['product_id'],
+            'quantity': item['quantity'],
+            'price': float(item['price']),
+            'line_total': float(item['quantity'] * item['price']),
+        } for item in items],
+    }, etag(max((item['version'] for item in items), default=0), len(items))
+
+
+def read_product_stock(cursor, product_id):
+    """Текущий остаток товара"""
+    cursor.execute(PRODUCT_STOCK_SQL, {'product_id': product_id})
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        'product_id': row['id'],
+        'stock_quantity': int(row['stock_quantity']),
+        'sharded': row['stock_shards'] > 0,
+    }, etag(row['version'])
@@ -0,0 +1,3 @@
+#!/bin/bash
+# Разрешает реплике из docker-compose.replica.yml подключение для потоковой репликации
+echo "host replication all all md5" >> "$PGDATA/pg_hba.conf"
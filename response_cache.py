@@ -0,0 +1,53 @@
+"""
+Кэш ответов GET-эндпоинтов в памяти процесса (TTL + LRU).
+
+Хранит готовое тело ответа и его ETag по пути запроса. В пределах
+READ_CACHE_TTL повторный запрос отвечается из памяти без обращения к БД
+(в том числе 304 на If-None-Match), поэтому ответ может отставать от БД
+не больше чем на TTL. После истечения срока запись перечитывается; ETag
+при этом не меняется, если строки не менялись, и клиент по-прежнему
+получает 304. Каждый воркер gunicorn держит свой кэш.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import RESPONSE_CACHE_LOOKUPS
+
+
+class ResponseCache:
+    """LRU путей запросов с ограниченным сроком жизни записей"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # путь -> (время загрузки, ETag, тело)
+
+    def get(self, key, endpoint):
+        """(ETag, тело) свежей записи или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+            else:
+                entry = None
+        RESPONSE_CACHE_LOOKUPS.labels(endpoint, 'miss' if entry is None else 'hit').inc()
+        return entry and entry[1:]
+
+    def put(self, key, etag, body, loaded_at):
+        """
+        Запись ответа, прочитанного из БД в момент loaded_at (time.monotonic() до запроса):
+        срок жизни отсчитывается от начала чтения
+        """
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (loaded_at, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
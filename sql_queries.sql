@@ -1,59 +1,72 @@
 -- Сумма товаров по клиентам
+-- Полный пересчет по всей истории. Дашборд и API читают сводку customer_spend
+-- (migrations/0010_customer_spend.sql), которую maintenance.py сверяет с этим запросом.
 SELECT 
     c.name AS client,
     SUM(oi.quantity * oi.price) AS amount
 FROM customers c
 INNER JOIN orders o ON o.customer_id = c.id
-INNER JOIN order_items oi ON oi.order_id = o.id
+INNER JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
 GROUP BY c.id, c.name
 ORDER BY SUM(oi.quantity * oi.price) DESC;
 
 -- Количество дочерних элементов первого уровня
+-- Число прямых потомков хранится в category_tree (migrations/0011_category_tree.sql)
+-- и поддерживается триггерами на categories, соединение categories с самой собой не нужно.
 SELECT 
-    parent.id AS category_ID,
-    parent.name AS category,
-    COUNT(child.id) AS child_num
-FROM categories parent
-LEFT JOIN categories child ON child.parent_id = parent.id
-GROUP BY parent.id, parent.name
-ORDER BY parent.name;
+    c.id AS category_ID,
+    c.name AS category,
+    t.direct_children AS child_num
+FROM categories c
+INNER JOIN category_tree t ON t.category_id = c.id
+ORDER BY c.name;
 
 -- Топ-5 самых покупаемых товаров
+-- Читает сводные таблицы из migrations/0002_category_roots_and_product_sales.sql:
+-- product_sales_daily (продажи товара по дням) и category_roots (корневая категория),
+-- category_roots поддерживают триггеры на categories, product_sales_daily - обработчик
+-- очереди событий заказов worker.py (migrations/0007_order_events.sql), поэтому продажи
+-- отстают от заказов на время обработки очереди.
+-- Граница месяца считается с точностью до дня.
 CREATE VIEW top_5_products_last_month AS
 SELECT
     p.name AS product,
     root_category.name AS category_1_lvl,
-    SUM(oi.quantity) AS sold_amount
-FROM order_items oi
-INNER JOIN orders o ON oi.order_id = o.id
-INNER JOIN products p ON oi.product_id = p.id
-INNER JOIN categories cat ON p.category_id = cat.id
-LEFT JOIN categories root_category ON (
-    -- Если у категории нет родителя, то она корневая и берем ее саму
-    -- Иначе идем вверх по иерархии, пока не найдем корень
-    root_category.id = (
-        WITH RECURSIVE category_path AS (
-            SELECT id, parent_id, name
-            FROM categories
-            WHERE id = cat.id
-            UNION ALL
-            SELECT c.id, c.parent_id, c.name
-            FROM categories c
-            INNER JOIN category_path cp ON c.id = cp.parent_id
-        )
-        SELECT id FROM category_path WHERE parent_id IS NULL
-    )
-)
-WHERE o.order_date >= NOW() - INTERVAL '1 month'
-    AND o.order_date < NOW()
-GROUP BY p.id, p.name, root_category.name
-ORDER BY SUM(oi.quantity) DESC
-LIMIT 5;
+    s.sold_amount
+FROM (
+    SELECT product_id, SUM(sold_amount) AS sold_amount
+    FROM product_sales_daily
+    WHERE sale_date > (NOW() - INTERVAL '1 month')::date
+        AND sale_date <= NOW()::date
+    GROUP BY product_id
+    ORDER BY SUM(sold_amount) DESC
+    LIMIT 5
+) s
+INNER JOIN products p ON p.id = s.product_id
+LEFT JOIN category_roots cr ON cr.category_id = p.category_id
+LEFT JOIN categories root_category ON root_category.id = cr.root_id
+ORDER BY s.sold_amount DESC;
 
 /*
     Оптимизация:
     1. Добавить в таблицу categories поле для хранения корневой категории сразу
+       (сделано: таблица category_roots)
     2. Отказ от VIEW в пользу таблиц для хранения результатов, т.к. VIEW выполняется каждый раз при обращении к ней.
+       (сделано: product_sales_daily / product_sales_total, VIEW только читает их)
     3. Использование иных способов хранения дерева вместо Adjacency List.
+       (сделано: материализованный путь ltree в category_tree рядом с parent_id,
+       поддерево и предки - один запрос по GiST-индексу, счетчики потомков готовые)
     4. В последствии выносить исторические данные из 'горячих' таблиц
+       (сделано: orders и order_items секционированы по месяцам order_date,
+       migrations/0009_partition_orders.sql; старые секции переносятся в схему archive
+       задачей archive_order_partitions в maintenance.py. Отчеты за период фильтруют
+       order_date в обеих таблицах, чтобы читались только нужные секции, например:
+
+       SELECT c.name AS client, SUM(oi.quantity * oi.price) AS amount
+       FROM orders o
+       JOIN order_items oi ON oi.order_id = o.id AND oi.order_date = o.order_date
+       JOIN customers c ON c.id = o.customer_id
+       WHERE o.order_date >= NOW() - INTERVAL '1 month'
+           AND oi.order_date >= NOW() - INTERVAL '1 month'
+       GROUP BY c.id, c.name)
 */
\ No newline at end of file
@@ -1,11 +1,15 @@
+import functools
 import streamlit as st
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import timedelta
 import plotly.express as px
-import plotly.graph_objects as go
+from catalog import catalog
 from config import Config
+from customer_spend import customer_spend, top_customers
+from database import Database
+from inventory import ACTIVE_ORDER_STATUSES, STOCK_QUANTITY_SQL, ReservationError, reserve_item
+from order_details import fetch_order_details, order_headers, order_items
 
 # Настройка страницы
 st.set_page_config(
@@ -36,255 +40,297 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-class Database:
-    @staticmethod
-    def get_connection():
-        try:
-            conn = psycopg2.connect(
-                host=Config.DB_HOST,
-                port=Config.DB_PORT,
-                database=Config.DB_NAME,
-                user=Config.DB_USER,
-                password=Config.DB_PASSWORD
-            )
-            return conn
-        except Exception as e:
-            st.error(f"Database connection error: {e}")
-            return None
-
-def get_orders(status_filter=None):
-    """Список заказов"""
-    conn = Database.get_connection()
-    if not conn:
-        return []
-    
+@st.cache_resource
+def get_database():
+    """Общий для всех сессий и перезапусков скрипта пул соединений"""
+    Database.init_pool()
+    return Database
+
+def get_connection():
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            if status_filter:
-                cursor.execute("""
-                    SELECT o.*, c.name as customer_name 
-                    FROM orders o 
-                    JOIN customers c ON o.customer_id = c.id 
-                    WHERE o.current_status = %s 
-                    ORDER BY o.order_date DESC
-                """, (status_filter,))
-            else:
-                cursor.execute("""
-                    SELECT o.*, c.name as customer_name 
-                    FROM orders o 
-                    JOIN customers c ON o.customer_id = c.id 
-                    ORDER BY o.order_date DESC
-                """)
-            return cursor.fetchall()
+        return get_database().get_connection()
     except Exception as e:
-        st.error(f"Error fetching orders: {e}")
-        return []
-    finally:
-        conn.close()
+        st.error(f"Database connection error: {e}")
+        return None
 
-def get_order_details(order_id):
-    """Детали заказа"""
-    conn = Database.get_connection()
-    if not conn:
-        return None, []
-    
-    try:
+# Размер страницы для списков заказов и товаров
+PAGE_SIZE = 50
+
+# Кэшированные функции чтения по таблицам, от которых зависит результат
+_CACHE_TAGS = {}
+
+def cached_query(*tables, ttl=60, default=list):
+    """
+    Кэширование результата функции чтения через st.cache_data.
+    Кэш общий для всех сессий и сбрасывается по ttl или invalidate_cache(таблица).
+    Ошибки не кэшируются: выводятся через st.error, возвращается default().
+    """
+    def decorator(func):
+        cached = st.cache_data(ttl=ttl, show_spinner=False)(func)
+        for table in tables:
+            _CACHE_TAGS.setdefault(table, []).append(cached)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return cached(*args, **kwargs)
+            except Exception as e:
+                st.error(f"Error fetching {func.__name__.removeprefix('get_').replace('_', ' ')}: {e}")
+                return default()
+
+        wrapper.clear = cached.clear
+        return wrapper
+    return decorator
+
+def invalidate_cache(*tables):
+    """Сброс кэша всех функций чтения, зависящих от указанных таблиц"""
+    for table in tables:
+        for cached in _CACHE_TAGS.get(table, []):
+            cached.clear()
+
+def like_pattern(search):
+    """Шаблон ILIKE для поиска подстроки с экранированием спецсимволов"""
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+@cached_query('orders', 'customers', ttl=30, default=lambda: ([], None))
+def get_orders_page(statuses=None, search=None, after=None, limit=PAGE_SIZE):
+    """
+    Страница заказов, новые сверху (keyset-пагинация по (order_date, id)).
+    after - курсор (order_date, id) последнего заказа предыдущей страницы.
+    Возвращает (заказы, курсор следующей страницы или None).
+    """
+    conditions, params = [], []
+    if statuses:
+        conditions.append("o.current_status IN %s")
+        params.append(tuple(statuses))
+    if search:
+        if search.isdigit():
+            conditions.append("o.id = %s AND o.order_date = (SELECT order_date FROM order_dates WHERE order_id = %s)")
+            params.extend([int(search)] * 2)
+        else:
+            conditions.append("c.name ILIKE %s")
+            params.append(like_pattern(search))
+    if after:
+        conditions.append("(o.order_date, o.id) < (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with get_database().connection(readonly=True) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            # Информация о заказе
-            cursor.execute("""
-                SELECT o.*, c.name as customer_name, c.address 
-                FROM orders o 
-                JOIN customers c ON o.customer_id = c.id 
-                WHERE o.id = %s
-            """, (order_id,))
-            order = cursor.fetchone()
-            
-            # Товары в заказе
-            cursor.execute("""
-                SELECT oi.*, p.name as product_name 
-                FROM order_items oi 
-                JOIN products p ON oi.product_id = p.id 
-                WHERE oi.order_id = %s
-            """, (order_id,))
-            items = cursor.fetchall()
-            
-            return order, items
-    except Exception as e:
-        st.error(f"Error fetching order details: {e}")
-        return None, []
-    finally:
-        conn.close()
+            cursor.execute(f"""
+                SELECT o.*, c.name as customer_name
+                FROM orders o
+                JOIN customers c ON o.customer_id = c.id
+                {where}
+                ORDER BY o.order_date DESC, o.id DESC
+                LIMIT %s
+            """, params + [limit + 1])
+            rows = [dict(row) for row in cursor.fetchall()]
 
-def get_products():
-    """Список товаров"""
-    conn = Database.get_connection()
-    if not conn:
-        return []
-    
-    try:
+    next_cursor = (rows[limit - 1]['order_date'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@cached_query('orders', 'order_items', 'products', 'customers', ttl=30, default=pd.DataFrame)
+def get_order_details(order_ids, order_date=None):
+    """
+    Детали заказов одним запросом (order_details.py): DataFrame по позициям
+    с суммами по строкам и по заказу. order_date - дата заказа, если известна,
+    чтобы читалась только его месячная секция
+    """
+    until = order_date + timedelta(microseconds=1) if order_date is not None else None
+    with get_database().connection(readonly=True) as conn:
+        with conn.cursor() as cursor:
+            return fetch_order_details(cursor, order_ids, since=order_date, until=until)
+
+@cached_query('products', 'categories', ttl=60, default=lambda: ([], None))
+def get_products_page(search=None, after=None, limit=PAGE_SIZE):
+    """
+    Страница товаров по названию (keyset-пагинация по (name, id)).
+    Возвращает (товары, курсор следующей страницы или None).
+    """
+    conditions, params = [], []
+    if search:
+        conditions.append("p.name ILIKE %s")
+        params.append(like_pattern(search))
+    if after:
+        conditions.append("(p.name, p.id) > (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with get_database().connection(readonly=True) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT p.*, c.name as category_name 
-                FROM products p 
-                JOIN categories c ON p.category_id = c.id 
-                ORDER BY p.name
-            """)
-            return cursor.fetchall()
-    except Exception as e:
-        st.error(f"Error fetching products: {e}")
-        return []
-    finally:
-        conn.close()
+            cursor.execute(f"""
+                SELECT p.*, c.name as category_name
+                FROM products p
+                JOIN categories c ON p.category_id = c.id
+                {where}
+                ORDER BY p.name, p.id
+                LIMIT %s
+            """, params + [limit + 1])
+            rows = [dict(row) for row in cursor.fetchall()]
+
+    next_cursor = (rows[limit - 1]['name'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@cached_query('products', ttl=30, default=lambda: None)
+def get_product_stock(product_id):
+    """Остаток товара (в кэше справочника остатков нет); у товара с шардами - их сумма"""
+    with get_database().connection(readonly=True) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(STOCK_QUANTITY_SQL, {'product_id': product_id})
+            row = cursor.fetchone()
+            return row[0] if row else None
 
+@cached_query('customers', ttl=300)
 def get_customers():
     """Список клиентов"""
-    conn = Database.get_connection()
-    if not conn:
-        return []
-    
-    try:
+    with get_database().connection(readonly=True) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute("SELECT * FROM customers ORDER BY name")
-            return cursor.fetchall()
-    except Exception as e:
-        st.error(f"Error fetching customers: {e}")
-        return []
-    finally:
-        conn.close()
+            return [dict(row) for row in cursor.fetchall()]
 
 def add_product_to_order(order_id, product_id, quantity):
     """Добавление товара в заказ"""
-    conn = Database.get_connection()
-    if not conn:
-        return False, "Database connection error"
-    
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            # Наличие товара
-            cursor.execute("SELECT quantity, price FROM products WHERE id = %s FOR UPDATE", (product_id,))
-            product = cursor.fetchone()
-            
-            if not product:
-                return False, "Product not found"
-            
-            if product['quantity'] < quantity:
-                return False, f"Insufficient stock. Available: {product['quantity']}"
-            
-            # Наличие товара уже в заказе
-            cursor.execute("SELECT id, quantity FROM order_items WHERE order_id = %s AND product_id = %s", 
-                          (order_id, product_id))
-            existing_item = cursor.fetchone()
-            
-            if existing_item:
-                new_quantity = existing_item['quantity'] + quantity
-                cursor.execute("UPDATE order_items SET quantity = %s WHERE id = %s", 
-                              (new_quantity, existing_item['id']))
-            else:
-                cursor.execute("""
-                    INSERT INTO order_items (order_id, product_id, quantity, price)
-                    VALUES (%s, %s, %s, %s)
-                """, (order_id, product_id, quantity, product['price']*quantity))
-            
-            cursor.execute("UPDATE products SET quantity = quantity - %s WHERE id = %s", 
-                          (quantity, product_id))
-            
-            conn.commit()
-            return True, "Product added successfully"
-            
+        # Та же атомарная резервация и тот же повтор при deadlock, что и в API
+        get_database().run_in_transaction(
+            lambda cursor: reserve_item(cursor, order_id, product_id, quantity),
+            operation='add_item',
+            cursor_factory=RealDictCursor,
+            lock_timeout=Config.ORDER_TX_LOCK_TIMEOUT,
+            statement_timeout=Config.ORDER_TX_STATEMENT_TIMEOUT
+        )
+        invalidate_cache('order_items', 'products')
+        return True, "Product added successfully"
+
+    except ReservationError as e:
+        if 'available_quantity' in e.payload:
+            return False, f"{e.payload['error']}. Available: {e.payload['available_quantity']}"
+        return False, e.payload['error']
     except Exception as e:
-        conn.rollback()
         return False, f"Error: {e}"
-    finally:
-        conn.close()
 
 def create_order(customer_id):
     """Создать новый заказ"""
-    conn = Database.get_connection()
+    conn = get_connection()
     if not conn:
         return None, "Database connection error"
-    
+
     try:
         with conn.cursor() as cursor:
             cursor.execute("""
-                INSERT INTO orders (customer_id, current_status) 
-                VALUES (%s, 'new') 
+                INSERT INTO orders (customer_id, current_status)
+                VALUES (%s, 'new')
                 RETURNING id
             """, (customer_id,))
             order_id = cursor.fetchone()[0]
             conn.commit()
+            invalidate_cache('orders')
             return order_id, "Order created successfully"
     except Exception as e:
         conn.rollback()
         return None, f"Error: {e}"
     finally:
-        conn.close()
+        get_database().return_connection(conn)
 
 def update_order_status(order_id, status):
     """Обновление статуса заказа"""
-    conn = Database.get_connection()
+    conn = get_connection()
     if not conn:
         return False, "Database connection error"
-    
+
     try:
         with conn.cursor() as cursor:
-            cursor.execute("UPDATE orders SET current_status = %s WHERE id = %s", (status, order_id))
+            cursor.execute("""
+                UPDATE orders SET current_status = %s
+                WHERE id = %s AND order_date = (SELECT order_date FROM order_dates WHERE order_id = %s)
+            """, (status, order_id, order_id))
             conn.commit()
+            invalidate_cache('orders')
             return True, "Status updated successfully"
     except Exception as e:
         conn.rollback()
         return False, f"Error: {e}"
     finally:
-        conn.close()
+        get_database().return_connection(conn)
 
+@cached_query('dashboard', ttl=30, default=dict)
 def get_dashboard_stats():
-    """Статистика для дашборда"""
-    conn = Database.get_connection()
-    if not conn:
-        return {}
-    
-    try:
+    """Статистика для дашборда из снимка, который пересчитывает maintenance.py"""
+    with get_database().connection(readonly=True) as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            # Общая статистика
             cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_orders,
-                    SUM(price) as total_revenue,
-                    AVG(price) as avg_order_value
-                FROM order_items 
+                SELECT refreshed_at, total_orders, total_revenue, avg_order_value,
+                    status_stats, top_products
+                FROM dashboard_stats_snapshot
             """)
             stats = cursor.fetchone()
-            
-            # Статистика по статусам
-            cursor.execute("""
-                SELECT current_status, COUNT(*) as count 
-                FROM orders 
-                GROUP BY current_status
-            """)
-            status_stats = cursor.fetchall()
-            
-            # Топ товаров
-            cursor.execute("""
-                SELECT p.name, SUM(oi.quantity) as total_sold
-                FROM order_items oi
-                JOIN products p ON oi.product_id = p.id
-                GROUP BY p.id, p.name
-                ORDER BY total_sold DESC
-                LIMIT 10
-            """)
-            top_products = cursor.fetchall()
-            
-            return {
-                'total_orders': stats['total_orders'] or 0,
-                'total_revenue': stats['total_revenue'] or 0,
-                'avg_order_value': stats['avg_order_value'] or 0,
-                'status_stats': status_stats,
-                'top_products': top_products
-            }
-    except Exception as e:
-        st.error(f"Error fetching dashboard stats: {e}")
-        return {}
-    finally:
-        conn.close()
+            return dict(stats) if stats else {}
+
+@cached_query('customer_spend', ttl=30)
+def get_top_customers(limit=10):
+    """Клиенты с наибольшей суммой покупок из сводки customer_spend"""
+    with get_database().connection(readonly=True) as conn:
+        with conn.cursor() as cursor:
+            rows = top_customers(cursor, limit)
+    return [{'customer_id': customer_id, 'name': name, 'amount': float(amount)}
+            for customer_id, name, amount, _ in rows]
+
+@cached_query('customer_spend', ttl=30, default=lambda: None)
+def get_customer_spend(customer_id):
+    """Сумма покупок клиента из сводки customer_spend"""
+    with get_database().connection(readonly=True) as conn:
+        with conn.cursor() as cursor:
+            row = customer_spend(cursor, customer_id)
+    return float(row[2]) if row else None
+
+def keyset_pages(key, fetch_page, params):
+    """
+    Постраничный просмотр с кнопками назад/вперед.
+    fetch_page(after) -> (строки, курсор следующей страницы); в session_state
+    хранится стек курсоров открытых страниц, смена params возвращает к первой.
+    """
+    state = st.session_state.setdefault(key, {'params': None, 'cursors': [None]})
+    if state['params'] != params:
+        state.update(params=params, cursors=[None])
+
+    rows, next_cursor = fetch_page(state['cursors'][-1])
+
+    col1, col2, col3 = st.columns([1, 1, 6])
+    with col1:
+        st.button("← Prev", key=f"{key}_prev", disabled=len(state['cursors']) == 1,
+                  on_click=state['cursors'].pop)
+    with col2:
+        st.button("Next →", key=f"{key}_next", disabled=next_cursor is None,
+                  on_click=state['cursors'].append, args=(next_cursor,))
+    with col3:
+        st.caption(f"Page {len(state['cursors'])}")
+    return rows
+
+def lazy_picker(label, key, fetch_page, format_option):
+    """
+    Выбор из списка с поиском: загружается первая страница совпадений,
+    следующие - по кнопке "Load more". fetch_page(search, after) -> (строки, курсор);
+    страницы читаются через кэш, поэтому после изменений данные актуальны.
+    """
+    search = st.text_input(f"Search {label.lower()}", key=f"{key}_search").strip() or None
+    state = st.session_state.setdefault(key, {'search': None, 'cursors': [None]})
+    if state['search'] != search:
+        state.update(search=search, cursors=[None])
+
+    rows, next_cursor = [], None
+    for after in state['cursors']:
+        page, next_cursor = fetch_page(search, after)
+        rows.extend(page)
+
+    if not rows:
+        return None
+
+    selected = st.selectbox(label, rows, format_func=format_option, key=f"{key}_select")
+    if next_cursor is not None:
+        st.button("Load more", key=f"{key}_more", on_click=state['cursors'].append, args=(next_cursor,))
+    return selected
 
 # Основное приложение
 def main():
@@ -309,6 +355,8 @@ def show_dashboard():
     st.header("Dashboard")
     
     stats = get_dashboard_stats()
+    if stats.get('refreshed_at'):
+        st.caption(f"Updated at {stats['refreshed_at'].strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Метрики
     col1, col2, col3 = st.columns(3)
@@ -331,6 +379,14 @@ def show_dashboard():
         top_df = pd.DataFrame(stats['top_products'])
         fig = px.bar(top_df, x='name', y='total_sold', title='Top 10 Products by Sales')
         st.plotly_chart(fig)
+    
+    # Топ клиентов по сумме покупок
+    top_spenders = get_top_customers(10)
+    if top_spenders:
+        st.subheader("Top Customers by Spend")
+        customers_df = pd.DataFrame(top_spenders)
+        fig = px.bar(customers_df, x='name', y='amount', title='Top 10 Customers by Spend')
+        st.plotly_chart(fig)
 
 def show_orders():
     st.header("Orders Management")
@@ -339,10 +395,14 @@ def show_orders():
     status_filter = st.selectbox("Filter by status", 
                                 ["All", "new", "processing", "shipped", "delivered"])
     
-    if status_filter == "All":
-        orders = get_orders()
-    else:
-        orders = get_orders(status_filter)
+    search = st.text_input("Search by order id or customer name").strip()
+    statuses = None if status_filter == "All" else (status_filter,)
+    
+    orders = keyset_pages(
+        'orders_pages',
+        lambda after: get_orders_page(statuses, search or None, after),
+        (statuses, search)
+    )
     
     if orders:
         # Отображение заказов в таблице
@@ -351,12 +411,14 @@ def show_orders():
         st.dataframe(orders_df[['id', 'customer_name', 'current_status', 'order_date']])
         
         # Детализация заказа
-        selected_order_id = st.selectbox("Select order for details", 
-                                        [f"{o['id']} - {o['customer_name']}" for o in orders])
-        order_id = int(selected_order_id.split(' - ')[0])
+        selected = st.selectbox("Select order for details", orders,
+                                format_func=lambda o: f"{o['id']} - {o['customer_name']}")
+        order_id = selected['id']
         
-        order, items = get_order_details(order_id)
-        if order:
+        details = get_order_details((order_id,), selected['order_date'])
+        if not details.empty:
+            order = order_headers(details).iloc[0]
+            items_df = order_items(details)
             st.subheader(f"Order #{order_id} Details")
             col1, col2 = st.columns(2)
             with col1:
@@ -365,13 +427,12 @@ def show_orders():
                 st.write(f"**Status:** {order['current_status']}")
             with col2:
                 st.write(f"**Order Date:** {order['order_date'].strftime('%Y-%m-%d %H:%M')}")
+                st.write(f"**Total:** {order['order_total']:.2f} ₽")
             
-            # Товары в заказе
-            if items:
+            # Товары в заказе, суммы по строкам посчитаны в запросе
+            if not items_df.empty:
                 st.subheader("Order Items")
-                items_df = pd.DataFrame(items)
-                items_df['total_price'] = items_df['quantity'] * items_df['price']
-                st.dataframe(items_df[['product_name', 'quantity', 'price', 'total_price']])
+                st.dataframe(items_df[['product_name', 'quantity', 'price', 'line_total']])
             
             # Изменение статуса
             new_status = st.selectbox("Change status", 
@@ -391,50 +452,44 @@ def show_orders():
 def add_to_order():
     st.header("Add Product to Order")
     
-    # Выбор заказа
-    orders = get_orders()
-    if not orders:
-        st.warning("No orders available. Please create an order first.")
-        return
-    
-    order_options = [f"{o['id']} - {o['customer_name']} ({o['current_status']})" for o in orders]
-    selected_order = st.selectbox("Select Order", order_options)
-    order_id = int(selected_order.split(' - ')[0])
-    
-    # Проверка статуса заказа
-    order, _ = get_order_details(order_id)
-    if order and order['current_status'] not in ['new', 'processing']:
-        st.error(f"Cannot add products to order with status: {order['current_status']}")
+    # Выбор заказа: в выборке только заказы, которые еще можно менять
+    order = lazy_picker(
+        "Order", 'add_to_order_order',
+        lambda search, after: get_orders_page(ACTIVE_ORDER_STATUSES, search, after),
+        lambda o: f"{o['id']} - {o['customer_name']} ({o['current_status']})"
+    )
+    if not order:
+        st.warning("No active orders found. Please create an order first.")
         return
+    order_id = order['id']
     
-    # Выбор товара
-    products = get_products()
-    if not products:
-        st.warning("No products available.")
+    # Выбор товара: keyset-страницы из БД, категория - из кэша справочника, остаток - только по выбранному товару
+    selected_product_info = lazy_picker(
+        "Product", 'add_to_order_product',
+        lambda search, after: get_products_page(search, after),
+        lambda p: f"{p['id']} - {p['name']}"
+    )
+    if not selected_product_info:
+        st.warning("No products found.")
         return
-    
-    product_options = [f"{p['id']} - {p['name']} (Stock: {p['quantity']})" for p in products]
-    selected_product = st.selectbox("Select Product", product_options)
-    product_id = int(selected_product.split(' - ')[0])
-    
-    # Получение информации о выбранном товаре
-    selected_product_info = next((p for p in products if p['id'] == product_id), None)
+    product_id = selected_product_info['id']
+    stock = get_product_stock(product_id) or 0
     
     if selected_product_info:
         col1, col2, col3 = st.columns(3)
         with col1:
             st.write(f"**Price:** {selected_product_info['price']:.2f} ₽")
         with col2:
-            st.write(f"**Stock:** {selected_product_info['quantity']}")
+            st.write(f"**Stock:** {stock}")
         with col3:
-            st.write(f"**Category:** {selected_product_info['category_name']}")
+            st.write(f"**Category:** {' / '.join(catalog.category_path(selected_product_info['category_id']))}")
     
     # Ввод количества
-    quantity = st.number_input("Quantity", min_value=1, max_value=selected_product_info['quantity'] if selected_product_info else 100, value=1)
+    quantity = st.number_input("Quantity", min_value=1, max_value=max(stock, 1), value=1)
     
     if st.button("Add to Order"):
-        if quantity > selected_product_info['quantity']:
-            st.error(f"Not enough stock. Available: {selected_product_info['quantity']}")
+        if quantity > stock:
+            st.error(f"Not enough stock. Available: {stock}")
         else:
             success, message = add_product_to_order(order_id, product_id, quantity)
             if success:
@@ -445,7 +500,12 @@ def add_to_order():
 def show_products():
     st.header("Products Inventory")
     
-    products = get_products()
+    search = st.text_input("Search by name").strip()
+    products = keyset_pages(
+        'products_pages',
+        lambda after: get_products_page(search or None, after),
+        search
+    )
     if products:
         products_df = pd.DataFrame(products)
         st.dataframe(products_df[['name', 'category_name', 'quantity', 'price']])
@@ -469,6 +529,9 @@ def show_customers():
         selected_customer = st.selectbox("Select Customer", 
                                         [f"{c['id']} - {c['name']}" for c in customers])
         customer_id = int(selected_customer.split(' - ')[0])
+        spend = get_customer_spend(customer_id)
+        if spend is not None:
+            st.write(f"**Total spend:** {spend:.2f} ₽")
         
         if st.button("Create New Order"):
             order_id, message = create_order(customer_id)
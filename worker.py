@@ -0,0 +1,283 @@
+"""
+Обработка очереди событий заказов (order_events, migrations/0007_order_events.sql).
+
+Воркер забирает пачки событий через SELECT ... FOR UPDATE SKIP LOCKED,
+выполняет обработчики и удаляет события в той же транзакции, поэтому
+воркеров можно запускать сколько угодно. Пачка, на которой обработчик упал,
+разбирается по одному событию; сбойное событие откладывается с растущей
+паузой, после ORDER_EVENTS_MAX_ATTEMPTS попыток остается в очереди
+с available_at = 'infinity' для разбора вручную.
+
+Запуск: python worker.py           - бесконечный цикл
+        python worker.py --once    - обработать очередь и выйти
+"""
+import argparse
+import json
+import logging
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from prometheus_client import start_http_server
+from psycopg2.extras import RealDictCursor
+
+from config import Config
+from database import Database
+from metrics import (
+    ORDER_EVENTS_FAILED, ORDER_EVENTS_OLDEST_AGE, ORDER_EVENTS_PENDING, ORDER_EVENTS_PROCESSED, timed_step
+)
+
+logger = logging.getLogger(__name__)
+
+# Период обновления метрик глубины очереди, секунды
+STATS_INTERVAL = 5
+
+# Зарегистрированные обработчики: тип события -> [функция(cursor, события)]
+HANDLERS = defaultdict(list)
+
+CLAIM_EVENTS_SQL = """
+    SELECT id, event_type, order_id, product_id, payload, attempts
+    FROM order_events
+    WHERE available_at <= now()
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+
+def handler(*event_types):
+    """Регистрация обработчика событий; функция получает курсор и список событий пачки"""
+    def decorator(func):
+        for event_type in event_types:
+            HANDLERS[event_type].append(func)
+        return func
+    return decorator
+
+
+def event_lines(events):
+    """Приращения по позициям из всех событий пачки"""
+    return [line for event in events for line in event['payload'].get('lines', [])]
+
+
+@handler('item_added', 'item_changed', 'item_removed', 'order_changed', 'order_deleted')
+def update_product_sales(cursor, events):
+    """Сводки продаж товаров по дням и за все время (раньше - триггеры 0002)"""
+    daily, total = defaultdict(int), defaultdict(int)
+    for line in event_lines(events):
+        daily[(line['sale_date'], line['product_id'])] += line['quantity']
+        total[line['product_id']] += line['quantity']
+    # Ключи по возрастанию: параллельные воркеры блокируют строки сводок в одном порядке
+    daily = sorted((key, amount) for key, amount in daily.items() if amount)
+    total = sorted((key, amount) for key, amount in total.items() if amount)
+
+    if daily:
+        cursor.execute("""
+            INSERT INTO product_sales_daily (sale_date, product_id, sold_amount)
+            SELECT d.sale_date, d.product_id, d.amount
+            FROM unnest(%s::date[], %s::int[], %s::bigint[]) AS d(sale_date, product_id, amount)
+            WHERE EXISTS (SELECT 1 FROM products p WHERE p.id = d.product_id)
+            ON CONFLICT (sale_date, product_id)
+            DO UPDATE SET sold_amount = product_sales_daily.sold_amount + EXCLUDED.sold_amount
+        """, ([key[0] for key, _ in daily], [key[1] for key, _ in daily], [amount for _, amount in daily]))
+    if total:
+        cursor.execute("""
+            INSERT INTO product_sales_total (product_id, sold_amount)
+            SELECT t.product_id, t.amount
+            FROM unnest(%s::int[], %s::bigint[]) AS t(product_id, amount)
+            WHERE EXISTS (SELECT 1 FROM products p WHERE p.id = t.product_id)
+            ON CONFLICT (product_id)
+            DO UPDATE SET sold_amount = product_sales_total.sold_amount + EXCLUDED.sold_amount
+        """, ([key for key, _ in total], [amount for _, amount in total]))
+
+
+@handler('item_added', 'item_changed', 'item_removed', 'order_changed', 'order_deleted')
+def update_customer_spend(cursor, events):
+    """Суммы покупок клиентов (0010)"""
+    spend = defaultdict(Decimal)
+    for line in event_lines(events):
+        if line.get('customer_id') is not None:
+            # amount приходит из JSON как float, сумма копится в Decimal без ошибок округления
+            spend[line['customer_id']] += Decimal(str(line['amount']))
+    spend = sorted((key, amount) for key, amount in spend.items() if amount)
+    if spend:
+        cursor.execute("""
+            INSERT INTO customer_spend (customer_id, amount)
+            SELECT s.customer_id, s.amount
+            FROM unnest(%s::int[], %s::numeric[]) AS s(customer_id, amount)
+            WHERE EXISTS (SELECT 1 FROM customers c WHERE c.id = s.customer_id)
+            ON CONFLICT (customer_id)
+            DO UPDATE SET amount = customer_spend.amount + EXCLUDED.amount, updated_at = now()
+        """, ([key for key, _ in spend], [amount for _, amount in spend]))
+
+
+@handler('item_added', 'item_changed')
+def refresh_sharded_stock(cursor, events):
+    """products.quantity товаров с шардированным остатком - сумма шардов (0008)"""
+    product_ids = sorted({event['product_id'] for event in events if event['product_id'] is not None})
+    if not product_ids:
+        return
+    cursor.execute("""
+        UPDATE products p
+        SET quantity = s.total
+        FROM (
+            SELECT product_id, sum(quantity) AS total
+            FROM product_stock_shards
+            WHERE product_id = ANY(%s::int[])
+            GROUP BY product_id
+        ) s
+        WHERE p.id = s.product_id AND p.stock_shards > 0 AND p.quantity <> s.total
+    """, (product_ids,))
+
+
+@handler('order_status_changed')
+def publish_status_changes(cursor, events):
+    """Уведомление подписчиков канала order_status (доставляется после коммита)"""
+    for event in events:
+        cursor.execute("SELECT pg_notify('order_status', %s)", (json.dumps({
+            'order_id': event['order_id'],
+            'old_status': event['payload']['old_status'],
+            'new_status': event['payload']['new_status'],
+        }),))
+
+
+def dispatch(cursor, events):
+    by_handler = {}
+    for event in events:
+        for func in HANDLERS.get(event['event_type'], []):
+            by_handler.setdefault(func, []).append(event)
+    for func, handled in by_handler.items():
+        with timed_step('order_events', func.__name__):
+            func(cursor, handled)
+
+
+def process_batch(cursor, batch_size, claimed):
+    """Захват, обработка и удаление пачки; захваченные события пишутся в claimed"""
+    cursor.execute(CLAIM_EVENTS_SQL, (batch_size,))
+    claimed[:] = cursor.fetchall()
+    if claimed:
+        dispatch(cursor, claimed)
+        cursor.execute("DELETE FROM order_events WHERE id = ANY(%s)", ([event['id'] for event in claimed],))
+
+
+def mark_failed(event, error):
+    """Отложить событие с экспоненциальной паузой или остановить повторы после ORDER_EVENTS_MAX_ATTEMPTS"""
+    attempts = event['attempts'] + 1
+    ORDER_EVENTS_FAILED.labels(event['event_type']).inc()
+    dead = attempts >= Config.ORDER_EVENTS_MAX_ATTEMPTS
+    if dead:
+        logger.error("Order event %s failed %s times, giving up: %s", event['id'], attempts, error)
+    else:
+        logger.warning("Order event %s failed (attempt %s): %s", event['id'], attempts, error)
+
+    with Database.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE order_events
+                SET attempts = %(attempts)s,
+                    last_error = %(error)s,
+                    available_at = CASE WHEN %(dead)s THEN 'infinity'::timestamptz
+                        ELSE now() + %(delay)s * INTERVAL '1 second' END
+                WHERE id = %(id)s
+            """, {
+                'id': event['id'],
+                'attempts': attempts,
+                'error': str(error),
+                'dead': dead,
+                'delay': Config.ORDER_EVENTS_RETRY_DELAY * 2 ** (attempts - 1),
+            })
+        conn.commit()
+
+
+def drain_batch(batch_size):
+    """Обработка одной пачки, возвращает число обработанных событий"""
+    claimed = []
+    try:
+        Database.run_in_transaction(
+            lambda cursor: process_batch(cursor, batch_size, claimed),
+            operation='order_events',
+            cursor_factory=RealDictCursor
+        )
+    except Exception as e:
+        if not claimed:
+            raise
+        if len(claimed) == 1:
+            mark_failed(claimed[0], e)
+            return 0
+        # Сбойное событие неизвестно: пачка разбирается по одному
+        logger.warning("Batch of %s order events failed, retrying one by one: %s", len(claimed), e)
+        return sum(drain_batch(1) for _ in range(len(claimed)))
+
+    for event in claimed:
+        ORDER_EVENTS_PROCESSED.labels(event['event_type']).inc()
+    return len(claimed)
+
+
+def record_queue_stats():
+    with Database.connection(readonly=True) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    count(*) FILTER (WHERE available_at <= now()),
+                    count(*) FILTER (WHERE available_at > now() AND available_at < 'infinity'),
+                    count(*) FILTER (WHERE available_at = 'infinity'),
+                    COALESCE(EXTRACT(EPOCH FROM now() - min(created_at) FILTER (WHERE available_at <= now())), 0)
+                FROM order_events
+            """)
+            ready, delayed, dead, oldest_age = cursor.fetchone()
+        conn.rollback()
+    ORDER_EVENTS_PENDING.labels('ready').set(ready)
+    ORDER_EVENTS_PENDING.labels('delayed').set(delayed)
+    ORDER_EVENTS_PENDING.labels('dead').set(dead)
+    ORDER_EVENTS_OLDEST_AGE.set(float(oldest_age))
+
+
+def drain(batch_size):
+    """Обработка очереди до опустошения, возвращает число событий"""
+    total = 0
+    while True:
+        processed = drain_batch(batch_size)
+        total += processed
+        if processed < batch_size:
+            return total
+
+
+def run_forever(batch_size, poll_interval):
+    stats_at = 0
+    while True:
+        try:
+            processed = drain_batch(batch_size)
+            if time.monotonic() - stats_at >= STATS_INTERVAL:
+                record_queue_stats()
+                stats_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Order events worker error: {e}")
+            processed = 0
+        # Полная пачка - в очереди, вероятно, есть еще события
+        if processed < batch_size:
+            time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='drain the queue and exit')
+    parser.add_argument('--batch-size', type=int, default=Config.ORDER_EVENTS_BATCH_SIZE)
+    parser.add_argument('--metrics-port', type=int, default=Config.WORKER_METRICS_PORT,
+                        help='port for Prometheus metrics, 0 to disable')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    # Соединения по одному: обработка пачки, затем отметка сбоя или статистика очереди
+    Database.init_pool(minconn=1, maxconn=Config.DB_SERVICE_POOL_MAX)
+
+    if args.once:
+        logger.info("Processed %s order events", drain(args.batch_size))
+        record_queue_stats()
+        return
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    run_forever(args.batch_size, Config.ORDER_EVENTS_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()